@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Backfill-aware sizing of the time bins of search jobs.
+
+Search jobs process a fixed number of seconds of data (`SEARCH_PARAMETERS['SMART']['duration']`),
+which with many DM trials makes jobs of many hours, waiting long for whole GPU nodes. Shorter
+time bins make shorter jobs, which the SLURM backfill scheduler can start on the nodes kept idle
+for the pending jobs expected to start later, at the price of more jobs, each with the fixed
+startup cost and the overlap with the previous time bin processed twice.
+
+`choose_duration` picks the duration of the time bins of a DM range, among multiples of `step`
+seconds, minimising the estimated time to complete the search of the observation:
+
+- jobs whose walltime fits in the backfill window start on the idle nodes right away, as many
+  one after the other on each node as fit in the window; the others wait `queue_wait`;
+- at most `max_jobs` jobs run at the same time (the user's share of the queue);
+- only durations using at most `max_overhead` more GPU time than the most efficient one are
+  considered, so that shorter jobs are chosen only where the queue wait they save is worth it;
+  among durations completing within 5% of the best, the one using the least GPU time wins.
+
+The cluster state (idle nodes, backfill window, queue wait) comes from a probe: `SlurmProbe`
+reads `sinfo` and `squeue --start` (commands overridable with BLINK_SINFO and BLINK_SQUEUE),
+`FileProbe` a snapshot of their output saved with `backfill.py snapshot`, to plan or test
+away from the cluster. The window is the time until the earliest expected start of a pending
+job of the partition, when the nodes kept idle for it are taken; the queue wait the time until
+the latest one, after which a new job would start. Alternatively, a fixed goal (e.g. jobs of at
+most 4 hours) can be given as the window, every job then being required to fit in it.
+
+Usage:
+    backfill.py snapshot --partition gpu > cluster_state.json
+    backfill.py show <slurm|cluster_state.json> --partition gpu
+"""
+import argparse
+import json
+import math
+import time
+from collections import namedtuple
+from datetime import datetime
+import slurm
+
+ClusterState = namedtuple('ClusterState', ['idle_nodes', 'window', 'queue_wait'])
+
+# Node states of sinfo in which nodes can start jobs right away.
+IDLE_STATES = ('idle',)
+# Longest walltime of the GPU partitions, window when no job is pending.
+MAX_WINDOW = 86400
+# Share of the best completion time within which durations are considered equivalent.
+COMPLETION_TOLERANCE = 0.05
+
+
+def time_bins(segments : list, duration : int, overlap : int):
+    """
+    Returns the (offset, duration) of the time bins splitting the runs of seconds with complete
+    data `segments`, given as (offset, length) pairs: bins of `duration` seconds overlapping by
+    `overlap` seconds. The last bin of each segment ends with it, never reading past its end.
+    """
+    bins = []
+    for segment_start, segment_length in segments:
+        segment_end = segment_start + segment_length
+        i = segment_start
+        while i < segment_end:
+            if i + duration >= segment_end:
+                bins.append((i, segment_end - i))
+                break
+            bins.append((i, duration))
+            i += duration - overlap
+    return bins
+
+
+
+def parse_time(text : str):
+    """
+    Converts a SLURM timestamp (e.g. 2026-10-18T20:15:00) to a Unix time, None if not a time.
+    """
+    try:
+        return datetime.strptime(text.strip(), "%Y-%m-%dT%H:%M:%S").timestamp()
+    except ValueError:
+        return None
+
+
+
+def parse_cluster_state(node_states : str, expected_starts : str, now : float, max_window : int = MAX_WINDOW):
+    """
+    Returns the cluster state from the output of `sinfo --format=%T|%D` (node state and count)
+    and `squeue --start --format=%S|%D` (expected start and number of nodes of pending jobs).
+    """
+    idle_nodes = 0
+    for line in node_states.splitlines():
+        tokens = line.strip().split('|')
+        if len(tokens) != 2 or not tokens[1].isdigit(): continue
+        if tokens[0].rstrip('*~#').lower() in IDLE_STATES:
+            idle_nodes += int(tokens[1])
+    starts = []
+    for line in expected_starts.splitlines():
+        start = parse_time(line.split('|')[0])
+        if start is not None:
+            starts.append(max(start - now, 0))
+    window = min(min(starts), max_window) if starts else max_window
+    queue_wait = max(starts) if starts else 0
+    return ClusterState(idle_nodes, int(window), int(queue_wait))
+
+
+
+class SlurmProbe:
+    """
+    Cluster state of a partition from sinfo and squeue --start.
+    """
+    def __init__(self, partition : str):
+        self.partition = partition
+
+    def outputs(self):
+        return slurm.node_states(self.partition), slurm.expected_starts(self.partition)
+
+    def state(self):
+        return parse_cluster_state(*self.outputs(), time.time())
+
+
+
+class FileProbe:
+    """
+    Cluster state from a snapshot of the outputs of sinfo and squeue --start, a JSON file with
+    keys `time` (Unix time of the snapshot), `sinfo` and `squeue_start`.
+    """
+    def __init__(self, path : str):
+        self.path = path
+
+    def state(self):
+        with open(self.path) as f:
+            snapshot = json.load(f)
+        return parse_cluster_state(snapshot['sinfo'], snapshot['squeue_start'], snapshot['time'])
+
+
+
+def make_probe(source : str, partition : str):
+    return SlurmProbe(partition) if source == "slurm" else FileProbe(source)
+
+
+
+def completion_time(n_jobs : int, walltime : int, state : ClusterState, max_jobs : int):
+    """
+    Estimated time to run `n_jobs` jobs of the given walltime, at most `max_jobs` at the same time.
+    """
+    nodes = min(state.idle_nodes, max_jobs)
+    backfilled = 0
+    finish = 0
+    if nodes > 0 and walltime <= state.window:
+        per_node = state.window // walltime
+        backfilled = min(n_jobs, nodes * per_node)
+        finish = math.ceil(backfilled / nodes) * walltime
+    rest = n_jobs - backfilled
+    if rest > 0:
+        finish = max(finish, state.queue_wait + math.ceil(rest / max_jobs) * walltime)
+    return finish
+
+
+
+def choose_duration(segments : list, overlap : int, runtime, time_limit, state : ClusterState, max_jobs : int,
+        min_duration : int, max_duration : int, step : int = 60, require_fit : bool = False, max_overhead : float = 0.2):
+    """
+    Returns the duration of the time bins of a DM range minimising the estimated completion time
+    of its jobs (see the module documentation), and the list of candidates evaluated as
+    dictionaries. `runtime(duration)` is the estimated runtime of a job, `time_limit(runtime)` the
+    walltime to request in seconds. With `require_fit`, walltimes must fit in the window.
+    """
+    candidates = []
+    first = max(min_duration, (overlap // step + 1) * step)
+    for duration in sorted(set(list(range(first, max_duration + 1, step)) + [max(max_duration, first)])):
+        bins = time_bins(segments, duration, overlap)
+        walltime = max(time_limit(runtime(x)) for _, x in bins)
+        candidates.append({'duration' : duration, 'jobs' : len(bins), 'walltime' : walltime,
+            'gpu_time' : sum(runtime(x) for _, x in bins), 'fits' : walltime <= state.window,
+            'completion' : completion_time(len(bins), walltime, state, max_jobs)})
+    eligible = [x for x in candidates if x['fits']] if require_fit else candidates
+    if not eligible:
+        print(f"Warning: no time bin duration gives jobs fitting in {slurm.format_time_limit(state.window)}, using the shortest.")
+        eligible = candidates[:1]
+    min_gpu_time = min(x['gpu_time'] for x in eligible)
+    eligible = [x for x in eligible if x['gpu_time'] <= min_gpu_time * (1 + max_overhead)]
+    best = min(x['completion'] for x in eligible)
+    chosen = min([x for x in eligible if x['completion'] <= best * (1 + COMPLETION_TOLERANCE)],
+        key=lambda x : (x['gpu_time'], -x['duration']))
+    return chosen['duration'], candidates
+
+
+
+def print_candidates(dm_range : str, candidates : list, chosen : int):
+    print(f"Time bins of DM range {dm_range}:")
+    print(f"  {'duration':>9} {'jobs':>5} {'walltime':>9} {'GPU-hours':>10} {'completion':>11}")
+    for x in candidates:
+        print(f"  {x['duration']:>9} {x['jobs']:>5} {slurm.format_time_limit(x['walltime']):>9} {x['gpu_time'] / 3600:>10.1f} " \
+            f"{slurm.format_time_limit(x['completion']):>11}{' <' if x['duration'] == chosen else ''}")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe the backfill window of a SLURM partition.")
+    parser.add_argument("command", choices=["snapshot", "show"])
+    parser.add_argument("source", nargs='?', default="slurm", help="show: 'slurm' or a snapshot file.")
+    parser.add_argument("--partition", type=str, default="gpu", help="SLURM partition.")
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        node_states, expected_starts = SlurmProbe(args.partition).outputs()
+        print(json.dumps({'time' : time.time(), 'partition' : args.partition, 'sinfo' : node_states, 'squeue_start' : expected_starts}, indent=1))
+    else:
+        state = make_probe(args.source, args.partition).state()
+        print(f"{state.idle_nodes} idle nodes, backfill window {slurm.format_time_limit(state.window)}, " \
+            f"queue wait {slurm.format_time_limit(state.queue_wait)}")
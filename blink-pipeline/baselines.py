@@ -0,0 +1,162 @@
+"""
+Identify the minimal set of stations to flag so that no baseline longer than a given
+threshold survives.
+
+1. Compute the distance between every pair of stations as one NumPy matrix.
+
+2. Build a graph where each node is a station and there is an edge between two nodes
+if those nodes represent a long baseline.
+
+3. Find a vertex cover of that graph: a set of stations touching every long baseline.
+The greedy cover repeatedly flags the station with the highest number of long baselines,
+using a lazy max-heap instead of rescanning every node. For small graphs the cover is
+refined with an exact branch-and-bound search.
+
+However, it would be better to flag baselines in the imager. This is just a workaround.
+"""
+import heapq
+import numpy as np
+
+# Graphs with at most this many nodes taking part in a long baseline are solved exactly.
+EXACT_COVER_MAX_NODES = 48
+# Maximum number of branch-and-bound steps before settling for the best cover found so far.
+EXACT_COVER_MAX_STEPS = 200000
+
+
+def pairwise_distances(positions):
+    """
+    Return the N x N matrix of distances between the N (East, North, Height) positions given.
+    """
+    pos = np.asarray(positions, dtype=np.float64)
+    squared = np.zeros((len(pos), len(pos)))
+    for x in pos.T:
+        squared += (x[:, np.newaxis] - x[np.newaxis, :])**2
+    return np.sqrt(squared)
+
+
+
+def long_baseline_graph(positions, max_distance):
+    """
+    Return the boolean adjacency matrix of the graph whose edges are baselines
+    longer than `max_distance`.
+    """
+    return pairwise_distances(positions) > max_distance
+
+
+
+def greedy_cover(adjacency):
+    """
+    Iteratively flag the node with highest number of edges, until there are no edges
+    left in the graph between unflagged nodes. Returns the flagged nodes in removal order.
+
+    Node degrees only decrease, so heap entries are upper bounds of the current degree:
+    an entry is re-pushed with the up to date degree when popped, rather than on each update.
+    """
+    adjacency = np.asarray(adjacency, dtype=bool)
+    degree = adjacency.sum(axis=1)
+    heap = [(-d, i) for i, d in enumerate(degree.tolist()) if d > 0]
+    heapq.heapify(heap)
+    cover = []
+    while heap:
+        neg_degree, node = heapq.heappop(heap)
+        current = int(degree[node])
+        if current <= 0: continue
+        if current != -neg_degree:
+            heapq.heappush(heap, (-current, node))
+            continue
+        cover.append(node)
+        degree -= adjacency[node]
+        degree[node] = 0
+    return cover
+
+
+
+def prune_cover(adjacency, cover):
+    """
+    Remove redundant nodes from a cover, i.e. nodes whose neighbours are all flagged anyway.
+    Nodes flagged last are checked first, as they tend to be the ones with fewer edges.
+    """
+    adjacency = np.asarray(adjacency, dtype=bool)
+    in_cover = np.zeros(len(adjacency), dtype=bool)
+    in_cover[list(cover)] = True
+    for node in reversed(cover):
+        if in_cover[adjacency[node]].all():
+            in_cover[node] = False
+    return [x for x in cover if in_cover[x]]
+
+
+
+def exact_cover(adjacency, upper_bound = None, max_steps = EXACT_COVER_MAX_STEPS):
+    """
+    Minimum vertex cover by branch and bound. Branches on the node with most edges: either that
+    node is flagged, or all of its neighbours are. `upper_bound` is a known cover (e.g. the greedy
+    one) used for pruning; if the search exceeds `max_steps` the best cover found so far is returned.
+    """
+    adjacency = np.asarray(adjacency, dtype=bool)
+    nodes = [int(x) for x in np.flatnonzero(adjacency.any(axis=1))]
+    local = {x : i for i, x in enumerate(nodes)}
+    neighbours = []
+    for x in nodes:
+        mask = 0
+        for y in np.flatnonzero(adjacency[x]):
+            mask |= 1 << local[int(y)]
+        neighbours.append(mask)
+
+    if upper_bound is None:
+        upper_bound = prune_cover(adjacency, greedy_cover(adjacency))
+    best = [[local[x] for x in upper_bound]]
+    steps = [0]
+
+    def members(mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def search(active, chosen):
+        steps[0] += 1
+        if steps[0] > max_steps: return
+        degrees = [(bin(neighbours[i] & active).count('1'), i) for i in members(active)]
+        degrees = [x for x in degrees if x[0] > 0]
+        if len(degrees) == 0:
+            if len(chosen) < len(best[0]):
+                best[0] = list(chosen)
+            return
+        max_degree, node = max(degrees)
+        n_edges = sum(d for d, _ in degrees) // 2
+        # each additional flagged node removes at most max_degree edges
+        if len(chosen) + -(-n_edges // max_degree) >= len(best[0]): return
+        # a node with a single edge: flagging its neighbour is never worse
+        pendant = next((i for d, i in degrees if d == 1), None)
+        if pendant is not None:
+            other = next(members(neighbours[pendant] & active))
+            search(active & ~(1 << other), chosen + [other])
+            return
+        search(active & ~(1 << node), chosen + [node])
+        node_neighbours = neighbours[node] & active
+        search(active & ~node_neighbours & ~(1 << node), chosen + list(members(node_neighbours)))
+
+    search((1 << len(nodes)) - 1, [])
+    return sorted(nodes[i] for i in best[0])
+
+
+
+def minimum_cover(adjacency, exact = True):
+    """
+    Return the sorted indices of the nodes to flag so that no edge is left in the graph.
+    The greedy cover is always computed; if `exact` is set and the graph is small enough
+    it is refined with `exact_cover`.
+    """
+    adjacency = np.asarray(adjacency, dtype=bool)
+    cover = prune_cover(adjacency, greedy_cover(adjacency))
+    if exact and np.count_nonzero(adjacency.any(axis=1)) <= EXACT_COVER_MAX_NODES:
+        cover = exact_cover(adjacency, cover)
+    return sorted(cover)
+
+
+
+def long_baseline_cover(positions, max_distance, exact = True):
+    """
+    Indices of the stations to flag such that all baselines longer than `max_distance` are removed.
+    """
+    return minimum_cover(long_baseline_graph(positions, max_distance), exact)
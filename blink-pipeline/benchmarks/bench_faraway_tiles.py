@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Compares the original pure Python long-baseline tile finder with the NumPy/heap based one
+in `baselines.py` on synthetic arrays: a dense core of tiles plus a ring of long baseline tiles,
+similarly to the MWA Phase II extended / Phase III layouts.
+"""
+import argparse
+import os
+import sys
+import time
+from math import sqrt
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from baselines import long_baseline_cover, long_baseline_graph
+
+
+class Graph:
+    """
+    Original implementation, kept as reference.
+    """
+    def __init__(self):
+        self.data = {}
+
+    def add_edge(self, x, y):
+        s1 : set = self.data.setdefault(x, set())
+        s1.add(y)
+        s2 : set = self.data.setdefault(y, set())
+        s2.add(x)
+
+    def reemove_largest_node(self):
+        vals = [(x, len(self.data[x])) for x in self.data]
+        max_node = max(vals, key= lambda x : x[1])
+        neighbours = self.data[max_node[0]]
+        del self.data[max_node[0]]
+        for n in neighbours:
+            self.data[n].remove(max_node[0])
+        return max_node
+
+
+def old_find_faraway_tiles(antenna_pos, max_distance):
+    n_ant = len(antenna_pos)
+
+    def comp_dist(a, b):
+        return sqrt((a[1] - b[1])**2 +  (a[2] - b[2])**2 +  (a[3] - b[3])**2)
+
+    G = Graph()
+    for i in range(n_ant):
+        for j in range(0, i):
+            dist = comp_dist(antenna_pos[i], antenna_pos[j])
+            if dist > max_distance:
+                G.add_edge(antenna_pos[i][0], antenna_pos[j][0])
+
+    flagged_tiles = []
+    while len(G.data) > 0:
+        node_id, neigh_count = G.reemove_largest_node()
+        if neigh_count == 0: break
+        flagged_tiles.append(node_id)
+    return flagged_tiles
+
+
+
+def synthetic_array(n_tiles, n_outliers, core_radius = 250, outer_radius = 2500, seed = 0):
+    """
+    Returns a (n_tiles, 3) array of East, North, Height positions in metres.
+    """
+    rng = np.random.default_rng(seed)
+    n_core = n_tiles - n_outliers
+    radius = np.concatenate([core_radius * np.sqrt(rng.random(n_core)),
+        rng.uniform(core_radius, outer_radius, n_outliers)])
+    angle = rng.uniform(0, 2 * np.pi, n_tiles)
+    height = 377 + rng.normal(0, 1, n_tiles)
+    return np.column_stack([radius * np.cos(angle), radius * np.sin(angle), height])
+
+
+
+def timeit(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the long-baseline tile finder.")
+    parser.add_argument("--sizes", type=int, nargs='*', default=[128, 256, 512], help="Number of tiles of the synthetic arrays.")
+    parser.add_argument("--outliers", type=float, default=0.15, help="Fraction of tiles outside the core.")
+    parser.add_argument("--max-baseline", type=float, default=524.1177408273832, help="Maximum baseline length (metres).")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of repetitions, the best time is reported.")
+    args = parser.parse_args()
+
+    print(f"{'tiles':>6} {'old (s)':>10} {'greedy (s)':>11} {'exact (s)':>10} {'speedup':>8} {'old':>5} {'greedy':>7} {'exact':>6}")
+    for n_tiles in args.sizes:
+        positions = synthetic_array(n_tiles, int(n_tiles * args.outliers))
+        antenna_pos = [(i, *p) for i, p in enumerate(positions.tolist())]
+        old_time, old_cover = timeit(lambda: old_find_faraway_tiles(antenna_pos, args.max_baseline), args.repeat)
+        greedy_time, greedy = timeit(lambda: long_baseline_cover(positions, args.max_baseline, exact=False), args.repeat)
+        exact_time, exact = timeit(lambda: long_baseline_cover(positions, args.max_baseline, exact=True), args.repeat)
+        # sanity check: every cover must remove all the long baselines
+        adjacency = long_baseline_graph(positions, args.max_baseline)
+        for cover in (old_cover, greedy, exact):
+            keep = np.ones(n_tiles, dtype=bool)
+            keep[list(cover)] = False
+            assert not adjacency[np.ix_(keep, keep)].any()
+        print(f"{n_tiles:>6} {old_time:>10.4f} {greedy_time:>11.4f} {exact_time:>10.4f} {old_time / greedy_time:>7.1f}x"
+            f" {len(old_cover):>5} {len(greedy):>7} {len(exact):>6}")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Startup time of the submission scripts, each run in a fresh Python process as on a login node:
+`blink-submit.py --help`, `fix_metafits_time_radec.py --help`, and the parsing of a metafits
+file by `metafits.parse_metafits` (NumPy only reader) compared with astropy, imports included.
+
+The script fails if a submission path imports astropy, or if `blink-submit.py --help` takes
+longer than `--max-seconds`, so that it can be used to catch startup regressions. Without
+`--metafits`, a synthetic metafits file with the TILEDATA columns of MWA files is written
+(with astropy) to a temporary directory.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BLINK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIX_METAFITS_SCRIPT = os.path.join(BLINK_DIR, "..", "wsclean-pipeline", "lib", "fix_metafits_time_radec.py")
+
+FAST_PARSE = """
+import sys, metafits
+record = metafits.parse_metafits(sys.argv[1])
+"""
+
+# original parser, kept as reference
+ASTROPY_PARSE = """
+import sys
+import numpy as np
+from astropy.io import fits
+with fits.open(sys.argv[1]) as hdus:
+    header = {k : v for k, v in hdus[0].header.items() if k not in ('', 'COMMENT', 'HISTORY')}
+    data = hdus[1].data
+    columns = [np.asarray(data[x]) for x in ('Antenna', 'Tile', 'TileName', 'Pol', 'Flag', 'East', 'North', 'Height')]
+"""
+
+
+def synthetic_metafits(path, n_tiles = 128, seed = 0):
+    from astropy.io import fits
+    rng = np.random.default_rng(seed)
+    n_inputs = 2 * n_tiles
+    tile = np.repeat(np.arange(n_tiles), 2)
+    header = fits.Header()
+    for key, value in (('GPSTIME', 1342107776), ('EXPOSURE', 600), ('RA', 120.0), ('DEC', -26.7), ('PROJECT', 'G0057'),
+            ('MODE', 'MWAX_VCS'), ('CHANNELS', ','.join(str(x) for x in range(109, 133))), ('FREQCENT', 154.24),
+            ('BANDWDTH', 30.72), ('FINECHAN', 10.0), ('INTTIME', 0.5), ('ALTITUDE', 70.0), ('AZIMUTH', 0.0)):
+        header[key] = value
+    columns = [
+        fits.Column('Input', 'I', array=np.arange(n_inputs)),
+        fits.Column('Antenna', 'I', array=tile),
+        fits.Column('Tile', 'I', array=1000 + tile),
+        fits.Column('TileName', '8A', array=[f"Tile{x:03d}" for x in tile]),
+        fits.Column('Pol', '1A', array=['X', 'Y'] * n_tiles),
+        fits.Column('Rx', 'I', array=tile // 8),
+        fits.Column('Flag', 'I', array=np.zeros(n_inputs, dtype=int)),
+        fits.Column('Length', '14A', array=['EL_100'] * n_inputs),
+        fits.Column('North', 'E', array=np.repeat(rng.normal(0, 300, n_tiles), 2)),
+        fits.Column('East', 'E', array=np.repeat(rng.normal(0, 300, n_tiles), 2)),
+        fits.Column('Height', 'E', array=np.repeat(377 + rng.normal(0, 1, n_tiles), 2)),
+        fits.Column('Gains', '24I', array=np.full((n_inputs, 24), 64)),
+        fits.Column('Delays', '16I', array=np.zeros((n_inputs, 16), dtype=int)),
+        fits.Column('Calib_Gains', '24E', array=np.ones((n_inputs, 24)))
+    ]
+    fits.HDUList([fits.PrimaryHDU(header=header), fits.BinTableHDU.from_columns(columns, name='TILEDATA')]).writeto(path)
+
+
+
+def run_python(args, repeat):
+    """
+    Best wall time of running Python with the given arguments.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable] + args, cwd=BLINK_DIR, capture_output=True, text=True)
+        best = min(best, time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(args)} failed:\n{result.stderr}")
+    return best
+
+
+
+def imports_astropy(args):
+    """
+    Whether running Python with the given arguments imports astropy (from `-X importtime`).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=BLINK_DIR, capture_output=True, text=True)
+    return any(line.split('|')[-1].strip().startswith('astropy') for line in result.stderr.splitlines() if '|' in line)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the submission scripts.")
+    parser.add_argument("--metafits", type=str, default=None, help="Metafits file to parse. Default: a synthetic one.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs of each command, the best time is reported.")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if blink-submit.py --help takes longer.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        metafits_file = args.metafits
+        if metafits_file is None:
+            metafits_file = os.path.join(tmp_dir, "synthetic.metafits")
+            synthetic_metafits(metafits_file)
+        commands = [
+            ("blink-submit.py --help", ["blink-submit.py", "--help"]),
+            ("fix_metafits_time_radec.py --help", [FIX_METAFITS_SCRIPT, "--help"]),
+            ("python startup", ["-c", "pass"]),
+            ("parse metafits", ["-c", FAST_PARSE, metafits_file]),
+            ("parse metafits (astropy)", ["-c", ASTROPY_PARSE, metafits_file])
+        ]
+        times = {}
+        print(f"{'command':<36} {'time (s)':>9}")
+        for name, command in commands:
+            times[name] = run_python(command, args.repeat)
+            print(f"{name:<36} {times[name]:>9.3f}")
+        print(f"metafits parsing speedup: {times['parse metafits (astropy)'] / times['parse metafits']:.1f}x")
+
+        failures = []
+        for name, command in commands[:2] + commands[3:4]:
+            if imports_astropy(command):
+                failures.append(f"{name} imports astropy")
+    if args.max_seconds is not None and times["blink-submit.py --help"] > args.max_seconds:
+        failures.append(f"blink-submit.py --help took {times['blink-submit.py --help']:.3f} s (limit {args.max_seconds} s)")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
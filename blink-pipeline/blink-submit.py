@@ -1,18 +1,37 @@
 #!/usr/bin/env python3
-from astropy.io import fits
 import argparse
-from itertools import product
+import json
+import math
+from collections import namedtuple
 import os
-from math import sqrt
+import sys
+import time
+import numpy as np
+from baselines import long_baseline_cover, pairwise_distances
+from dispersion import dm_range_overlap, parse_dm_range, dm_trial_runs, split_dm_runs
+from cost_model import CostModel, COMMAND_MARKER, START_MARKER, END_MARKER, GPUS_MARKER, n_dm_trials
+from resume import plan_resume
+from metafits import load_metafits
+from obs_index import build_index, format_gaps
+from timing_report import TIMINGS_FILE_NAME
+import sweep
+from campaign import Campaign, run_campaign
+import packing
+import slurm
+from ledger import Ledger, job_key, LEDGER_FILE_NAME
+from backfill import ClusterState, time_bins, make_probe, choose_duration, print_candidates
+from staging import make_policy, observation_policy, make_output_dir, make_dir_commands, \
+    prefetch_commands, staged_paths, input_paths, wait_commands, stage_out_commands, DEFAULT_LOCAL_DIR
 
 # Script to tile an observation's FoV in smaller chunks
 # for processing with the BLINK pipeline.
 # The following is the maximum baseline length allowed in the MWAX SMART observations.
 MAX_BASELINE_LENGTH = 524.1177408273832
 
-# The following array was needed to manually flag antennas that contributed to long baselines.
-# Now these are automatically identified given the metafits file with the antenna information,
-# and a maximum baseline length. See the `Graph` class below for more info.
+# Tiles flagged in SMART observations to remove the baselines longer than MAX_BASELINE_LENGTH.
+# The minimum vertex cover of `find_faraway_tiles` computes such a set from the tile positions of
+# any metafits file, but it has not been checked against this list on SMART observations yet
+# (see `compare_long_baseline_flagging`), so the list stays the default (--flagging-method).
 SMART_ANTENNAS_OUTSIDE_CORE = [
     "LBF1",
     "LBF2",
@@ -41,10 +60,40 @@ SMART_ANTENNAS_OUTSIDE_CORE = [
 #    "Tile028",
 ]
 
+# Number of GPUs requested by each BLINK job.
+GPUS_PER_JOB = 8
+# Number of CPU cores that go with each GPU (GCD) of a Setonix GPU node.
+CORES_PER_GPU = 8
+# Width in MHz of the fine channels of the combined VCS files, before frequency averaging.
+FINE_CHANNEL_WIDTH = 0.01
+
+# Resources of the CPU jobs reducing dynamic spectra to total power.
+TOTALPOWER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "totalpower.py")
+TOTALPOWER_CPUS = 16
+TOTALPOWER_TIME = "01:00:00"
+
+# Rough startup time (seconds) of a BLINK job, used to size time bins when no cost model is available.
+JOB_STARTUP = 300
+
+# Fields of the timing records (see timing_report.py) that are numbers.
+TIMING_NUMERIC_FIELDS = ('time', 'offset', 'seconds', 'wall', 'cpu', 'input_bytes')
+
+DATA_PATH_PREFIX = f"/scratch/pawsey1154/{os.getenv('USER')}"
+
 GLOBAL_CONFIG = {
-    "data_path_prefix" : f"/scratch/pawsey1154/{os.getenv('USER')}",
+    "data_path_prefix" : DATA_PATH_PREFIX,
     "project_modulepath" : " /software/projects/pawsey1154/setonix/2025.08/modules/zen3/gcc/14.2.0",
-    "user_modulepath" : f"/software/projects/pawsey1154/{os.getenv('USER')}/setonix/2025.08/modules/zen3/gcc/14.2.0"
+    "user_modulepath" : f"/software/projects/pawsey1154/{os.getenv('USER')}/setonix/2025.08/modules/zen3/gcc/14.2.0",
+    # runtime model fitted with cost_model.py, used to set job walltimes when it exists
+    "cost_model" : f"/scratch/pawsey1154/{os.getenv('USER')}/blink_cost_model.json",
+    # Setonix service units charged per GPU (GCD) hour
+    "su_per_gpu_hour" : 64,
+    # CPU partition of the jobs reducing dynamic spectra to total power (see totalpower.py)
+    "cpu_partition" : "work",
+    # node-local storage of the GPU nodes, where jobs stage their inputs and outputs (see staging.py)
+    "node_local_dir" : DEFAULT_LOCAL_DIR,
+    # submitted jobs, so that the same job is not submitted twice (see ledger.py)
+    "ledger" : f"{DATA_PATH_PREFIX}/{LEDGER_FILE_NAME}"
 }
 
 SEARCH_PARAMETERS = {
@@ -74,6 +123,11 @@ SEARCH_PARAMETERS = {
         },
         # number of seconds to process for each job
         'duration' : 600,
+        # the overlap between consecutive time bins is computed for each DM range from the
+        # dispersion delay across the observed band, plus the following number of seconds.
+        'overlap_margin' : 5,
+        # fixed overlap used when the observed band is not known
+        'overlap' : 30,
         # start points within the observation
         # now automatically computed
         # 'offsets' : [0, 1170, 2340, 3510, 4680], # allow 30 seconds overlap
@@ -82,239 +136,1047 @@ SEARCH_PARAMETERS = {
 
 
 
-class Graph:
+def find_faraway_tiles(metafits_file, max_distance, exact = True):
     """
-    The following method identifies the minimal set of stations to be flagged such that
-    all the long baselines are removed, long being an arbitrary threshold.
+    Find all the tiles that make the baseline distance above the maximum allowed.
+    Returns the smallest set of tile names found (see `baselines.py`) whose flagging
+    removes all the long baselines.
+    """
+    metadata = load_metafits(metafits_file)
+    # each tile has two rows in the table, one per polarisation
+    rows = metadata.tiles()
+    cover = long_baseline_cover(metadata.positions[rows], max_distance, exact)
+    return [metadata.tile_names[rows[i]] for i in cover]
+
 
-    1. Build a graph where each node is a station and there is an edge between two nodes
-    if those nodes represent a long baseline.
 
-    2. Sort nodes by number of edges.
+def compare_long_baseline_flagging(metafits_file, max_distance = MAX_BASELINE_LENGTH):
+    """
+    Compares the tiles of SMART_ANTENNAS_OUTSIDE_CORE present in the metafits file with the cover
+    computed by `find_faraway_tiles`. Returns a dictionary with the tile names flagged by either
+    method only, the number of tiles each one flags, and the longest baseline left by each.
+    """
+    metadata = load_metafits(metafits_file)
+    rows = metadata.tiles()
+    names = metadata.tile_names[rows]
+    distances = pairwise_distances(metadata.positions[rows])
+    listed = set(names.tolist()) & set(SMART_ANTENNAS_OUTSIDE_CORE)
+    cover = set(str(x) for x in find_faraway_tiles(metafits_file, max_distance))
+    def longest(flagged):
+        kept = ~np.isin(names, list(flagged))
+        return float(distances[np.ix_(kept, kept)].max()) if kept.any() else 0.0
+    return {'n_tiles' : len(rows), 'list' : len(listed), 'cover' : len(cover), 'only_list' : sorted(listed - cover),
+        'only_cover' : sorted(cover - listed), 'longest_list' : longest(listed), 'longest_cover' : longest(cover)}
 
-    3. Iteratively flag the node/station with highest number of edges, until there are no edges 
-    left in the graph between unflagged nodes.
 
-    However, it would be better to flag baselines in the imager. This is just a workaround.
 
+def print_baseline_lengths(metafits_file, max_distance = MAX_BASELINE_LENGTH):
     """
-    def __init__(self):
-        self.data = {}
-    
-    def add_edge(self, x, y):
-        s1 : set = self.data.setdefault(x, set())
-        s1.add(y)
-        s2 : set = self.data.setdefault(y, set())
-        s2.add(x)
+    Helper function just used for testing. Used to print list of baselines and associated length.
+    """
+    metadata = load_metafits(metafits_file)
+    faraway_tiles = set(find_faraway_tiles(metafits_file, max_distance))
+    rows = np.sort([i for i in metadata.tiles() if metadata.tile_names[i] not in faraway_tiles])
+    antennas = metadata.antenna[rows]
+    distances = pairwise_distances(metadata.positions[rows])
+    i, j = np.tril_indices(len(rows), -1)
+    for k in np.argsort(distances[i, j], kind='stable'):
+        print((antennas[i[k]], antennas[j[k]], distances[i[k], j[k]]))
 
 
-    def reemove_largest_node(self):
-        vals = [(x, len(self.data[x])) for x in self.data]
-        max_node = max(vals, key= lambda x : x[1])
-        neighbours = self.data[max_node[0]]
-        del self.data[max_node[0]]
-        for n in neighbours:
-            self.data[n].remove(max_node[0])
-        return max_node
 
+def get_info_from_metafits(metafits_file, skip_long_baselines = True, maximum_baseline_length = MAX_BASELINE_LENGTH,
+        flagging_method = "list"):
+    """
+    `flagging_method` is how the tiles forming long baselines are found: the SMART_ANTENNAS_OUTSIDE_CORE
+    list (`list`, the threshold is then not used), or the cover of `find_faraway_tiles` (`cover`).
+    """
+    metadata = load_metafits(metafits_file)
+    ra = metadata.header['RA']
+    dec = metadata.header['DEC']
 
-def find_faraway_tiles(metafits_file, max_distance):
+    # now get the antennas that were already flagged
+    flagged_antennas = set(metadata.antenna[metadata.flag > 0].tolist())
+    if skip_long_baselines:
+        # must flag antennas that contribute to generate long baselines.
+        # This is a workaround, we should flag baselines in the gridding code in the imager.
+        if flagging_method == "list":
+            faraway_tiles = set(SMART_ANTENNAS_OUTSIDE_CORE)
+        elif flagging_method == "cover":
+            faraway_tiles = set(find_faraway_tiles(metafits_file, maximum_baseline_length))
+        else:
+            raise ValueError(f"Unknown long baseline flagging method: {flagging_method}")
+        outside_core = set(metadata.antenna[np.isin(metadata.tile_names, list(faraway_tiles))].tolist())
+        flagged_antennas = flagged_antennas.union(outside_core)
+    n_antennas = metadata.n_antennas
+    project = metadata.header['PROJECT']
+    mode = metadata.header['MODE']
+    return project, mode, ra, dec, n_antennas, flagged_antennas
+
+
+SearchCell = namedtuple('SearchCell', ['time_bin', 'dm_bin', 'offset', 'duration', 'dm_range', 'time_limit'])
+
+# Parameters of the BLINK jobs of a submission, built once by `observation_job_params` and changed
+# with `_replace` where a mode needs to (e.g. the phase centre of each tile).
+JobParams = namedtuple('JobParams', ['observation_id', 'n_antennas', 'image_size', 'ra', 'dec', 'reorder', 'time_res',
+    'freq_avg_factor', 'oversampling', 'average_images', 'flagging_threshold', 'flagged_antennas', 'snr', 'dyspec',
+    'slm_partition', 'slm_account', 'dir_postfix', 'file_postfix', 'module', 'dry_run', 'nice', 'bytes_per_second',
+    'totalpower', 'staging'])
+
+# One run of `blink_pipeline`: a single job, a search cell or a tile. `postfix` overrides the postfix
+# of the products in dedispersion mode.
+BlinkRun = namedtuple('BlinkRun', ['params', 'start_offset', 'duration', 'dedisp', 'postfix'], defaults=[None])
+
+
+
+def plan_search(segments, search_parameters : dict, band : tuple = None,
+        selected_time_bins : list = [], selected_dm_bins : list = [], int_offset : int = 0, durations : dict = None):
     """
-    Find all the tiles that make the baseline distance above the maximum allowed.
+    Splits the observation in overlapping time bins and returns the list of search cells,
+    one per selected (DM range, time bin) pair.
+
+    `segments` is the list of (offset, length) of the runs of seconds with complete data (see
+    `obs_index.py`), or the number of seconds of the observation if it has no gaps. Time bins
+    never extend across a gap, and the last time bin of each segment lasts until its end.
+    Time bins are numbered consecutively across segments.
+
+    If the observed `band` (lowest and highest frequency in MHz) is given, the overlap between
+    consecutive time bins of a DM range is the dispersion delay across the band at the highest DM
+    of the range plus a safety margin, otherwise the fixed overlap in `search_parameters` is used.
+
+    `durations` maps DM ranges to the duration of their time bins (see `backfill.py`), by default
+    the one in `search_parameters`.
     """
-    hdus = fits.open(metafits_file)
-    antenna_pos = []
-    for row in hdus[1].data:
-        antenna_pos.append((row['Tilename'], row['East'], row['North'], row['Height']))
-    
-    n_ant = len(antenna_pos)
+    if isinstance(segments, int):
+        segments = [(0, segments)]
+    dm_ranges = search_parameters['dm_range']
+    if len(selected_dm_bins) == 0:
+        selected_dm_bins = list(range(len(dm_ranges)))
+    cells = []
+    for j, dm_range in enumerate(dm_ranges):
+        if j not in selected_dm_bins: continue
+        duration = (durations or {}).get(dm_range, search_parameters['duration'])
+        overlap = time_bin_overlap(search_parameters, dm_range, band)
+        if overlap >= duration:
+            raise ValueError(f"The overlap for DM range {dm_range} ({overlap}s) is not shorter than the time bin duration.")
+        # (offset, duration) of each time bin
+        bins = time_bins(segments, duration, overlap)
 
-    def comp_dist(a, b):
-        return sqrt((a[1] - b[1])**2 +  (a[2] - b[2])**2 +  (a[3] - b[3])**2)
+        time_limit = dm_range_time_limit(search_parameters, dm_range)
+        for i, (offset, curr_duration) in enumerate(bins):
+            if len(selected_time_bins) > 0 and i not in selected_time_bins: continue
+            if curr_duration <= int_offset: continue
+            cells.append(SearchCell(i, j, offset + int_offset, curr_duration - int_offset, dm_range, time_limit))
+    return cells
 
-    G = Graph()
 
-    for i in range(n_ant):
-        for j in range(0, i):
-            dist = comp_dist(antenna_pos[i], antenna_pos[j])
-            if dist > max_distance:
-                G.add_edge(antenna_pos[i][0], antenna_pos[j][0])
-    
-    flagged_tiles = []
-    while True:
-        node_id, neigh_count = G.reemove_largest_node()
-        if neigh_count == 0: break
-        flagged_tiles.append(node_id)
 
-    return flagged_tiles
+def time_bin_overlap(search_parameters : dict, dm_range : str, band : tuple = None):
+    """
+    Overlap in seconds between consecutive time bins of a DM range (see `plan_search`).
+    """
+    if band is None:
+        return search_parameters['overlap']
+    return dm_range_overlap(dm_range, band[0], band[1], search_parameters['overlap_margin'])
 
 
 
-def print_baseline_lengths(metafits_file):
+def dm_range_time_limit(search_parameters : dict, dm_range : str):
     """
-    Helper function just used for testing. Used to print list of baselines and associated length.
+    Walltime of the jobs of a DM range: the configured one, or for other ranges (see
+    `smearing_dm_ranges`) the one of the configured range containing its highest DM, scaled
+    by the ratio of the numbers of DM trials.
     """
-    hdus = fits.open(metafits_file)
-    ra = hdus[0].header['RA']
-    dec = hdus[0].header['DEC']
-    antenna_pos = []
-    for row in hdus[1].data:
-        if row['Tilename'] in SMART_ANTENNAS_OUTSIDE_CORE: continue
-        antenna_pos.append((row['Antenna'], row['East'], row['North'], row['Height']))
-    
-    n_ant = len(antenna_pos)
-    baseline_lengths = []
-    from math import sqrt
+    configured = search_parameters['dmrange_to_timelimit']
+    if dm_range in configured:
+        return configured[dm_range]
+    dm_max = parse_dm_range(dm_range)[1]
+    reference = next((x for x in configured if parse_dm_range(x)[0] <= dm_max <= parse_dm_range(x)[1]), list(configured)[-1])
+    seconds = slurm.parse_time_limit(configured[reference]) * n_dm_trials(dm_range) / n_dm_trials(reference)
+    return slurm.format_time_limit(int(min(max(math.ceil(seconds / 900) * 900, 3600), 86400)))
 
-    def comp_dist(a, b):
-        return sqrt((a[1] - b[1])**2 +  (a[2] - b[2])**2 +  (a[3] - b[3])**2)
 
-    for i in range(n_ant):
-        for j in range(0, i):
-            baseline_lengths.append((antenna_pos[i][0], antenna_pos[j][0], comp_dist(antenna_pos[i], antenna_pos[j])))
-    
-    sorted_lengths = sorted(baseline_lengths, key=lambda x: x[2])
-    for i, v in enumerate(sorted_lengths):
-        print(v)
 
+def smearing_dm_ranges(search_parameters : dict, band : tuple, time_res : float, freq_avg_factor : int,
+        snr_loss : float, n_ranges : int = None):
+    """
+    Returns a copy of `search_parameters` searching the same DMs with a trial grid whose step
+    grows with DM as intra-channel smearing does, for a tolerated fractional `snr_loss` (see
+    `dispersion.dm_trial_runs`), split in `n_ranges` DM ranges (default: as many as configured)
+    with about the same number of trials each.
+    """
+    dm_ranges = search_parameters['dm_range']
+    dm_min = min(parse_dm_range(x)[0] for x in dm_ranges)
+    dm_max = max(parse_dm_range(x)[1] for x in dm_ranges)
+    runs = dm_trial_runs(dm_min, dm_max, band, FINE_CHANNEL_WIDTH * freq_avg_factor, time_res, snr_loss)
+    return dict(search_parameters, dm_range=split_dm_runs(runs, n_ranges or len(dm_ranges)))
 
 
-def get_info_from_metafits(metafits_file, skip_long_baselines = True, maximum_baseline_length = MAX_BASELINE_LENGTH):
-    hdus = fits.open(metafits_file)
-    ra = hdus[0].header['RA']
-    dec = hdus[0].header['DEC']
 
-    # now get the antennas that were already flagged
-    flagged_antennas = set([row['ANTENNA'] for row in hdus[1].data if row['FLAG'] > 0])
-    if skip_long_baselines:
-        # must flag antennas that contribute to generate long baselines.
-        # This is a workaround, we should flag baselines in the gridding code in the imager.
-        if True: # Old method: exclude hardcoded tiles - which works but tedious.
-            outside_core = set()
-            for row in hdus[1].data:
-                if row['TILENAME'] in SMART_ANTENNAS_OUTSIDE_CORE:
-                    outside_core.add(row['ANTENNA'])
-        else:
-            # This is not working properly yet ...
-            outside_core = set(find_faraway_tiles(metafits_file, maximum_baseline_length))
-        flagged_antennas = flagged_antennas.union(outside_core)
-    n_antennas = len(hdus[1].data) // 2
-    project = hdus[0].header['PROJECT']
-    mode = hdus[0].header['MODE']
-    return project, mode, ra, dec, n_antennas, flagged_antennas
+def cell_job_params(cell : SearchCell, image_size : int, oversampling : float, time_res : float,
+        freq_avg_factor : int, n_unflagged_antennas : int):
+    """
+    Parameters of a search cell's job, as used by the cost model.
+    """
+    return {'imgsize' : image_size, 'oversampling' : oversampling, 'duration' : cell.duration,
+        'dm_range' : cell.dm_range, 'time_res' : time_res, 'freq_avg_factor' : freq_avg_factor,
+        'n_antennas' : n_unflagged_antennas}
 
 
-# TODO set proper output log directory / policy
-# TODO print job cost prediction
-
-def submit_job(observation_id : int, n_antennas : int, image_size : int,
-        ra : float, dec : float, reorder : bool, start_offset : int,
-        duration : int, time_res : float, freq_avg_factor : int,
-        oversampling : float, average_images : bool, flagging_threshold : float,
-        flagged_antennas : list, dedisp : str, snr : float, dyspec : str,
-        slm_partition : str, slm_account : str, slm_time : str,
-        dir_postfix : str, file_postfix : str, module : str, dry_run : bool, nice : bool):
-
-    # TODO: make sure the following paths exist
-    # Move FS operations outside?
+
+def walltime_scaled_runtime(cell : SearchCell, search_parameters : dict):
+    """
+    Rough estimate of the runtime of a search cell when no cost model is available, assuming
+    the walltime configured for its DM range is what a full-duration time bin takes.
+    """
+    return slurm.parse_time_limit(cell.time_limit) * cell.duration / search_parameters['duration']
+
+
+
+def startup_scaled_runtime(cell : SearchCell, search_parameters : dict):
+    """
+    Like `walltime_scaled_runtime`, but JOB_STARTUP seconds of the configured walltime do not
+    scale with the duration of the time bin, as needed to compare time bins of different sizes.
+    """
+    reference = slurm.parse_time_limit(dm_range_time_limit(search_parameters, cell.dm_range))
+    return JOB_STARTUP + max(reference - JOB_STARTUP, 0) * cell.duration / search_parameters['duration']
+
+
+
+def adaptive_durations(segments : list, search_parameters : dict, band : tuple, selected_dm_bins : list, runtime, time_limit,
+        state : ClusterState, max_jobs : int, min_duration : int, require_fit : bool, max_overhead : float):
+    """
+    Chooses the duration of the time bins of each selected DM range from the cluster state (see
+    `backfill.py`). `runtime(cell)` is the estimated runtime of a search cell, `time_limit(runtime)`
+    the walltime to request in seconds. Returns a dictionary mapping DM ranges to durations.
+    """
+    print(f"Sizing time bins for {state.idle_nodes} idle nodes, a backfill window of {slurm.format_time_limit(state.window)} " \
+        f"and a queue wait of {slurm.format_time_limit(state.queue_wait)}, at most {max_jobs} jobs at the same time.")
+    durations = {}
+    for j, dm_range in enumerate(search_parameters['dm_range']):
+        if len(selected_dm_bins) > 0 and j not in selected_dm_bins: continue
+        cell_runtime = lambda duration : runtime(SearchCell(0, j, 0, duration, dm_range, None))
+        durations[dm_range], candidates = choose_duration(segments, time_bin_overlap(search_parameters, dm_range, band),
+            cell_runtime, time_limit, state, max_jobs, min_duration, search_parameters['duration'], require_fit=require_fit,
+            max_overhead=max_overhead)
+        print_candidates(dm_range, candidates, durations[dm_range])
+    return durations
+
+
+
+def print_search_summary(cells : list, reference_cells : list, search_parameters : dict, runtime):
+    """
+    Prints the amount of data, GPU time and service units of the planned search, compared to
+    the reference plan using a fixed overlap between time bins. `runtime` is a function returning
+    the estimated runtime in seconds of a search cell.
+    """
+    def gpu_seconds(cells):
+        return sum(GPUS_PER_JOB * runtime(c) for c in cells)
+
+    def service_units(gpu_seconds):
+        return gpu_seconds / 3600 * GLOBAL_CONFIG['su_per_gpu_hour']
+
+    print(f"Search plan: {len(cells)} jobs.")
+    print(f"{'DM range':>12} {'time bins':>10} {'data seconds':>13} {'GPU-seconds':>12} {'SU':>9}")
+    for dm_range in search_parameters['dm_range']:
+        dm_cells = [c for c in cells if c.dm_range == dm_range]
+        if len(dm_cells) == 0: continue
+        dm_gpu_seconds = gpu_seconds(dm_cells)
+        print(f"{dm_range:>12} {len(dm_cells):>10} {sum(c.duration for c in dm_cells):>13} "
+            f"{dm_gpu_seconds:>12.0f} {service_units(dm_gpu_seconds):>9.0f}")
+    total = gpu_seconds(cells)
+    reference = gpu_seconds(reference_cells)
+    print(f"Total estimated GPU-seconds: {total:.0f} (fixed {search_parameters['overlap']}s overlap: {reference:.0f}, "
+        f"saved: {reference - total:.0f})")
+    print(f"Total estimated cost: {service_units(total):.0f} SU")
+
+
+
+def observation_paths(observation_id : int, dir_postfix : str):
+    """
+    Returns a dictionary with the paths of the observation's input files and of the output directory.
+    The input files must exist; the output directory is created when jobs are submitted.
+    """
     observation_path = f"{GLOBAL_CONFIG['data_path_prefix']}/{observation_id}"
-    combined_files_path = f"{observation_path}/combined"
-    metafits_file = f"{observation_path}/{observation_id}.metafits"
+    if not os.path.isdir(observation_path):
+        raise FileNotFoundError(f"The observation's directory {observation_path} does not exist.")
     # find the solution file
     bin_filenames = [x for x in os.listdir(observation_path) if x.endswith(".bin")]
     if len(bin_filenames) == 0:
         raise Exception("No .bin file found in the observation's directory.")
-    solutions_file = f"{observation_path}/{bin_filenames[0]}"
     output_dir = f"{observation_path}_output" #_output_ra{ra:.3f}_dec{dec:.3f}"
     if dir_postfix is not None: output_dir += f"_{dir_postfix}"
-    slurm_out_file = f"{output_dir}/slurm-%A.out"
-    
-    if dedisp is not None:
-        job_title = f"BLINK Dedispersion - {observation_id} - OFFSET {start_offset} - DM range {dedisp}"
-    elif dyspec is not None:
-        job_title = f"BLINK Dynamic Spectrum - {observation_id} - {dyspec}"
-    else:
-        job_title = f"BLINK Imaging - {observation_id}"
-    
-    slurm_sbatch_args = f"--gres=gpu:8 --partition={slm_partition} --job-name=\"{job_title}\" " \
-        f"--account={slm_account}-gpu --output={slurm_out_file} --time={slm_time} --no-requeue "
-    
-    if nice or slm_partition == "mwa-gpu":
-        slurm_sbatch_args += "--nice=1500"
+    paths = {
+        "observation_id" : observation_id,
+        "observation_path" : observation_path,
+        "combined_files_path" : f"{observation_path}/combined",
+        "metafits_file" : f"{observation_path}/{observation_id}.metafits",
+        "solutions_file" : f"{observation_path}/{bin_filenames[0]}",
+        "output_dir" : output_dir
+    }
+    if not os.path.isfile(paths["metafits_file"]):
+        raise FileNotFoundError(f"The observation's metafits file {paths['metafits_file']} does not exist.")
+    if not os.path.isdir(paths["combined_files_path"]):
+        raise FileNotFoundError(f"The observation's directory of voltage files {paths['combined_files_path']} does not exist.")
+    if os.path.exists(output_dir) and not os.path.isdir(output_dir):
+        raise FileExistsError(f"The output directory {output_dir} exists and is not a directory.")
+    return paths
 
-    blink_line = f"blink_pipeline -R {n_antennas} -c {freq_avg_factor} -t {time_res}s -o {output_dir} " \
-        f"-n {image_size} -O {oversampling} -M {metafits_file} {'-r' if reorder else ''} " \
-        f"-s {solutions_file} -b 0 -I {combined_files_path} -X {start_offset}"
-    
-    if average_images:
+
+
+def dedisp_postfix(start_offset : int, dedisp : str):
+    tokens = dedisp.split(':')
+    if len(tokens) != 3:
+        raise ValueError(f"Dedispersion range is malformed: {dedisp}")
+    return f"start_second_{start_offset}_dm_range_{dedisp.replace(':', '_')}"
+
+
+
+def timing_record_command(record : dict, timings_file : str):
+    """
+    Returns a shell command appending a timing record (one JSON object per line, see
+    `timing_report.py`) to `timings_file`. String values containing a `$` are shell
+    expressions evaluated when the command runs, recorded as numbers for the fields
+    in `TIMING_NUMERIC_FIELDS`.
+    """
+    fields, args = [], []
+    for key, value in record.items():
+        if isinstance(value, dict):
+            nested, nested_args = timing_record_command(value, None)
+            fields.append(f'"{key}": {nested}')
+            args += nested_args
+        elif isinstance(value, str) and '$' in value:
+            fields.append(f'"{key}": %s' if key in TIMING_NUMERIC_FIELDS else f'"{key}": "%s"')
+            args.append(f'"{value}"')
+        else:
+            fields.append(f'"{key}": ' + json.dumps(value).replace('%', '%%'))
+    record_format = "{" + ", ".join(fields) + "}"
+    if timings_file is None:
+        return record_format, args
+    return f"printf '{record_format}\\n' {' '.join(args)} >> {timings_file};"
+
+
+
+def blink_job_commands(run : BlinkRun, launcher : str = None, n_gpus : int = GPUS_PER_JOB):
+    """
+    Returns the shell commands of a BLINK run: the `blink_pipeline` invocation, followed by
+    the total power computation in dedispersion + dynamic spectrum mode if its parameters
+    reduce total power on the GPU (see `submit_totalpower_jobs`).
+
+    When generating job array scripts, `start_offset`, `duration`, `dedisp` and `postfix` are
+    shell variable references (strings) resolved at runtime.
+
+    A completed run appends its timing record to `timings.jsonl` in the output directory, with
+    the number of bytes read estimated from `bytes_per_second` (see `obs_index.py`).
+
+    `launcher` (e.g. an `srun` command line) is prepended to the `blink_pipeline` invocation when
+    the job runs on `n_gpus` of the allocation's GPUs only.
+
+    With a `staging` policy (see `staging.py`), the commands of `prefetch_commands` must run
+    before these ones (see `run_commands`). `blink_pipeline` then reads and writes node-local
+    copies, and the products are copied back to the output directory once it ends.
+    """
+    params = run.params
+    start_offset, duration, dedisp = run.start_offset, run.duration, run.dedisp
+    paths = run_paths(run)
+    output_dir = paths["output_dir"]
+    blink_paths = input_paths(params.staging, staged_paths(params.staging, paths))
+    blink_line = f"blink_pipeline -R {params.n_antennas} -c {params.freq_avg_factor} -t {params.time_res}s -o {blink_paths['output_dir']} " \
+        f"-n {params.image_size} -O {params.oversampling} -M {blink_paths['metafits_file']} {'-r' if params.reorder else ''} " \
+        f"-s {blink_paths['solutions_file']} -b 0 -I {blink_paths['combined_files_path']} -X {start_offset}"
+
+    if params.average_images:
         blink_line += " -u"
-    
-    if flagging_threshold > 0:
-        blink_line += f" -f {flagging_threshold}"
 
-    if duration >= 0:
+    if params.flagging_threshold > 0:
+        blink_line += f" -f {params.flagging_threshold}"
+
+    if isinstance(duration, str) or duration >= 0:
         blink_line += f" -Q {duration}"
-    
-    if ra is not None and dec is not None:
-        blink_line +=  f" -P {ra},{dec}"
-    
-    if len(flagged_antennas) > 0:
-        blink_line += f' -A {",".join(str(x) for x in flagged_antennas)}'
-    
+
+    if params.ra is not None and params.dec is not None:
+        blink_line +=  f" -P {params.ra},{params.dec}"
+
+    if len(params.flagged_antennas) > 0:
+        blink_line += f' -A {",".join(str(x) for x in params.flagged_antennas)}'
+
+    postfix = product_postfix(run)
     if dedisp is not None:
-        tokens = dedisp.split(':')
-        if len(tokens) != 3:
-            raise ValueError(f"Dedispersion range is malformed: {dedisp}")
-        postfix = f"start_second_{start_offset}_dm_range_{dedisp.replace(':', '_')}"
-        blink_line += f' -D {dedisp} -S {snr} -p {postfix} '
-
-    if dyspec is not None:
-        if dedisp is None and file_postfix is not None:
-            blink_line += f" -p {file_postfix} "
-        blink_line += f' -d {dyspec} '
-    
-    module_env_setup = f"""
+        blink_line += f' -D {dedisp} -S {params.snr} -p {postfix} '
+
+    if params.dyspec is not None:
+        if dedisp is None and postfix is not None:
+            blink_line += f" -p {postfix} "
+        blink_line += f' -d {params.dyspec} '
+
+    record = {
+        'time' : "${BLINK_T1}", 'obsid' : int(paths['observation_id']), 'offset' : start_offset, 'stage' : "blink_pipeline",
+        'seconds' : duration, 'wall' : "$((BLINK_T1 - BLINK_T0))", 'cpu' : "${BLINK_CPU}",
+        'input_bytes' : f"$(({duration} * {params.bytes_per_second}))" if isinstance(duration, str) else max(duration, 0) * params.bytes_per_second,
+        'node' : "$(hostname)", 'gpus' : n_gpus, 'job_id' : "${SLURM_JOB_ID}", 'module' : params.module,
+        'params' : {'imgsize' : params.image_size, 'oversampling' : params.oversampling, 'dm_range' : dedisp, 'time_res' : params.time_res,
+            'freq_avg_factor' : params.freq_avg_factor, 'n_antennas' : params.n_antennas - len(params.flagged_antennas)}
+    }
+    # markers used to fit the cost model from the job's output (see cost_model.py)
+    commands  = wait_commands(params.staging, paths)
+    commands += f"echo {GPUS_MARKER}{n_gpus}; echo {COMMAND_MARKER} {blink_line}; BLINK_T0=$(date +%s); echo {START_MARKER}$BLINK_T0; "
+    # CPU time of the terminated child processes of the job's shell (or subshell), in clock ticks
+    commands += "BLINK_PID=${BASHPID:-$$}; BLINK_CPU0=$(awk '{ print $16 + $17 }' /proc/$BLINK_PID/stat); "
+    commands += f"{launcher + ' ' if launcher else ''}{blink_line} && BLINK_T1=$(date +%s) && echo {END_MARKER}$BLINK_T1 && "
+    commands += "BLINK_CPU=$(awk -v a=$BLINK_CPU0 -v tck=$(getconf CLK_TCK) '{ printf \"%.2f\", ($16 + $17 - a) / tck }' /proc/$BLINK_PID/stat) && "
+    commands += timing_record_command(record, f"{output_dir}/{TIMINGS_FILE_NAME}")
+    commands += stage_out_commands(params.staging, output_dir, postfix if dedisp is not None else f"start_second_{start_offset}")
+    if params.dyspec is not None and params.totalpower == "gpu":
+        if dedisp is not None:
+            commands += f"cd {output_dir}; ls -1 dynamic_spectrum_*{postfix}.fits > fits_list_{postfix}; test_totalpower fits_list_{postfix};"
+            commands += f"mv dynamic_spectrum_*{postfix}.total_power totalpower_{postfix}.power ;"
+    return commands
+
+
+
+def run_paths(run : BlinkRun):
+    return observation_paths(run.params.observation_id, run.params.dir_postfix)
+
+
+
+def product_postfix(run : BlinkRun):
+    """
+    Postfix of the products of a run: in dedispersion mode the one given by its offset and
+    DM range unless overridden, otherwise `file_postfix`.
+    """
+    if run.dedisp is None:
+        return run.params.file_postfix
+    return run.postfix if run.postfix is not None else dedisp_postfix(run.start_offset, run.dedisp)
+
+
+
+def run_commands(run : BlinkRun, setup : str = "", launcher : str = None, n_gpus : int = GPUS_PER_JOB):
+    """
+    Returns the shell commands of a run in a job: starting the staging of its inputs, then
+    `setup` (e.g. loading the modules, which the copy of the inputs overlaps with), then the
+    commands of `blink_job_commands`.
+    """
+    paths = run_paths(run)
+    return prefetch_commands(run.params.staging, paths, run.start_offset, run.duration) + setup + \
+        blink_job_commands(run, launcher, n_gpus)
+
+
+
+def module_env_setup(module : str):
+    return f"""
     module use {GLOBAL_CONFIG["project_modulepath"]};
     module use {GLOBAL_CONFIG["user_modulepath"]};
     module load {module};
     """
-    
-    wrap_command  = module_env_setup
-    wrap_command += f"{blink_line} ;"
 
-    if dyspec is not None:
-        if dedisp is not None:
-            wrap_command += f"cd {output_dir}; ls -1 dynamic_spectrum_*{postfix}.fits > fits_list_{postfix}; test_totalpower fits_list_{postfix};"
-            wrap_command += f"mv dynamic_spectrum_*{postfix}.total_power totalpower_{start_offset}.power ;"
+
+
+def sbatch_args(job_title : str, slm_partition : str, slm_account : str, slm_time : str, slurm_out_file : str, nice : bool):
+    slurm_sbatch_args = f"--gres=gpu:{GPUS_PER_JOB} --partition={slm_partition} --job-name=\"{job_title}\" " \
+        f"--account={slm_account}-gpu --output={slurm_out_file} --time={slm_time} --no-requeue "
     
-    submit_command_line = f"sbatch {slurm_sbatch_args} --wrap \"{wrap_command}\""
-    print("Submitting BLINK job with the following command:\n" + submit_command_line)
+    if nice or slm_partition == "mwa-gpu":
+        slurm_sbatch_args += "--nice=1500"
+    return slurm_sbatch_args
+
 
+
+def submit_totalpower_job(observation_id : int, job_id : int, output_dir : str, postfixes : list, mode : str,
+        slm_time : str, slm_account : str, nice : bool, dry_run : bool):
+    """
+    Submits a CPU job reducing the dynamic spectra written by the BLINK job `job_id` in
+    `output_dir` to total power (see `totalpower.py`), for the runs with the given postfixes (the
+    ones of the cells the job runs). In `cpu` mode the job starts once the BLINK job has
+    completed successfully, in `follow` mode as soon as it starts, reducing files as they are
+    written, for the walltime `slm_time` of the BLINK job plus one hour.
+    Returns the job ID (None in dry run mode).
+    """
+    command = f"{sys.executable} {TOTALPOWER_SCRIPT} {output_dir} --workers {TOTALPOWER_CPUS}"
+    command += f" --postfix {' '.join(postfixes)}"
+    dependency_id = job_id if job_id is not None else "<job id>"
+    if mode == "follow":
+        command += f" --follow {dependency_id}"
+        dependency = f"after:{dependency_id}"
+        totalpower_time = slurm.format_time_limit(slurm.parse_time_limit(slm_time) + 3600)
+    elif mode == "cpu":
+        dependency = f"afterok:{dependency_id}"
+        totalpower_time = TOTALPOWER_TIME
+    else:
+        raise ValueError(f"Unknown total power reduction mode: {mode}")
+    slurm_sbatch_args = f"--partition={GLOBAL_CONFIG['cpu_partition']} --job-name=\"BLINK Total Power - {observation_id}\" " \
+        f"--account={slm_account} --output={output_dir}/totalpower-%A.out --time={totalpower_time} --ntasks=1 " \
+        f"--cpus-per-task={TOTALPOWER_CPUS} --dependency={dependency} --no-requeue "
+    if nice:
+        slurm_sbatch_args += "--nice=1500 "
+    slurm_sbatch_args += f"--wrap \"{command}\""
+    print("Submitting total power job with the following command:\nsbatch " + slurm_sbatch_args)
     if not dry_run:
-        os.system(submit_command_line)
+        return slurm.sbatch(slurm_sbatch_args)
 
 
 
-def compute_tiling(pc_ra_deg, pc_dec_deg, img_size, tile_size, pix_size_deg):
-    img_pc_pixel_coord = int(img_size / 2)
-    # compute number of tiles
-    n_tiles = int((img_size + tile_size - 1)  / tile_size)
+def submit_totalpower_jobs(job_id : int, runs : list, slm_time : str):
+    """
+    Submits the CPU jobs reducing to total power the dynamic spectra of the given runs of the
+    BLINK job `job_id`, one per output directory, if their parameters do not reduce total power
+    on the GPU (see `submit_totalpower_job`).
+    """
+    output_dirs = {}
+    for run in runs:
+        if run.params.totalpower == "gpu" or run.dedisp is None or run.params.dyspec is None: continue
+        output_dirs.setdefault(run_paths(run)['output_dir'], []).append(run)
+    for output_dir, dir_runs in output_dirs.items():
+        params = dir_runs[0].params
+        submit_totalpower_job(params.observation_id, job_id, output_dir, [product_postfix(x) for x in dir_runs], params.totalpower,
+            slm_time, params.slm_account, params.nice, params.dry_run)
+
+
+
+def dedisp_job_title(observation_id : int, start_offset : int, dedisp : str):
+    return f"BLINK Dedispersion - {observation_id} - OFFSET {start_offset} - DM range {dedisp}"
+
+
+
+def ledger_job(run : BlinkRun):
+    """
+    Returns the key and the parameters identifying a BLINK run in the ledger (see `ledger.py`).
+    """
+    params = run.params
+    paths = run_paths(run)
+    record = {'obsid' : int(paths['observation_id']), 'output_dir' : paths['output_dir'], 'postfix' : product_postfix(run),
+        'offset' : run.start_offset, 'duration' : run.duration, 'dm_range' : run.dedisp, 'imgsize' : params.image_size,
+        'oversampling' : params.oversampling, 'time_res' : params.time_res, 'freq_avg_factor' : params.freq_avg_factor,
+        'n_antennas' : params.n_antennas, 'flagged_antennas' : list(params.flagged_antennas), 'ra' : params.ra, 'dec' : params.dec,
+        'dyspec' : params.dyspec, 'average_images' : params.average_images, 'module' : params.module}
+    return job_key(record), record
+
+
+
+def refresh_ledger(ledger : Ledger, runs : list):
+    """
+    Refreshes the states of the given runs in the ledger (if not None) with a single squeue call.
+    Returns their keys.
+    """
+    keys = [ledger_job(x)[0] for x in runs]
+    if ledger is not None:
+        ledger.refresh(keys)
+    return keys
+
+
+
+def skip_submitted(ledger : Ledger, runs : list):
+    """
+    Returns the indices of the runs to submit: all of them without a ledger, otherwise those
+    not submitted, queued, running or completed yet.
+    """
+    if ledger is None:
+        return list(range(len(runs)))
+    keys = refresh_ledger(ledger, runs)
+    kept = [i for i, key in enumerate(keys) if ledger.should_skip(key, refresh=False) is None]
+    if len(kept) < len(runs):
+        print(f"Skipping {len(runs) - len(kept)} of {len(runs)} jobs already submitted or completed (see ledger.py).")
+    return kept
+
+
+
+def record_submitted(ledger : Ledger, runs : list, job_ids : list, output_files : list):
+    """
+    Records in the ledger (if not None) the runs submitted with the given job IDs (`<job id>_<task>`
+    for array tasks) and SLURM output files.
+    """
+    if ledger is None:
+        return
+    for run, job_id, output_file in zip(runs, job_ids, output_files):
+        key, record = ledger_job(run)
+        ledger.submitted(key, record, job_id, output_file)
+
+
+
+# TODO set proper output log directory / policy
+
+def submit_job(run : BlinkRun, slm_time : str, sweep_tag : str = None, ledger : Ledger = None, refresh : bool = True):
+    """
+    Submits a single BLINK job and returns its SLURM job ID (None in dry run mode, or if the
+    `ledger` shows it was already submitted or completed). `sweep_tag` is the sweep ID and point
+    index of a benchmark job (see `sweep.py`), logged by the job. When submitting many jobs,
+    refresh their states at once (see `refresh_ledger`) and pass `refresh` = False.
+    """
+    params = run.params
+    paths = run_paths(run)
+    slurm_out_file = f"{paths['output_dir']}/slurm-%A.out"
+
+    if sweep_tag is not None:
+        job_title = f"BLINK Benchmark - {params.observation_id} - {sweep_tag}"
+    elif run.dedisp is not None:
+        job_title = dedisp_job_title(params.observation_id, run.start_offset, run.dedisp)
+    elif params.dyspec is not None:
+        job_title = f"BLINK Dynamic Spectrum - {params.observation_id} - {params.dyspec}"
+    else:
+        job_title = f"BLINK Imaging - {params.observation_id}"
+
+    key, _ = ledger_job(run)
+    previous = ledger.should_skip(key, refresh) if ledger is not None else None
+    if previous is not None:
+        print(f"Skipping {job_title}: already {previous['state'].lower()} as job {previous['job_id']} (see ledger.py).")
+        return None
+
+    slurm_sbatch_args = sbatch_args(job_title, params.slm_partition, params.slm_account, slm_time, slurm_out_file, params.nice)
+
+    setup = module_env_setup(params.module)
+    if sweep_tag is not None:
+        setup += f"echo {sweep.SWEEP_MARKER} {sweep_tag};"
+    wrap_command = run_commands(run, setup)
 
-    # pixel (0, 0) RA, DEC - it is going to be our reference point
-    px0_ra = pc_ra_deg - img_pc_pixel_coord * pix_size_deg
-    px0_dec = pc_dec_deg + img_pc_pixel_coord * pix_size_deg
+    # the wrapped commands are evaluated by the job, not by the shell running sbatch
+    for c in ('\\', '"', '$', '`'):
+        wrap_command = wrap_command.replace(c, '\\' + c)
+    slurm_sbatch_args += f" --wrap \"{wrap_command}\""
+    print("Submitting BLINK job with the following command:\nsbatch " + slurm_sbatch_args)
+
+    job_id = None
+    if not params.dry_run:
+        make_output_dir(paths['output_dir'], params.staging)
+        job_id = slurm.sbatch(slurm_sbatch_args)
+        record_submitted(ledger, [run], [job_id], [f"{paths['output_dir']}/slurm-{job_id}.out"])
+    submit_totalpower_jobs(job_id, [run], slm_time)
+    return job_id
+
+
+
+def submit_job_array(params : JobParams, cells : list, throttle : int, ledger : Ledger = None):
+    """
+    Submits the given search cells as SLURM job arrays, one per distinct walltime, except
+    the ones the `ledger` shows were already submitted or completed.
+    For each array a parameter table (one row per cell) and a batch script reading the row
+    selected by SLURM_ARRAY_TASK_ID are written in the `jobs` subdirectory of the output directory.
+    At most `throttle` tasks of each array run at the same time (0 means no limit).
+    Returns the list of array job IDs (empty in dry run mode).
+    """
+    runs = [BlinkRun(params, c.offset, c.duration, c.dm_range) for c in cells]
+    kept = skip_submitted(ledger, runs)
+    if len(kept) == 0:
+        return []
+    paths = observation_paths(params.observation_id, params.dir_postfix)
+    jobs_dir = f"{paths['output_dir']}/jobs"
+    make_output_dir(paths['output_dir'], params.staging)
+    os.makedirs(jobs_dir, exist_ok=True)
+    slurm_out_file = f"{paths['output_dir']}/slurm-%A_%a.out"
+    timestamp = time.strftime("%Y%m%d%H%M%S")
+
+    groups = {}
+    for i in kept:
+        groups.setdefault(cells[i].time_limit, []).append(i)
+
+    # the run of each task, from the row of the parameter table
+    task_run = BlinkRun(params, "${OFFSET}", "${DURATION}", "${DM_RANGE}", "${POSTFIX}")
+    job_ids = []
+    for slm_time, group in groups.items():
+        name = f"array_{timestamp}_{slm_time.replace(':', '')}"
+        table_file = f"{jobs_dir}/{name}.txt"
+        script_file = f"{jobs_dir}/{name}.sh"
+        slurm.write_parameter_table(table_file, ["offset", "duration", "dm_range", "walltime", "time_bin", "dm_bin"],
+            [(c.offset, c.duration, c.dm_range, c.time_limit, c.time_bin, c.dm_bin) for c in [cells[i] for i in group]])
+
+        script  = "#!/bin/bash\n"
+        script += f"# Generated by blink-submit.py: each array task processes one row of {table_file}\n"
+        script += f"PARAMS=( $(awk -v task=${{SLURM_ARRAY_TASK_ID}} '$1 == task {{ print $2, $3, $4 }}' {table_file}) )\n"
+        script += "OFFSET=${PARAMS[0]}\nDURATION=${PARAMS[1]}\nDM_RANGE=${PARAMS[2]}\n"
+        script += "POSTFIX=\"start_second_${OFFSET}_dm_range_${DM_RANGE//:/_}\"\n"
+        script += run_commands(task_run, module_env_setup(params.module)) + "\n"
+        with open(script_file, "w") as f:
+            f.write(script)
+
+        job_title = f"BLINK Dedispersion - {params.observation_id} - array - time limit {slm_time}"
+        slurm_sbatch_args = f"--array={slurm.array_spec(len(group), throttle)} " + \
+            sbatch_args(job_title, params.slm_partition, params.slm_account, slm_time, slurm_out_file, params.nice)
+        print(f"Submitting BLINK job array of {len(group)} tasks with the following command:\nsbatch {slurm_sbatch_args} {script_file}")
+        job_id = None if params.dry_run else slurm.sbatch(slurm_sbatch_args, script_file)
+        group_runs = [runs[i] for i in group]
+        if job_id is not None:
+            job_ids.append(job_id)
+            record_submitted(ledger, group_runs, [f"{job_id}_{k}" for k in range(len(group))],
+                [f"{paths['output_dir']}/slurm-{job_id}_{k}.out" for k in range(len(group))])
+        submit_totalpower_jobs(job_id, group_runs, slm_time)
+    return job_ids
+
+
+
+def submit_packed(params : JobParams, cells : list, runtimes : list, gpus_per_cell : int, capacity : float, time_limit,
+        ledger : Ledger = None):
+    """
+    Packs the given search cells into allocations of GPUS_PER_JOB GPUs, each running several cells
+    at the same time as `srun` steps on `gpus_per_cell` GPUs (see `packing.py`), and submits them.
+    Cells the `ledger` shows were already submitted or completed are skipped.
+    `runtimes` are the predicted runtimes of the cells on `gpus_per_cell` GPUs, `capacity` the
+    maximum predicted runtime of an allocation and `time_limit` a function returning the walltime
+    (in seconds) to request for a predicted runtime. The batch scripts are written in the `jobs`
+    subdirectory of the output directory, and the output of each cell goes to its own
+    `slurm-<job id>_cell<n>.out` file. Returns the list of job IDs (empty in dry run mode) and
+    the list of cells too long to be packed.
+    """
+    if GPUS_PER_JOB % gpus_per_cell != 0:
+        raise ValueError(f"The number of GPUs per cell must divide {GPUS_PER_JOB}.")
+    n_lanes = GPUS_PER_JOB // gpus_per_cell
+    runs = [BlinkRun(params, c.offset, c.duration, c.dm_range) for c in cells]
+    kept = skip_submitted(ledger, runs)
+    cells, runtimes, runs = [cells[i] for i in kept], [runtimes[i] for i in kept], [runs[i] for i in kept]
+    paths = observation_paths(params.observation_id, params.dir_postfix)
+    jobs_dir = f"{paths['output_dir']}/jobs"
+    make_output_dir(paths['output_dir'], params.staging)
+    os.makedirs(jobs_dir, exist_ok=True)
+    timestamp = time.strftime("%Y%m%d%H%M%S")
+    launcher = f"srun --exact -n 1 -c {CORES_PER_GPU * gpus_per_cell} --gres=gpu:{gpus_per_cell}"
+
+    allocations, oversized = packing.pack(runtimes, n_lanes, capacity)
+    job_ids = []
+    for k, lanes in enumerate(allocations):
+        script_file = f"{jobs_dir}/pack_{timestamp}_{k}.sh"
+        script  = "#!/bin/bash\n"
+        script += f"# Generated by blink-submit.py: {sum(len(x) for x in lanes)} search cells in {n_lanes} lanes of {gpus_per_cell} GPUs\n"
+        script += module_env_setup(params.module) + "\n"
+        for lane in lanes:
+            if len(lane) == 0: continue
+            script += "(\n"
+            for i in lane:
+                commands = run_commands(runs[i], launcher=launcher, n_gpus=gpus_per_cell)
+                script += f"    {{ {commands} }} > {paths['output_dir']}/slurm-${{SLURM_JOB_ID}}_cell{i}.out 2>&1\n"
+            script += ") &\n"
+        script += "wait\n"
+        with open(script_file, "w") as f:
+            f.write(script)
+
+        slm_time = slurm.format_time_limit(time_limit(packing.allocation_runtime(lanes, runtimes)))
+        job_title = f"BLINK Dedispersion - {params.observation_id} - pack {k} - {sum(len(x) for x in lanes)} cells"
+        slurm_sbatch_args = sbatch_args(job_title, params.slm_partition, params.slm_account, slm_time,
+            f"{paths['output_dir']}/slurm-%A.out", params.nice) + f" --ntasks={n_lanes} --cpus-per-task={CORES_PER_GPU * gpus_per_cell}"
+        print(f"Submitting BLINK packed job of {sum(len(x) for x in lanes)} cells with the following command:\nsbatch {slurm_sbatch_args} {script_file}")
+        job_id = None if params.dry_run else slurm.sbatch(slurm_sbatch_args, script_file)
+        packed = [i for lane in lanes for i in lane]
+        if job_id is not None:
+            job_ids.append(job_id)
+            record_submitted(ledger, [runs[i] for i in packed], [job_id] * len(packed),
+                [f"{paths['output_dir']}/slurm-{job_id}_cell{i}.out" for i in packed])
+        submit_totalpower_jobs(job_id, [runs[i] for i in packed], slm_time)
+
+    busy = sum(runtimes[i] for lanes in allocations for lane in lanes for i in lane)
+    allocated = sum(packing.allocation_runtime(lanes, runtimes) * n_lanes for lanes in allocations)
+    if allocated > 0:
+        print(f"Packed {len(cells) - len(oversized)} cells in {len(allocations)} allocations, "
+            f"estimated GPU utilisation {busy / allocated:.0%}.")
+    return job_ids, [cells[i] for i in oversized]
+
+
+
+def submit_sweep(params : JobParams, spec_file : str, base : dict, cost_model : CostModel,
+        slm_time : str, ledger : Ledger = None):
+    """
+    Submits one benchmark job per point of the sweep described in `spec_file` (see `sweep.py`),
+    in an output directory named after the sweep ID, and writes the sweep manifest there.
+    `base` holds the values of the axes not swept. Returns the output directory.
+    """
+    spec = sweep.load_spec(spec_file)
+    sweep_id = sweep.make_sweep_id(spec)
+    points = sweep.expand_sweep(spec, base)
+    paths = observation_paths(params.observation_id, sweep_id)
+    make_output_dir(paths['output_dir'], params.staging)
+
+    # extra antennas to flag, in order
+    flagged = list(params.flagged_antennas)
+    metadata = load_metafits(paths['metafits_file'])
+    candidates = [x for x in np.unique(metadata.antenna).tolist() if x not in flagged]
+    print(f"Sweep {sweep_id}: {len(points)} jobs of {spec['duration']} seconds.")
+    for point in points:
+        if point['extra_flagged'] > len(candidates):
+            raise ValueError(f"Cannot flag {point['extra_flagged']} more antennas, only {len(candidates)} are not flagged.")
+        point_params = params._replace(dir_postfix=sweep_id, image_size=point['imgsize'], oversampling=point['oversampling'],
+            time_res=point['time_res'], freq_avg_factor=point['freq_avg'], average_images=point['avg_images'], dyspec=None,
+            flagged_antennas=flagged + candidates[:point['extra_flagged']])
+        point['n_antennas'] = point_params.n_antennas - len(point_params.flagged_antennas)
+        time_limit = slm_time
+        if time_limit is None and cost_model is not None:
+            time_limit = slurm.format_time_limit(cost_model.time_limit({'imgsize' : point['imgsize'], 'oversampling' : point['oversampling'],
+                'duration' : spec['duration'], 'dm_range' : point['dm_range'], 'time_res' : point['time_res'],
+                'freq_avg_factor' : point['freq_avg'], 'n_antennas' : point['n_antennas']}))
+        run = BlinkRun(point_params, spec['offset'], spec['duration'], point['dm_range'],
+            f"{dedisp_postfix(spec['offset'], point['dm_range'])}_point{point['index']}")
+        point['job_id'] = submit_job(run, time_limit if time_limit is not None else "01:00:00",
+            sweep_tag=f"{sweep_id} {point['index']}", ledger=ledger)
+
+    sweep.write_manifest(paths['output_dir'], {'sweep_id' : sweep_id, 'observation_id' : params.observation_id, 'spec' : spec,
+        'duration' : spec['duration'], 'gpus_per_job' : GPUS_PER_JOB, 'module' : params.module, 'points' : points})
+    print(f"Sweep manifest written in {paths['output_dir']}. Once the jobs ran: sweep.py report {paths['output_dir']}")
+    return paths['output_dir']
+
+
+
+def compute_tiling(pc_ra_deg, pc_dec_deg, img_size, tile_size, pix_size_deg, projection = 'SIN'):
+    """
+    Returns the phase centres (RA, Dec in degrees, one row per tile) of the tiles of side
+    `tile_size` pixels covering an image of side `img_size` pixels, centred on the given phase
+    centre with pixels of side `pix_size_deg`. Pixel offsets are coordinates in the plane tangent
+    to the sky at the phase centre, in orthographic (SIN, as imaged from interferometric data)
+    or gnomonic (TAN) projection. Tiles beyond the horizon of a SIN image have NaN coordinates.
+    """
+    n_tiles = (img_size + tile_size - 1) // tile_size
+    # offsets of the tile centres from the image centre, in pixels
+    centres = np.arange(n_tiles) * tile_size + tile_size // 2 - img_size // 2
+    x, y = np.meshgrid(centres, centres, indexing='ij')
+    # RA increases with x, Dec decreases with y
+    l = np.deg2rad(x.ravel() * pix_size_deg)
+    m = -np.deg2rad(y.ravel() * pix_size_deg)
+    if projection == 'SIN':
+        with np.errstate(invalid='ignore'):
+            n = np.sqrt(1 - l**2 - m**2)
+    elif projection == 'TAN':
+        norm = np.sqrt(1 + l**2 + m**2)
+        l, m, n = l / norm, m / norm, 1 / norm
+    else:
+        raise ValueError(f"Unknown projection: {projection}")
+    ra0, dec0 = np.deg2rad(pc_ra_deg), np.deg2rad(pc_dec_deg)
+    dec = np.arcsin(m * np.cos(dec0) + n * np.sin(dec0))
+    ra = ra0 + np.arctan2(l, n * np.cos(dec0) - m * np.sin(dec0))
+    return np.column_stack([np.rad2deg(ra) % 360, np.rad2deg(dec)])
+
+
+
+def default_pixel_size(band : tuple, max_baseline : float, oversampling : float):
+    """
+    Pixel size in degrees sampling the longest baseline at the highest observed frequency
+    at the Nyquist rate, divided by the oversampling factor.
+    """
+    wavelength = 299.792458 / band[1]
+    return float(np.rad2deg(wavelength / (2 * max_baseline) / oversampling))
+
+
+
+def tile_dir_postfix(dir_postfix : str, tile : int):
+    return f"{dir_postfix}_tile{tile}" if dir_postfix is not None else f"tile{tile}"
+
+
+
+def submit_tiles(params : JobParams, tiles : np.ndarray, tiles_per_job : int, start_offset : int, duration : int,
+        dedisp : str, slm_time : str, ledger : Ledger = None):
+    """
+    Images each of the given tiles (see `compute_tiling`) as an image of side `image_size`
+    phase centred on the tile, with its products in its own output directory (`tile<n>` is
+    appended to the directory postfix). The field phase centre `ra`, `dec` is not used.
+
+    With `tiles_per_job` = 1 each tile is submitted as a single job. Otherwise each job images
+    `tiles_per_job` tiles at the same time, as `srun` steps sharing the GPUs of the allocation,
+    from a batch script written in the `jobs` subdirectory of the field's output directory.
+    Tiles the `ledger` shows were already submitted or completed are skipped.
+    Returns the list of job IDs (empty in dry run mode).
+    """
+    runs = [BlinkRun(params._replace(ra=tile_ra, dec=tile_dec, dir_postfix=tile_dir_postfix(params.dir_postfix, i)),
+        start_offset, duration, dedisp) for i, (tile_ra, tile_dec) in enumerate(tiles)]
+    if tiles_per_job == 1:
+        job_ids = [submit_job(run, slm_time, ledger=ledger) for run in runs]
+        return [x for x in job_ids if x is not None]
+
+    if GPUS_PER_JOB % tiles_per_job != 0:
+        raise ValueError(f"The number of tiles per job must divide {GPUS_PER_JOB}.")
+    gpus = GPUS_PER_JOB // tiles_per_job
+    launcher = f"srun --exact -n 1 -c {CORES_PER_GPU * gpus} --gres=gpu:{gpus}"
+    kept = skip_submitted(ledger, runs)
+    if len(kept) == 0:
+        return []
+    field_dir = observation_paths(params.observation_id, params.dir_postfix)["output_dir"]
+    jobs_dir = f"{field_dir}/jobs"
+    make_output_dir(field_dir, params.staging)
+    os.makedirs(jobs_dir, exist_ok=True)
+    timestamp = time.strftime("%Y%m%d%H%M%S")
+    job_ids = []
+    for k in range(0, len(kept), tiles_per_job):
+        job_tiles = kept[k:k + tiles_per_job]
+        script_file = f"{jobs_dir}/tiles_{timestamp}_{k // tiles_per_job}.sh"
+        script  = "#!/bin/bash\n"
+        script += f"# Generated by blink-submit.py: tiles {', '.join(str(x) for x in job_tiles)}, {gpus} GPUs each\n"
+        script += module_env_setup(params.module) + "\n"
+        for i in job_tiles:
+            output_dir = run_paths(runs[i])['output_dir']
+            script += make_dir_commands(output_dir, params.staging) + "\n"
+            script += f"( {run_commands(runs[i], launcher=launcher, n_gpus=gpus)} ) > {output_dir}/slurm-${{SLURM_JOB_ID}}.out 2>&1 &\n"
+        script += "wait\n"
+        with open(script_file, "w") as f:
+            f.write(script)
+
+        job_title = f"BLINK Imaging - {params.observation_id} - tiles {job_tiles[0]} to {job_tiles[-1]}"
+        slurm_sbatch_args = sbatch_args(job_title, params.slm_partition, params.slm_account, slm_time, f"{field_dir}/slurm-%A.out", params.nice) + \
+            f" --ntasks={tiles_per_job} --cpus-per-task={CORES_PER_GPU * gpus}"
+        print(f"Submitting BLINK job of {len(job_tiles)} tiles with the following command:\nsbatch {slurm_sbatch_args} {script_file}")
+        job_id = None if params.dry_run else slurm.sbatch(slurm_sbatch_args, script_file)
+        if job_id is not None:
+            job_ids.append(job_id)
+            record_submitted(ledger, [runs[i] for i in job_tiles], [job_id] * len(job_tiles),
+                [f"{run_paths(runs[i])['output_dir']}/slurm-{job_id}.out" for i in job_tiles])
+        submit_totalpower_jobs(job_id, [runs[i] for i in job_tiles], slm_time)
+    return job_ids
+
+
+
+def observation_job_params(observation_id : int, args : dict):
+    """
+    Reads the metadata and the data index of an observation, and returns the parameters of
+    its BLINK jobs (see `JobParams`) given the command line options, and the data index.
+    """
+    paths = observation_paths(observation_id, None)
+    project, mode, pc_ra_deg, pc_dec_deg, n_antennas, flagged_antennas = get_info_from_metafits(paths['metafits_file'],
+        not args['long'], args['max_baseline'], args['flagging_method'])
+    
+    reorder = not mode == 'MWAX_VCS' 
+
+    if args['no_flags']:
+        flagged_antennas = []
     
+    if args['centre'] is not None:
+        tokens = args['centre'].split(',')
+        if len(tokens) != 2: raise ValueError("Phase centre spec is malformed.")
+        pc_ra_deg, pc_dec_deg = float(tokens[0]), float(tokens[1])
+
+    index = build_index(paths['combined_files_path'])
+    metadata = load_metafits(paths['metafits_file'])
+    if all(x in metadata.header for x in ('CHANNELS', 'GPSTIME', 'EXPOSURE')):
+        # channels and seconds missing from the directory altogether are gaps too
+        index = index.with_expected(metadata.coarse_channels(), *metadata.gps_span())
+    else:
+        print("Warning: the metafits file does not give the observation's channels and time span, " \
+            "only the files present are checked for gaps.")
+
+    params = JobParams(observation_id=observation_id, n_antennas=n_antennas, image_size=args["imgsize"], ra=pc_ra_deg,
+        dec=pc_dec_deg, reorder=reorder, time_res=args["time_res"], freq_avg_factor=args["freq_avg"],
+        oversampling=args["oversampling"], average_images=args["avg_images"], flagging_threshold=args["img_flag"],
+        flagged_antennas=sorted(flagged_antennas), snr=args["snr"], dyspec=args["dyspec"], slm_partition=args["partition"],
+        slm_account=args["account"], dir_postfix=args["dir_postfix"], file_postfix=args["file_postfix"], module=args["module"],
+        dry_run=args["dry_run"], nice=args["nice"], bytes_per_second=int(index.expected_size() * len(index.channels)),
+        totalpower=args["totalpower"],
+        staging=observation_policy(make_policy(args["stripe_count"], args["stripe_size"], args["stripe_pool"], args["stage_inputs"],
+            args["stage_outputs"], args["bundle_size"], args["local_dir"], backend=args["fs_backend"]),
+            observation_id, index.start_gps, index.channels))
+    return params, index
+
+
+
+def plan_observation(observation_id : int, args : dict, params : JobParams, index, cost_model : CostModel):
+    """
+    Plans the search of an observation given the command line options. Returns the search
+    cells (with walltimes predicted by the cost model if not None), the reference cells (see
+    `print_search_summary`), the search parameters, the parameters of the search jobs (`params`
+    with the image size, oversampling and dynamic spectrum of the search), and a function
+    returning the estimated runtime of a cell.
+    """
+    segments = index.complete_segments(args["min_segment"])
+    print(f"The observation's number of seconds is {index.n_seconds}, {len(index.channels)} coarse channels.")
+    gaps = format_gaps(index)
+    if len(gaps) > 0:
+        print("Skipping the seconds (offsets) with missing or incomplete data: " + ", ".join(gaps))
+    if index.missing_before > 0:
+        print(f"No data for the first {index.missing_before} seconds of the observation, offsets count from GPS time {index.start_gps}.")
+    band = load_metafits(observation_paths(observation_id, None)['metafits_file']).observed_band()
+    print(f"The observed band is {band[0]:.2f} - {band[1]:.2f} MHz")
+    search_parameters = SEARCH_PARAMETERS['SMART']
+    if args['dm_plan'] is not None:
+        search_parameters = smearing_dm_ranges(search_parameters, band, args['time_res'], args['freq_avg'], args['dm_plan'], args['dm_ranges'])
+        print(f"DM plan for a S/N loss of {args['dm_plan']:.0%}: {sum(n_dm_trials(x) for x in search_parameters['dm_range'])} trials " \
+            f"(configured: {sum(n_dm_trials(x) for x in SEARCH_PARAMETERS['SMART']['dm_range'])}) in the DM ranges " \
+            + ", ".join(search_parameters['dm_range']))
+    img_size = search_parameters['imgsize']
+    oversampling = search_parameters['oversampling']
+    n_unflagged_antennas = params.n_antennas - len(params.flagged_antennas)
+    def cell_params(cell):
+        return cell_job_params(cell, img_size, oversampling, args["time_res"], args["freq_avg"], n_unflagged_antennas)
+
+    durations = None
+    if args['backfill_window'] is not None or args['cluster_probe'] is not None:
+        if cost_model is not None:
+            runtime = lambda cell : cost_model.predict(cell_params(cell))
+            time_limit = cost_model.padded_time_limit
+        else:
+            runtime = lambda cell : startup_scaled_runtime(cell, search_parameters)
+            time_limit = lambda r : int(min(max(math.ceil(r / 900) * 900, 900), 86400))
+        if args['cluster_probe'] is not None:
+            state = make_probe(args['cluster_probe'], args['partition']).state()
+        else:
+            # only the goal: as many idle nodes as jobs allowed at the same time
+            state = ClusterState(args['max_queued'], 86400, 0)
+        if args['backfill_window'] is not None:
+            state = state._replace(window=min(state.window, slurm.parse_time_limit(args['backfill_window'])))
+        durations = adaptive_durations(segments, search_parameters, band, args["dm_bins"], runtime, time_limit, state,
+            args['max_queued'], args['min_bin_duration'], args['backfill_window'] is not None, args['max_bin_overhead'])
 
-    def compute_tile_pc_coord(t_x, t_y):
-        tile_pc_pixel_x = t_x * tile_size + int(tile_size / 2)
-        tile_pc_pixel_y = t_y * tile_size + int(tile_size / 2)
-        tile_pc_ra = px0_ra + tile_pc_pixel_x * pix_size_deg
-        tile_pc_dec = px0_dec - tile_pc_pixel_y * pix_size_deg
-        return tile_pc_ra, tile_pc_dec
+    cells = plan_search(segments, search_parameters, band, args["time_bins"], args["dm_bins"], args["int_offset"], durations)
+    reference_cells = plan_search(segments, search_parameters, None, args["time_bins"], args["dm_bins"], args["int_offset"])
+    if args['resume']:
+        output_dir = observation_paths(observation_id, args["dir_postfix"])["output_dir"]
+        remaining = plan_resume(cells, output_dir)
+        skipped = sum(c.duration for c in cells) - sum(c.duration for c in remaining)
+        print(f"Resuming from {output_dir}: {len(remaining)} of {len(cells)} jobs left, {skipped} seconds of data already processed.")
+        cells = remaining
+    search_params = params._replace(image_size=img_size, oversampling=oversampling, dyspec=f"{img_size//2},{img_size//2}")
 
-    tile_side_coord = list(range(n_tiles))
-    coords = [compute_tile_pc_coord(x, y) for x, y in product(tile_side_coord, tile_side_coord)]
-    return coords
+    if cost_model is not None:
+        runtime = lambda cell : cost_model.predict(cell_params(cell))
+        cells = [c._replace(time_limit=slurm.format_time_limit(cost_model.time_limit(cell_params(c)))) for c in cells]
+    elif durations is not None:
+        # walltimes of the configured time bin duration do not apply
+        cells = [c._replace(time_limit=slurm.format_time_limit(time_limit(runtime(c)))) for c in cells]
+    else:
+        runtime = lambda cell : walltime_scaled_runtime(cell, search_parameters)
+    return cells, reference_cells, search_parameters, search_params, runtime
+
+
+
+def read_obsid_list(path : str):
+    """
+    Reads a list of observations, one `<obsid> [priority]` per line (lower priorities are
+    submitted first, default 0). Returns a list of (obsid, priority) pairs.
+    """
+    observations = []
+    with open(path) as f:
+        for line in f:
+            tokens = line.split('#')[0].split()
+            if len(tokens) == 0: continue
+            observations.append((int(tokens[0]), int(tokens[1]) if len(tokens) > 1 else 0))
+    return observations
+
+
+
+def submit_campaign(args : dict, cost_model : CostModel, ledger : Ledger = None):
+    """
+    Plans the search of each observation listed in the `--campaign` file, or resumes the campaign
+    from its state file, and submits its cells through the queue-aware scheduler of `campaign.py`.
+    """
+    state_file = args['campaign_state'] or args['campaign'] + ".state.json"
+    if os.path.exists(state_file):
+        campaign = Campaign.load(state_file)
+        print(f"Resuming the campaign in {state_file}: {campaign.summary()}")
+    else:
+        observations, cells = {}, []
+        for observation_id, priority in read_obsid_list(args['campaign']):
+            print(f"Planning the search of observation {observation_id}.")
+            params, index = observation_job_params(observation_id, args)
+            obs_cells, _, _, search_params, runtime = plan_observation(observation_id, args, params, index, cost_model)
+            observations[observation_id] = {'job_params' : search_params._asdict()}
+            cells += [{'obsid' : observation_id, 'offset' : c.offset, 'duration' : c.duration, 'dm_range' : c.dm_range,
+                'time_limit' : c.time_limit, 'priority' : priority, 'cost' : GPUS_PER_JOB * runtime(c)} for c in obs_cells]
+        # nothing is recorded in dry run mode
+        campaign = Campaign.create(None if args['dry_run'] else state_file, observations, cells)
+        print(f"Campaign of {len(observations)} observations, {len(cells)} jobs, estimated cost " \
+            f"{sum(c['cost'] for c in cells) / 3600 * GLOBAL_CONFIG['su_per_gpu_hour']:.0f} SU.")
+
+    def cell_run(cell):
+        params = JobParams(**campaign.observations[str(cell['obsid'])]['job_params'])._replace(dry_run=args['dry_run'])
+        return BlinkRun(params, cell['offset'], cell['duration'], cell['dm_range'])
+
+    def submit(cell):
+        return submit_job(cell_run(cell), cell['time_limit'], ledger=ledger, refresh=False)
+
+    # the cells left to submit are looked up in the ledger as of the start of the campaign
+    refresh_ledger(ledger, [cell_run(x) for x in campaign.cells if x['status'] in ('pending', 'submitting')])
+
+    def job_name(cell):
+        return dedisp_job_title(cell['obsid'], cell['offset'], cell['dm_range'])
+
+    run_campaign(campaign, submit, job_name, args['max_queued'], args['poll_interval'], once=args['once'] or args['dry_run'])
 
 
 
@@ -323,14 +1185,19 @@ if __name__ == "__main__":
 
     # Observation information
     parser.add_argument("--obsid", type=str, help="Observation ID", default="1192477696")
-    parser.add_argument("--pixsize", type=float, default=None, help="Size of a pixel (side) in degrees.")
+    parser.add_argument("--pixsize", type=float, default=None, help="Size of a pixel (side) in degrees, used in tiling mode. " \
+                        "Default: Nyquist sampling of the longest baseline at the highest frequency, divided by the oversampling factor.")
     parser.add_argument("--mwax", action='store_true', help="It is an MWAX observation.")
     parser.add_argument("--no-flags", action='store_true', help="Do NOT flag bad tiles.")
 
     # BLINK pipeline args
     parser.add_argument("--offset", type=int, default=0, help="Number of seconds to skip from the start of the observations.")
     parser.add_argument("--duration", type=int, default=-1, help="Number of seconds to process. Default: all seconds.")
-    parser.add_argument("--tilesize", type=int, default=-1, help="Enable FoV tiling by specifying the size of the tile (side).")
+    parser.add_argument("--tilesize", type=int, default=-1, help="Enable FoV tiling by specifying the size of the tile (side). " \
+                        "The field of side --imgsize is imaged as tiles of this size, each phase centred on the tile.")
+    parser.add_argument("--tiles-per-job", type=int, default=1, help="In tiling mode, number of tiles imaged at the same time by each job, " \
+                        "sharing its GPUs (must divide 8).")
+    parser.add_argument("--projection", type=str, default="SIN", choices=["SIN", "TAN"], help="In tiling mode, projection of the field image.")
     parser.add_argument("--imgsize", type=int, default=256, help="Size of the image (side, e.g. 4096)")
     parser.add_argument("--centre", type=str, default=None, help="Specify phase centre coordinates in RA,DEC degrees.")
     parser.add_argument("--snr", type=float, default=7, help="SNR threshold for detections in dedispersion mode.")
@@ -343,86 +1210,176 @@ if __name__ == "__main__":
     # execution modes
     parser.add_argument("--dyspec", type=str, default=None, help="Enable dynamic spectrum mode by passing pixels coordinates (x1,y1:x2,y2:x3,y3).")
     parser.add_argument("--dedisp", type=str, default=None, help="Enable dedispersion mode by passing the DM range in the format min:max:step (e.g. 50:60:1)")
+    parser.add_argument("--totalpower", type=str, default="gpu", choices=["gpu", "cpu", "follow"], help="Where to reduce dynamic spectra " \
+                        "to total power in dedispersion + dynamic spectrum mode: within the GPU job (gpu), in a CPU job once it completed (cpu), " \
+                        "or in a CPU job reducing files while it runs (follow). See totalpower.py.")
     parser.add_argument("--dry-run", action='store_true', help="Do not actually submit jobs.")
     parser.add_argument("--dir-postfix", type=str, default=None, help="Adds the specified postfix to the output directory.")
     parser.add_argument("--file-postfix", type=str, default=None, help="Adds the specified postfix to the output files.")
     parser.add_argument("--search", action='store_true', help="Run an FRB search over the entire parameter space.")
     parser.add_argument("--time-bins", type=int, default=[], nargs='*', help="Limit the search to the specified time intevals. Intervals are specified with 0-based indexing.")
+    parser.add_argument("--array", action='store_true', help="In search mode, submit the search cells as SLURM job arrays, one per walltime.")
+    parser.add_argument("--array-throttle", type=int, default=0, help="Maximum number of tasks of a job array running at the same time (0: no limit).")
+    parser.add_argument("--sweep", type=str, default=None, help="Benchmark mode: submit the short jobs of the parameter sweep described in " \
+                        "this JSON file (see sweep.py). Axes not swept take the values of the corresponding options.")
+    parser.add_argument("--pack", action='store_true', help="In search mode, run several search cells at the same time in each allocation, " \
+                        "on --pack-gpus GPUs each, packed by predicted runtime.")
+    parser.add_argument("--pack-gpus", type=int, default=2, help="Number of GPUs of each search cell in packing mode.")
+    parser.add_argument("--pack-scaling", type=float, default=1.0, help="In packing mode, the runtime of a cell on fewer GPUs is assumed " \
+                        "to grow as (8 / GPUs)^scaling. 1 is linear growth, lower values suit cells that do not keep 8 GPUs busy.")
+    parser.add_argument("--pack-time", type=str, default="24:00:00", help="Maximum walltime of a packed allocation.")
+    parser.add_argument("--dm-plan", type=float, default=None, help="In search mode, replace the configured DM ranges with a trial grid " \
+                        "whose step grows with DM, tolerating this fractional S/N loss (e.g. 0.1) from smearing and DM step.")
+    parser.add_argument("--dm-ranges", type=int, default=None, help="Number of DM ranges of the --dm-plan grid. Default: as many as configured.")
+    parser.add_argument("--campaign", type=str, default=None, help="Campaign mode: search the observations listed in this file " \
+                        "(one '<obsid> [priority]' per line), submitting jobs as the queue has room (see campaign.py).")
+    parser.add_argument("--campaign-state", type=str, default=None, help="State file of the campaign, from which an interrupted " \
+                        "campaign resumes. Default: the campaign file name followed by .state.json.")
+    parser.add_argument("--max-queued", type=int, default=20, help="In campaign mode, maximum number of the user's jobs pending or running. " \
+                        "Also the number of jobs assumed to run at the same time when sizing time bins.")
+    parser.add_argument("--poll-interval", type=float, default=300, help="In campaign mode, seconds between checks of the queue.")
+    parser.add_argument("--once", action='store_true', help="In campaign mode, fill the queue once and exit, e.g. to run from cron.")
+    parser.add_argument("--stripe-count", type=int, default=None, help="Create the output directories with this Lustre stripe count " \
+                        "(-1: all OSTs), see staging.py.")
+    parser.add_argument("--stripe-size", type=str, default=None, help="Lustre stripe size of the output directories (e.g. 1M).")
+    parser.add_argument("--stripe-pool", type=str, default=None, help="Lustre OST pool of the output directories (e.g. flash).")
+    parser.add_argument("--stage-inputs", action='store_true', help="Copy the input files of the seconds processed by each job to " \
+                        "node-local storage while the job starts up.")
+    parser.add_argument("--stage-outputs", action='store_true', help="Write the products of each job to node-local storage and copy " \
+                        "them back to the output directory when it ends.")
+    parser.add_argument("--bundle-size", type=int, default=1048576, help="With --stage-outputs, bundle the products smaller than " \
+                        "this (bytes) in one tar archive per job, except the ones read by resume.py, totalpower.py and candidates.py (0: no bundling).")
+    parser.add_argument("--local-dir", type=str, default=GLOBAL_CONFIG["node_local_dir"], help="Node-local directory where jobs stage files.")
+    parser.add_argument("--fs-backend", type=str, default=os.getenv("BLINK_FS_BACKEND", "lustre"), choices=["lustre", "none"],
+                        help="Filesystem backend applying the striping options: lustre (lfs setstripe) or none (e.g. for testing off Lustre).")
     parser.add_argument("--dm-bins", type=int,default=[],  nargs='*', help="Limit the search to the specified DM intevals. Intervals are specified with 0-based indexing.")
     parser.add_argument("--module", type=str, default="blink-pipeline-gpu/main", help="LMOD module to load the BLINK-pipeline.")
     parser.add_argument("--int-offset", type=int, default=0, help="Skip the specified number of initial seconds within a time bin. " \
                         "Useful for check-pointing, when a job goes in time out. For instance, an internal offset of 500 in the time bin 1 " \
                         "Will start the processing at second 570 + 500 = 1070, and also shorten the duration of the same amount.")
+    parser.add_argument("--resume", action='store_true', help="In search mode, only submit the parts of the search not processed yet, " \
+                        "as found in the output directory. Replaces the manual use of --int-offset.")
+    parser.add_argument("--backfill-window", type=str, default=None, help="In search mode, choose the duration of the time bins " \
+                        "of each DM range so that jobs fit in backfill holes of this length (e.g. 04:00:00), see backfill.py.")
+    parser.add_argument("--cluster-probe", type=str, default=None, help="In search mode, choose the duration of the time bins from the " \
+                        "state of the partition: 'slurm' (sinfo and squeue --start) or a snapshot file written by backfill.py.")
+    parser.add_argument("--min-bin-duration", type=int, default=120, help="Shortest time bin duration (seconds) with --backfill-window " \
+                        "or --cluster-probe.")
+    parser.add_argument("--max-bin-overhead", type=float, default=0.2, help="With --backfill-window or --cluster-probe, maximum fraction " \
+                        "of extra GPU time (job startup, overlaps) of shorter time bins, compared to the most efficient duration.")
+    parser.add_argument("--min-segment", type=int, default=1, help="In search mode, do not search runs of consecutive seconds with complete data " \
+                        "shorter than this (seconds).")
     parser.add_argument("--long", action='store_true', help="DO NOT discard longer baselines.")
+    parser.add_argument("--max-baseline", type=float, default=MAX_BASELINE_LENGTH, help="With --flagging-method cover, flag the tiles " \
+                        "forming baselines longer than this (metres).")
+    parser.add_argument("--flagging-method", type=str, default="list", choices=["list", "cover"], help="How the tiles forming long " \
+                        "baselines are found: the list of SMART tiles outside the core, or the smallest set of tiles removing the " \
+                        "baselines longer than --max-baseline (see baselines.py).")
+    parser.add_argument("--compare-flagging", action='store_true', help="Compare the tiles flagged by both --flagging-method " \
+                        "on the observation's metafits file and exit.")
     # SLURM configuratino options
     parser.add_argument("--partition", default="gpu", type=str, help="Setonix GPU partition where to submit the job")
     parser.add_argument("--account", default="pawsey1154", type=str, help="Setonix account billed for the job.")
-    parser.add_argument("--time", type=str, default="24:00:00", help="Slurm job walltime.")
+    parser.add_argument("--time", type=str, default=None, help="Slurm job walltime. Default: predicted by the cost model if available, otherwise 24:00:00.")
+    parser.add_argument("--cost-model", type=str, default=GLOBAL_CONFIG["cost_model"], help="Runtime model fitted with cost_model.py, used to predict walltimes and costs.")
     parser.add_argument("--nice", action='store_true', help="Pass the --nice option to SLURM to artificially lower the priority.")
+    parser.add_argument("--ledger", type=str, default=GLOBAL_CONFIG["ledger"], help="Ledger of the submitted jobs: jobs already submitted, " \
+                        "queued, running or completed are skipped (see ledger.py).")
+    parser.add_argument("--no-ledger", action='store_true', help="Do not use the ledger (jobs are neither skipped nor recorded).")
+    parser.add_argument("--resubmit", action='store_true', help="Submit the jobs found in the ledger anyway (they are still recorded).")
 
     args = vars(parser.parse_args())
-    
-    metafits_file = f"{GLOBAL_CONFIG['data_path_prefix']}/{args['obsid']}/{args['obsid']}.metafits"
-    project, mode, pc_ra_deg, pc_dec_deg, n_antennas, flagged_antennas = get_info_from_metafits(metafits_file, not args['long'])
-    farway_tiles = find_faraway_tiles(metafits_file, MAX_BASELINE_LENGTH)
-    
-    reorder = not mode == 'MWAX_VCS' 
 
-    if args['no_flags']:
-        flagged_antennas = []
-    
-    if args['centre'] is not None:
-        tokens = args['centre'].split(',')
-        if len(tokens) != 2: raise ValueError("Phase centre spec is malformed.")
-        pc_ra_deg, pc_dec_deg = float(tokens[0]), float(tokens[1])
-    
+    if args['compare_flagging']:
+        metafits_file = observation_paths(args['obsid'], None)['metafits_file']
+        comparison = compare_long_baseline_flagging(metafits_file, args['max_baseline'])
+        print(f"{comparison['n_tiles']} tiles. List: {comparison['list']} flagged, longest baseline left " \
+            f"{comparison['longest_list']:.1f} m. Cover: {comparison['cover']} flagged, longest baseline left {comparison['longest_cover']:.1f} m.")
+        print(f"Flagged by the list only: {', '.join(comparison['only_list']) or 'none'}")
+        print(f"Flagged by the cover only: {', '.join(comparison['only_cover']) or 'none'}")
+        raise SystemExit(0)
+
+    if args['tilesize'] > 0 and (args['search'] or args['sweep'] is not None):
+        raise ValueError("FoV tiling is not supported in search and sweep modes.")
+
+    cost_model = None
+    if args["cost_model"] is not None and os.path.exists(args["cost_model"]):
+        cost_model = CostModel.load(args["cost_model"])
+        print(f"Using cost model {args['cost_model']} (fitted on {cost_model.n_records} jobs).")
+
+    ledger = None if args['no_ledger'] else Ledger(args['ledger'], args['resubmit'])
+
+    if args['campaign'] is not None:
+        submit_campaign(args, cost_model, ledger)
+        raise SystemExit(0)
 
-    if args['search']:
-        observation_path = f"{GLOBAL_CONFIG['data_path_prefix']}/{args['obsid']}"
-        combined_files_path = f"{observation_path}/combined"
-
-        dat_files = [x for x in os.listdir(combined_files_path) if x.endswith(".dat")]
-        n_seconds = len(dat_files) // 24
-        print("The observation's number of seconds is", n_seconds)
-        duration = SEARCH_PARAMETERS['SMART']['duration']
-        offsets = []
-        # TODO: compute overlap by DM
-        overlap = 30
-        i = 0
-        while i < n_seconds:
-            offsets.append(i)
-            i += duration - overlap
-        
-        dm_ranges =  SEARCH_PARAMETERS['SMART']['dm_range']
-        selected_time_bins = args["time_bins"]
-        selected_dm_bins = args["dm_bins"]
-
-        if len(selected_time_bins) == 0:
-            selected_time_bins = list(range(len(offsets)))
-        if len(selected_dm_bins) == 0:
-            selected_dm_bins = list(range(len(dm_ranges)))
-        for j, dm_range in enumerate(dm_ranges):
-            if j not in selected_dm_bins: continue
-            for i, offset in enumerate(offsets):
-                if i not in selected_time_bins: continue
-                curr_duration = -1 if (i == len(offsets) - 1) else duration
-                ioff = args["int_offset"]
-                curr_duration -= ioff
-                offset += ioff
-                img_size = SEARCH_PARAMETERS['SMART']['imgsize']
-                time_limit = SEARCH_PARAMETERS['SMART']['dmrange_to_timelimit'][dm_range]
-                submit_job(args["obsid"], n_antennas, img_size, pc_ra_deg, pc_dec_deg, 
-                    reorder,
-                    offset, curr_duration, args["time_res"], args["freq_avg"], SEARCH_PARAMETERS['SMART']['oversampling'],
-                    args["avg_images"], args["img_flag"], flagged_antennas, dm_range,
-                    args["snr"], f"{img_size//2},{img_size//2}", args["partition"], args["account"], time_limit,
-                    args["dir_postfix"], args["file_postfix"], args["module"], args["dry_run"], args["nice"])
-        
-        # TODO: add estimate of cost in SU in printed summary
+    params, index = observation_job_params(args['obsid'], args)
+    metafits_file = observation_paths(args['obsid'], None)['metafits_file']
+    n_unflagged_antennas = params.n_antennas - len(params.flagged_antennas)
+
+    if args['sweep'] is not None:
+        base = {'imgsize' : args['imgsize'], 'oversampling' : args['oversampling'], 'freq_avg' : args['freq_avg'],
+            'time_res' : args['time_res'], 'avg_images' : args['avg_images'], 'extra_flagged' : 0,
+            'dm_trials' : n_dm_trials(args['dedisp']) if args['dedisp'] is not None else 100}
+        submit_sweep(params, args['sweep'], base, cost_model, args['time'], ledger)
+    elif args['search']:
+        cells, reference_cells, search_parameters, search_params, runtime = plan_observation(args['obsid'], args, params, index, cost_model)
+
+        if args['pack']:
+            runtimes = [packing.scaled_runtime(runtime(c), args['pack_gpus'], GPUS_PER_JOB, args['pack_scaling']) for c in cells]
+            max_seconds = slurm.parse_time_limit(args['pack_time'])
+            if cost_model is not None:
+                time_limit = lambda r : cost_model.padded_time_limit(r, max_seconds=max_seconds)
+                capacity = max_seconds / cost_model.padding()
+            else:
+                # runtimes already estimated from walltimes
+                time_limit = lambda r : min(max_seconds, int(np.ceil(r / 900) * 900))
+                capacity = max_seconds
+            _, oversized = submit_packed(search_params, cells, runtimes, args['pack_gpus'], capacity, time_limit, ledger)
+            runs = [BlinkRun(search_params, c.offset, c.duration, c.dm_range) for c in oversized]
+            refresh_ledger(ledger, runs)
+            for run, cell in zip(runs, oversized):
+                submit_job(run, cell.time_limit, ledger=ledger, refresh=False)
+        elif args['array']:
+            submit_job_array(search_params, cells, args["array_throttle"], ledger)
+        else:
+            runs = [BlinkRun(search_params, c.offset, c.duration, c.dm_range) for c in cells]
+            refresh_ledger(ledger, runs)
+            for run, cell in zip(runs, cells):
+                submit_job(run, cell.time_limit, ledger=ledger, refresh=False)
+        print_search_summary(cells, reference_cells, search_parameters, runtime)
     else:
+        tiled = args["tilesize"] > 0
+        image_size = args["tilesize"] if tiled else args["imgsize"]
+        time_limit = args["time"]
+        if cost_model is not None and args["duration"] >= 0:
+            job_cost_params = {'imgsize' : image_size, 'oversampling' : args["oversampling"], 'duration' : args["duration"],
+                'dm_range' : args["dedisp"], 'time_res' : args["time_res"], 'freq_avg_factor' : args["freq_avg"],
+                'n_antennas' : n_unflagged_antennas}
+            predicted = cost_model.predict(job_cost_params)
+            if tiled:
+                # tiles sharing a job get a fraction of its GPUs each
+                predicted = packing.scaled_runtime(predicted, GPUS_PER_JOB // args["tiles_per_job"], GPUS_PER_JOB)
+            print(f"Predicted runtime: {predicted:.0f} s, cost: {GPUS_PER_JOB * predicted / 3600 * GLOBAL_CONFIG['su_per_gpu_hour']:.0f} SU" + \
+                (" per job" if tiled else ""))
+            if time_limit is None:
+                time_limit = slurm.format_time_limit(cost_model.padded_time_limit(predicted))
+        if time_limit is None:
+            time_limit = "24:00:00"
 
-        submit_job(args["obsid"], n_antennas, args["imgsize"], pc_ra_deg, pc_dec_deg, reorder,
-            args["offset"], args["duration"], args["time_res"], args["freq_avg"], args["oversampling"],
-            args["avg_images"], args["img_flag"], flagged_antennas, args["dedisp"],
-            args["snr"], args["dyspec"], args["partition"], args["account"], args["time"],
-            args["dir_postfix"], args["file_postfix"], args["module"], args["dry_run"], args["nice"])
+        if tiled:
+            pix_size = args["pixsize"]
+            if pix_size is None:
+                metadata = load_metafits(metafits_file)
+                max_baseline = pairwise_distances(metadata.positions[metadata.tiles()]).max() if args["long"] else args["max_baseline"]
+                pix_size = default_pixel_size(metadata.observed_band(), max_baseline, args["oversampling"])
+            tiles = compute_tiling(params.ra, params.dec, args["imgsize"], args["tilesize"], pix_size, args["projection"])
+            visible = np.isfinite(tiles).all(axis=1)
+            if not visible.all():
+                print(f"Skipping {np.count_nonzero(~visible)} tiles beyond the horizon.")
+            print(f"Imaging a field of {args['imgsize']} pixels of {pix_size * 3600:.1f} arcsec as {np.count_nonzero(visible)} " \
+                f"tiles of {args['tilesize']} pixels, {args['tiles_per_job']} per job.")
+            submit_tiles(params._replace(image_size=image_size), tiles[visible], args["tiles_per_job"], args["offset"],
+                args["duration"], args["dedisp"], time_limit, ledger)
+        else:
+            submit_job(BlinkRun(params, args["offset"], args["duration"], args["dedisp"]), time_limit, ledger=ledger)
@@ -0,0 +1,116 @@
+"""
+Queue-aware submission of the search cells of many observations over a long campaign.
+
+A campaign is planned once (see `blink-submit.py --campaign`) into a state file listing, for
+each observation, the parameters of its jobs and, for each search cell, its priority (lower
+first), predicted cost in GPU-seconds and submission status:
+
+- `pending`: not submitted yet;
+- `submitting`: being submitted, recorded before calling sbatch so that an interruption at
+  that point does not submit the job twice: on the next run the cell is matched by job name
+  against the queue, and goes back to `pending` if it is not there;
+- `queued`: submitted, with its job ID;
+- `finished`: its job left the queue.
+
+`run_campaign` keeps at most `max_queued` of the user's jobs (of this campaign or not) pending
+or running: at each poll of the queue it submits the pending cells with the lowest priority
+and then the lowest cost, until the queue is full. The state file is rewritten after every
+change, so that the campaign can be interrupted and resumed at any time. The queue is read
+through a function returning the user's jobs like `slurm.squeue` (e.g. the `fake_slurm`
+stand-in, through BLINK_SQUEUE).
+"""
+import json
+import os
+import time
+import slurm
+
+STATUSES = ('pending', 'submitting', 'queued', 'finished')
+
+
+class Campaign:
+    def __init__(self, path : str, observations : dict, cells : list):
+        self.path = path
+        # observation ID (string) -> {'job_params' : parameters of its search jobs (see blink-submit.py)}
+        self.observations = observations
+        self.cells = cells
+
+    @staticmethod
+    def create(path : str, observations : dict, cells : list):
+        """
+        Creates a campaign from the parameters of each observation and a list of cells as
+        dictionaries with at least `obsid`, `offset`, `duration`, `dm_range`, `time_limit`,
+        `priority` and `cost`.
+        """
+        for i, cell in enumerate(cells):
+            cell.update(id=i, status='pending', job_id=None, job_name=None, submit_time=None, end_time=None)
+        campaign = Campaign(path, {str(k) : v for k, v in observations.items()}, cells)
+        campaign.save()
+        return campaign
+
+    @staticmethod
+    def load(path : str):
+        with open(path) as f:
+            state = json.load(f)
+        return Campaign(path, state['observations'], state['cells'])
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({'observations' : self.observations, 'cells' : self.cells}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def count(self, status : str):
+        return sum(1 for c in self.cells if c['status'] == status)
+
+    def next_cells(self, n : int):
+        pending = [c for c in self.cells if c['status'] == 'pending']
+        return sorted(pending, key=lambda c : (c['priority'], c['cost'], c['id']))[:max(n, 0)]
+
+    def refresh(self, jobs : list):
+        """
+        Updates the status of the submitted cells from the jobs in the queue.
+        """
+        by_id = {str(j['job_id']) : j for j in jobs}
+        by_name = {j['name'] : j for j in jobs}
+        now = time.time()
+        for cell in self.cells:
+            if cell['status'] == 'submitting':
+                job = by_name.get(cell['job_name'])
+                if job is None:
+                    cell['status'] = 'pending'
+                else:
+                    cell.update(status='queued', job_id=int(job['job_id']))
+            elif cell['status'] == 'queued' and str(cell['job_id']) not in by_id:
+                cell.update(status='finished', end_time=now)
+        self.save()
+
+    def summary(self):
+        return ", ".join(f"{self.count(x)} {x}" for x in STATUSES if self.count(x) > 0)
+
+
+
+def run_campaign(campaign : Campaign, submit, job_name, max_queued : int, poll_interval : float = 300,
+        queue = slurm.squeue, user : str = None, once : bool = False):
+    """
+    Submits the cells of the campaign, keeping at most `max_queued` of the user's jobs in the
+    queue, until all cells have been submitted and have left the queue (or after one pass if
+    `once`). `submit(cell)` submits a cell and returns its job ID, `job_name(cell)` returns the
+    name of its job.
+    """
+    user = user or os.getenv("USER")
+    while True:
+        jobs = queue(user=user)
+        campaign.refresh(jobs)
+        submitted = campaign.next_cells(max_queued - len(jobs))
+        for cell in submitted:
+            cell.update(status='submitting', job_name=job_name(cell))
+            campaign.save()
+            cell.update(status='queued', job_id=submit(cell), submit_time=time.time())
+            campaign.save()
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {len(jobs) + len(submitted)} jobs in the queue, "
+            f"{len(submitted)} submitted, cells: {campaign.summary()}", flush=True)
+        if once or campaign.count('pending') + campaign.count('queued') == 0:
+            break
+        time.sleep(poll_interval)
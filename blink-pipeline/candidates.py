@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Merge the detections of all the jobs of a search into one ranked candidate list per observation.
+
+The jobs of a search process overlapping time bins of the same observation for several DM
+ranges, possibly in several output directories (`--dir-postfix`), so the same pulse is
+detected by more than one job, and at neighbouring DM trials. Detection files are text
+files (by default the `*cand*.txt` files of the output directories) whose first line names
+the columns, e.g. `# time dm snr x y`. Recognised columns (and aliases) are:
+
+- `time` (`t`): seconds from the start of the job, whose start second is taken from the
+  product postfix in the file name (see `resume.py`), or `obs_time`: seconds from the start
+  of the observation;
+- `dm`, `snr` (`sigma`);
+- `ra`, `dec` in degrees, or `x`, `y` in pixels (`pix_x`, `pix_y`).
+
+The detections of each observation are read one file at a time into a columnar store
+(`<store>/<obsid>.npz`, one array per column, sorted by time), rebuilt only when its detection
+files change. Detections close in time, DM and position are then clustered (friends of friends)
+and each cluster is reported once, by its brightest detection, in `<store>/<obsid>_candidates.txt`,
+ranked by S/N. Only one observation is held in memory at a time.
+
+Usage:
+    candidates.py <output dirs, or directories containing them> [--store candidates] [--time-tol 0.5] [--dm-tol 5] [--pos-tol 2]
+"""
+import argparse
+import fnmatch
+import os
+import re
+import sys
+import numpy as np
+from resume import postfix_key
+
+OUTPUT_DIR_PATTERN = re.compile(r"^(\d+)_output")
+
+COLUMN_ALIASES = {
+    'time' : ('time', 't'),
+    'obs_time' : ('obs_time',),
+    'dm' : ('dm',),
+    'snr' : ('snr', 'sigma'),
+    'ra' : ('ra',),
+    'dec' : ('dec',),
+    'x' : ('x', 'pix_x'),
+    'y' : ('y', 'pix_y')
+}
+
+STORE_COLUMNS = ['time', 'dm', 'snr', 'x', 'y', 'source']
+
+
+def find_detection_files(paths : list, pattern : str = "*cand*.txt"):
+    """
+    Returns a dictionary mapping each observation ID to the sorted list of detection files
+    in its output directories, found in `paths` or (one level down) in directories of `paths`.
+    """
+    output_dirs = []
+    for path in paths:
+        if OUTPUT_DIR_PATTERN.match(os.path.basename(os.path.normpath(path))):
+            output_dirs.append(path)
+        elif os.path.isdir(path):
+            output_dirs += [os.path.join(path, x) for x in sorted(os.listdir(path))
+                if OUTPUT_DIR_PATTERN.match(x) and os.path.isdir(os.path.join(path, x))]
+    files = {}
+    for output_dir in output_dirs:
+        obsid = int(OUTPUT_DIR_PATTERN.match(os.path.basename(os.path.normpath(output_dir))).group(1))
+        for name in sorted(os.listdir(output_dir)):
+            if fnmatch.fnmatch(name, pattern):
+                files.setdefault(obsid, []).append(os.path.join(output_dir, name))
+    return files
+
+
+
+def read_detections(path : str):
+    """
+    Returns the detections of a file as a dictionary of arrays with the store columns
+    (except `source`), and whether positions are sky coordinates.
+    """
+    with open(path) as f:
+        header_line = f.readline()
+        data = np.loadtxt(f, ndmin=2, comments='#', delimiter=',' if ',' in header_line else None)
+    header = header_line.lstrip('#').replace(',', ' ').lower().split()
+    columns = {}
+    for name, aliases in COLUMN_ALIASES.items():
+        matches = [header.index(x) for x in aliases if x in header]
+        if matches:
+            columns[name] = data[:, matches[0]] if len(data) > 0 else np.zeros(0)
+    missing = [x for x in ('dm', 'snr') if x not in columns]
+    if 'time' not in columns and 'obs_time' not in columns:
+        missing.append('time')
+    sky = 'ra' in columns and 'dec' in columns
+    if not sky and not ('x' in columns and 'y' in columns):
+        missing.append('ra/dec or x/y')
+    if missing:
+        raise ValueError(f"Detection file {path} lacks the columns: {', '.join(missing)}")
+
+    if 'obs_time' in columns:
+        time = columns['obs_time']
+    else:
+        key = postfix_key(os.path.basename(path))
+        if key is None:
+            raise ValueError(f"Detection file {path} has job times but no product postfix giving their start second")
+        time = columns['time'] + key[0]
+    return {'time' : time, 'dm' : columns['dm'], 'snr' : columns['snr'],
+        'x' : columns['ra' if sky else 'x'], 'y' : columns['dec' if sky else 'y']}, sky
+
+
+
+def sources_signature(files : list):
+    return np.array([f"{x}:{os.stat(x).st_mtime_ns}:{os.stat(x).st_size}" for x in files])
+
+
+
+def build_store(store_dir : str, obsid : int, files : list):
+    """
+    Returns the columns of the detections of an observation (sorted by time), the list of
+    source files and whether positions are sky coordinates, reading the detection files one
+    at a time only if the store is out of date.
+    """
+    store_file = os.path.join(store_dir, f"{obsid}.npz")
+    signature = sources_signature(files)
+    if os.path.exists(store_file):
+        with np.load(store_file) as store:
+            if np.array_equal(store['signature'], signature):
+                return {x : store[x] for x in STORE_COLUMNS}, files, bool(store['sky'])
+
+    parts, sky = [], None
+    for i, path in enumerate(files):
+        detections, file_sky = read_detections(path)
+        if sky is not None and file_sky != sky:
+            raise ValueError(f"Detection files of observation {obsid} mix sky and pixel positions.")
+        sky = file_sky
+        detections['source'] = np.full(len(detections['time']), i, dtype=np.int32)
+        parts.append(detections)
+    columns = {x : np.concatenate([p[x] for p in parts]) for x in STORE_COLUMNS}
+    order = np.argsort(columns['time'], kind='stable')
+    columns = {x : v[order] for x, v in columns.items()}
+
+    os.makedirs(store_dir, exist_ok=True)
+    tmp_file = store_file + ".tmp.npz"
+    np.savez(tmp_file, signature=signature, sky=bool(sky), **columns)
+    os.replace(tmp_file, store_file)
+    return columns, files, bool(sky)
+
+
+
+def cluster(columns : dict, time_tol : float, dm_tol : float, pos_tol : float, sky : bool):
+    """
+    Friends of friends clustering of detections sorted by time: two detections are linked if
+    they are within `time_tol` seconds, `dm_tol` DM units and `pos_tol` pixels (degrees for sky
+    positions) of each other. Returns the cluster label of each detection.
+    """
+    time, dm, x, y = columns['time'], columns['dm'], columns['x'], columns['y']
+    parent = np.arange(len(time))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    window_end = np.searchsorted(time, time + time_tol, side='right')
+    for i in range(len(time)):
+        j = np.arange(i + 1, window_end[i])
+        if len(j) == 0: continue
+        dx = x[j] - x[i]
+        if sky:
+            dx = (dx + 180) % 360 - 180
+            dx = dx * np.cos(np.deg2rad(y[i]))
+        close = (np.abs(dm[j] - dm[i]) <= dm_tol) & (np.hypot(dx, y[j] - y[i]) <= pos_tol)
+        for k in j[close]:
+            a, b = root(i), root(k)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    return np.array([root(i) for i in range(len(time))])
+
+
+
+def rank_candidates(columns : dict, labels : np.ndarray):
+    """
+    Returns one row per cluster, its brightest detection, with the number of detections and of
+    jobs that reported it and its DM span, sorted by decreasing S/N.
+    """
+    rows = []
+    order = np.lexsort((-columns['snr'], labels))
+    starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+    for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+        members = order[start:end]
+        best = members[0]
+        rows.append({'time' : columns['time'][best], 'dm' : columns['dm'][best], 'snr' : columns['snr'][best],
+            'x' : columns['x'][best], 'y' : columns['y'][best], 'n_detections' : len(members),
+            'n_jobs' : len(np.unique(columns['source'][members])),
+            'dm_min' : columns['dm'][members].min(), 'dm_max' : columns['dm'][members].max()})
+    return sorted(rows, key=lambda r : -r['snr'])
+
+
+
+def write_candidates(path : str, rows : list, sky : bool):
+    x_name, y_name = ('ra', 'dec') if sky else ('x', 'y')
+    with open(path, "w") as f:
+        f.write(f"# rank time dm snr {x_name} {y_name} n_detections n_jobs dm_min dm_max\n")
+        for rank, r in enumerate(rows):
+            f.write(f"{rank} {r['time']:.4f} {r['dm']:.3f} {r['snr']:.2f} {r['x']:.6g} {r['y']:.6g} "
+                f"{r['n_detections']} {r['n_jobs']} {r['dm_min']:.3f} {r['dm_max']:.3f}\n")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the detections of the jobs of BLINK searches into ranked candidate lists.")
+    parser.add_argument("inputs", nargs='+', help="Output directories (<obsid>_output*), or directories containing them.")
+    parser.add_argument("--store", type=str, default="candidates", help="Directory of the detection store and candidate lists.")
+    parser.add_argument("--pattern", type=str, default="*cand*.txt", help="Name pattern of the detection files.")
+    parser.add_argument("--obsid", type=int, nargs='*', default=[], help="Only merge these observations.")
+    parser.add_argument("--time-tol", type=float, default=0.5, help="Maximum time difference (s) between detections of a candidate.")
+    parser.add_argument("--dm-tol", type=float, default=5, help="Maximum DM difference between detections of a candidate.")
+    parser.add_argument("--pos-tol", type=float, default=2, help="Maximum distance between detections of a candidate " \
+                        "(pixels, or degrees if the detections have RA/Dec).")
+    args = parser.parse_args()
+
+    files = find_detection_files(args.inputs, args.pattern)
+    for obsid in sorted(files):
+        if args.obsid and obsid not in args.obsid: continue
+        columns, sources, sky = build_store(args.store, obsid, files[obsid])
+        labels = cluster(columns, args.time_tol, args.dm_tol, args.pos_tol, sky)
+        rows = rank_candidates(columns, labels)
+        output_file = os.path.join(args.store, f"{obsid}_candidates.txt")
+        write_candidates(output_file, rows, sky)
+        print(f"{obsid}: {len(columns['time'])} detections from {len(sources)} files, {len(rows)} candidates -> {output_file}",
+            file=sys.stderr)
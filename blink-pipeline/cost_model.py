@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Runtime model of BLINK jobs, fitted from the elapsed times of past jobs.
+
+The runtime of a job is modelled as a fixed startup cost plus a linear combination of terms
+proportional to the work done per second of data, each multiplied by the number of seconds
+processed:
+
+- a constant term per second (reading data, correlation, ...);
+- visibility gridding, proportional to the number of baselines and of visibilities per second;
+- imaging, proportional to the FFT cost of each image formed;
+- dedispersion, proportional to the number of DM trials times the number of image pixels.
+
+Coefficients are fitted with non-negative least squares. Training records come from the
+`slurm-%A.out` files of past jobs, in which BLINK jobs log the `blink_pipeline` command line,
+the number of GPUs it ran on and start/end times, or from
+`sacct -P --format=JobID,State,Elapsed,SubmitLine%10000` dumps.
+
+The model predicts the runtime of a job on all the GPUs of a node (MODEL_GPUS). Runs on fewer
+GPUs, i.e. search cells packed in an allocation and tiles sharing a job (see blink-submit.py),
+are not used for fitting: their runtimes are scaled from the model's predictions instead (see
+`packing.scaled_runtime`).
+
+Usage:
+    cost_model.py fit -o model.json <output dirs, slurm-*.out files or sacct dumps>
+    cost_model.py predict -m model.json --imgsize 256 --duration 600 --dm-range 10:100:1 ...
+"""
+import argparse
+import json
+import math
+import os
+import re
+import shlex
+import numpy as np
+
+FEATURE_NAMES = ['startup', 'per_second', 'gridding', 'imaging', 'dedispersion']
+
+# Markers printed by BLINK jobs in their SLURM output file.
+COMMAND_MARKER = "BLINK_COMMAND:"
+START_MARKER = "BLINK_START="
+END_MARKER = "BLINK_END="
+GPUS_MARKER = "BLINK_GPUS="
+
+# Number of GPUs of the jobs whose runtime the model predicts.
+MODEL_GPUS = 8
+
+
+def n_dm_trials(dm_range : str):
+    if dm_range is None:
+        return 0
+    dm_min, dm_max, dm_step = (float(x) for x in dm_range.split(':'))
+    return int(math.floor((dm_max - dm_min) / dm_step + 1e-9)) + 1
+
+
+
+def job_terms(params : dict):
+    """
+    Returns the vector of model terms for a job described by a dictionary with keys
+    `imgsize`, `oversampling`, `duration`, `dm_range`, `time_res` (seconds), `freq_avg_factor`
+    and `n_antennas` (number of unflagged antennas).
+    """
+    duration = params['duration']
+    images_per_second = 1.0 / params['time_res'] / params['freq_avg_factor']
+    n_baselines = params['n_antennas'] * (params['n_antennas'] - 1) / 2
+    grid_pixels = (params['imgsize'] * params['oversampling'])**2
+    return np.array([
+        1.0,
+        duration,
+        duration * images_per_second * n_baselines,
+        duration * images_per_second * grid_pixels * math.log2(max(grid_pixels, 2)),
+        duration * images_per_second * n_dm_trials(params.get('dm_range')) * params['imgsize']**2
+    ])
+
+
+
+def nnls(A, b, max_iterations = 100):
+    """
+    Non-negative least squares (Lawson-Hanson active set method): min ||Ax - b|| with x >= 0.
+    """
+    n = A.shape[1]
+    x = np.zeros(n)
+    passive = np.zeros(n, dtype=bool)
+    for _ in range(max_iterations):
+        gradient = A.T @ (b - A @ x)
+        if passive.all() or (gradient[~passive] <= 1e-12).all():
+            break
+        candidates = np.where(~passive, gradient, -np.inf)
+        passive[np.argmax(candidates)] = True
+        while True:
+            z = np.zeros(n)
+            z[passive] = np.linalg.lstsq(A[:, passive], b, rcond=None)[0]
+            if (z[passive] > 0).all():
+                x = z
+                break
+            negative = passive & (z <= 0)
+            alpha = np.min(x[negative] / (x[negative] - z[negative]))
+            x = x + alpha * (z - x)
+            passive &= x > 1e-12
+    return x
+
+
+
+class CostModel:
+    """
+    Linear runtime model, see the module documentation.
+    """
+    def __init__(self, coefficients = None, n_records = 0, residual_std = 0.0):
+        self.coefficients = np.zeros(len(FEATURE_NAMES)) if coefficients is None else np.asarray(coefficients, dtype=float)
+        self.n_records = n_records
+        # standard deviation of the relative error on the training records
+        self.residual_std = residual_std
+
+    def fit(self, records : list):
+        """
+        Fits the model on a list of (job parameters, elapsed seconds) pairs.
+        """
+        if len(records) == 0:
+            raise ValueError("No job records to fit the cost model on.")
+        A = np.array([job_terms(params) for params, _ in records])
+        b = np.array([elapsed for _, elapsed in records], dtype=float)
+        # fit the relative error, so that short and long jobs weigh the same
+        weights = 1.0 / np.maximum(b, 1.0)
+        scale = np.linalg.norm(A * weights[:, np.newaxis], axis=0)
+        scale[scale == 0] = 1.0
+        x = nnls(A * weights[:, np.newaxis] / scale, b * weights)
+        self.coefficients = x / scale
+        self.n_records = len(records)
+        relative_error = (A @ self.coefficients - b) * weights
+        self.residual_std = float(np.sqrt(np.mean(relative_error**2)))
+        return self
+
+    def predict(self, params : dict):
+        """
+        Predicted runtime in seconds of a job.
+        """
+        return float(job_terms(params) @ self.coefficients)
+
+    def time_limit(self, params : dict, safety_factor : float = 1.25, granularity : int = 900, max_seconds : int = 86400):
+        """
+        Walltime in seconds to request for a job: the predicted runtime, inflated by `safety_factor`
+        and by the model uncertainty, rounded up to `granularity` seconds.
+        """
+        return self.padded_time_limit(self.predict(params), safety_factor, granularity, max_seconds)
+
+    def padding(self, safety_factor : float = 1.25):
+        """
+        Factor by which predicted runtimes are inflated to get walltimes.
+        """
+        return safety_factor * (1 + 2 * self.residual_std)
+
+    def padded_time_limit(self, runtime : float, safety_factor : float = 1.25, granularity : int = 900, max_seconds : int = 86400):
+        """
+        Walltime in seconds to request for a predicted runtime (see `time_limit`).
+        """
+        runtime = runtime * self.padding(safety_factor)
+        return int(min(max(granularity, math.ceil(runtime / granularity) * granularity), max_seconds))
+
+    def save(self, path : str):
+        with open(path, "w") as f:
+            json.dump({'features' : FEATURE_NAMES, 'coefficients' : self.coefficients.tolist(),
+                'n_records' : self.n_records, 'residual_std' : self.residual_std}, f, indent=2)
+
+    @staticmethod
+    def load(path : str):
+        with open(path) as f:
+            data = json.load(f)
+        if data['features'] != FEATURE_NAMES:
+            raise ValueError(f"Cost model {path} was fitted with different features: {data['features']}")
+        return CostModel(data['coefficients'], data['n_records'], data['residual_std'])
+
+
+
+def parse_blink_command(command_line : str):
+    """
+    Extracts the job parameters used by the model from a `blink_pipeline` command line.
+    Returns None if the job did not process a known number of seconds.
+    """
+    tokens = shlex.split(command_line)
+    options = {}
+    i = 1
+    while i < len(tokens):
+        if tokens[i].startswith('-') and len(tokens[i]) == 2:
+            if i + 1 < len(tokens) and not tokens[i + 1].startswith('-'):
+                options[tokens[i][1]] = tokens[i + 1]
+                i += 2
+                continue
+            options[tokens[i][1]] = True
+        i += 1
+    if 'Q' not in options:
+        return None
+    time_res = options.get('t', '0.02s')
+    time_res = float(time_res[:-2]) / 1000 if time_res.endswith('ms') else float(time_res.rstrip('s'))
+    n_antennas = int(options.get('R', 128))
+    flagged = options.get('A')
+    n_flagged = len(flagged.split(',')) if isinstance(flagged, str) else 0
+    return {
+        'imgsize' : int(options.get('n', 256)),
+        'oversampling' : float(options.get('O', 2)),
+        'duration' : int(options['Q']),
+        'dm_range' : options.get('D'),
+        'time_res' : time_res,
+        'freq_avg_factor' : int(options.get('c', 4)),
+        'n_antennas' : n_antennas - n_flagged
+    }
+
+
+
+def parse_slurm_output(path : str):
+    """
+    Returns the (job parameters, elapsed seconds) record of a job from its SLURM output file,
+    or None if the file does not contain a complete BLINK run on MODEL_GPUS GPUs. Files
+    written before jobs logged their number of GPUs are assumed to be runs on MODEL_GPUS GPUs,
+    except the ones of packed cells (`slurm-<job id>_cell<n>.out`).
+    """
+    command_line, start, end = None, None, None
+    gpus = None if re.search(r"_cell\d+\.out$", path) else MODEL_GPUS
+    with open(path, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(GPUS_MARKER):
+                gpus = int(line[len(GPUS_MARKER):])
+            elif line.startswith(COMMAND_MARKER):
+                command_line = line[len(COMMAND_MARKER):].strip()
+            elif line.startswith(START_MARKER):
+                start = int(line[len(START_MARKER):])
+            elif line.startswith(END_MARKER):
+                end = int(line[len(END_MARKER):])
+    if command_line is None or start is None or end is None or gpus != MODEL_GPUS:
+        return None
+    params = parse_blink_command(command_line)
+    if params is None:
+        return None
+    return params, end - start
+
+
+
+def parse_elapsed(elapsed : str):
+    """
+    Converts a sacct elapsed time ([days-]hours:minutes:seconds) to seconds.
+    """
+    days = 0
+    if '-' in elapsed:
+        days, elapsed = elapsed.split('-')
+    seconds = 0
+    for token in elapsed.split(':'):
+        seconds = seconds * 60 + float(token)
+    return int(days) * 86400 + seconds
+
+
+
+def parse_sacct_dump(path : str):
+    """
+    Returns the records of the completed BLINK jobs in a `sacct -P` dump including the
+    JobID, State, Elapsed and SubmitLine fields.
+    """
+    records = []
+    with open(path) as f:
+        header = f.readline().strip().split('|')
+        if not all(x in header for x in ('JobID', 'State', 'Elapsed', 'SubmitLine')):
+            raise ValueError(f"sacct dump {path} must contain the JobID, State, Elapsed and SubmitLine fields.")
+        for line in f:
+            fields = dict(zip(header, line.rstrip('\n').split('|', len(header) - 1)))
+            # skip job steps (e.g. 1234.batch)
+            if '.' in fields['JobID'] or fields['State'] != 'COMPLETED': continue
+            match = re.search(r"blink_pipeline [^;\"]*", fields['SubmitLine'])
+            if match is None: continue
+            params = parse_blink_command(match.group(0))
+            if params is None: continue
+            records.append((params, parse_elapsed(fields['Elapsed'])))
+    return records
+
+
+
+def collect_records(paths : list):
+    """
+    Collects training records from output directories (all the slurm-*.out files within),
+    SLURM output files and sacct dumps.
+    """
+    records = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.startswith("slurm-") and name.endswith(".out"):
+                    record = parse_slurm_output(os.path.join(path, name))
+                    if record is not None: records.append(record)
+        elif os.path.basename(path).startswith("slurm-"):
+            record = parse_slurm_output(path)
+            if record is not None: records.append(record)
+        else:
+            records.extend(parse_sacct_dump(path))
+    return records
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit or query the BLINK job runtime model.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fit_parser = subparsers.add_parser("fit", help="Fit the model on past jobs.")
+    fit_parser.add_argument("inputs", nargs='+', help="Output directories, slurm-*.out files or sacct -P dumps.")
+    fit_parser.add_argument("-o", "--output", required=True, help="Where to save the fitted model (JSON).")
+    predict_parser = subparsers.add_parser("predict", help="Predict the runtime of a job.")
+    predict_parser.add_argument("-m", "--model", required=True, help="Fitted model (JSON).")
+    predict_parser.add_argument("--imgsize", type=int, default=256)
+    predict_parser.add_argument("--oversampling", type=float, default=1)
+    predict_parser.add_argument("--duration", type=int, default=600)
+    predict_parser.add_argument("--dm-range", type=str, default=None)
+    predict_parser.add_argument("--time-res", type=float, default=0.02)
+    predict_parser.add_argument("--freq-avg", type=int, default=4)
+    predict_parser.add_argument("--antennas", type=int, default=128, help="Number of unflagged antennas.")
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        records = collect_records(args.inputs)
+        model = CostModel().fit(records)
+        model.save(args.output)
+        print(f"Fitted on {model.n_records} jobs, relative error std {model.residual_std:.3f}.")
+        for name, value in zip(FEATURE_NAMES, model.coefficients):
+            print(f"{name:>14}: {value:.6g}")
+    else:
+        model = CostModel.load(args.model)
+        params = {'imgsize' : args.imgsize, 'oversampling' : args.oversampling, 'duration' : args.duration,
+            'dm_range' : args.dm_range, 'time_res' : args.time_res, 'freq_avg_factor' : args.freq_avg,
+            'n_antennas' : args.antennas}
+        print(f"Predicted runtime: {model.predict(params):.0f} s, time limit: {model.time_limit(params)} s")
@@ -0,0 +1,135 @@
+"""
+Cold plasma dispersion relations used to plan dedispersion searches.
+Frequencies are in MHz, dispersion measures in pc cm^-3, times in seconds.
+"""
+import math
+
+# Dispersion constant in s MHz^2 pc^-1 cm^3
+DISPERSION_CONSTANT = 4.148808e3
+
+
+def dispersion_delay(dm : float, f_low : float, f_high : float):
+    """
+    Delay of the signal at `f_low` with respect to `f_high` for a dispersion measure `dm`.
+    """
+    return DISPERSION_CONSTANT * dm * (f_low**-2 - f_high**-2)
+
+
+
+def parse_dm_range(dm_range : str):
+    """
+    Parses a DM range in the min:max:step format, returning three floats.
+    """
+    tokens = dm_range.split(':')
+    if len(tokens) != 3:
+        raise ValueError(f"Dedispersion range is malformed: {dm_range}")
+    return tuple(float(x) for x in tokens)
+
+
+
+def dm_range_overlap(dm_range : str, f_low : float, f_high : float, margin : float):
+    """
+    Number of seconds two consecutive time bins must overlap so that a pulse with the
+    highest DM of the range, starting at the end of a bin, is fully contained in the next one.
+    """
+    _, dm_max, _ = parse_dm_range(dm_range)
+    return int(math.ceil(dispersion_delay(dm_max, f_low, f_high) + margin))
+
+
+
+def channel_smearing(dm : float, frequency : float, channel_width : float):
+    """
+    Dispersive smearing of a pulse within a channel of width `channel_width` at `frequency`.
+    """
+    return 2 * DISPERSION_CONSTANT * dm * channel_width / frequency**3
+
+
+
+def effective_width(dm : float, frequency : float, channel_width : float, time_res : float, pulse_width : float = 0.0):
+    """
+    Width of a pulse of intrinsic width `pulse_width` after sampling at `time_res` and
+    smearing within channels of width `channel_width` at `frequency`.
+    """
+    return math.sqrt(pulse_width**2 + time_res**2 + channel_smearing(dm, frequency, channel_width)**2)
+
+
+
+def nice_step(step : float):
+    """
+    Largest DM step of the form 1, 2 or 5 times a power of ten not above `step`.
+    """
+    exponent = math.floor(math.log10(step))
+    for mantissa in (5, 2, 1):
+        if mantissa * 10**exponent <= step * (1 + 1e-9):
+            return round(mantissa * 10**exponent, 6)
+    return round(10**exponent, 6)
+
+
+
+def dm_trial_runs(dm_min : float, dm_max : float, band : tuple, channel_width : float, time_res : float,
+        snr_loss : float = 0.1, pulse_width : float = 0.0):
+    """
+    Returns a DM trial grid from `dm_min` to (at least) `dm_max` whose step grows with DM, as a
+    list of (first DM, last DM, step) runs of evenly spaced trials.
+
+    A pulse with a DM halfway between two trials is dedispersed with a residual delay across the
+    band of half the dispersion delay of one step. The step at each DM is the largest for which
+    this residual does not widen the pulse (see `effective_width`, at the lowest frequency of the
+    band) by more than a loss of `snr_loss` in S/N, which goes as the inverse square root of the
+    width. As intra-channel smearing grows with DM, so does the tolerated step. Steps are rounded
+    down to 1, 2 or 5 times a power of ten, so that the grid splits into few runs.
+    """
+    if not 0 < snr_loss < 1:
+        raise ValueError(f"The tolerated S/N loss must be between 0 and 1, got {snr_loss}.")
+    f_low, f_high = band
+    width_ratio = (1 - snr_loss)**-2
+    delay_per_dm = dispersion_delay(1.0, f_low, f_high)
+    runs = []
+    dm = dm_min
+    while True:
+        width = effective_width(dm, f_low, channel_width, time_res, pulse_width)
+        step = nice_step(2 * width * math.sqrt(width_ratio**2 - 1) / delay_per_dm)
+        if len(runs) > 0 and runs[-1][2] == step:
+            runs[-1][1] = dm
+        else:
+            runs.append([dm, dm, step])
+        if dm >= dm_max:
+            break
+        dm = round(dm + step, 6)
+    return [tuple(x) for x in runs]
+
+
+
+def run_trials(first_dm : float, last_dm : float, step : float):
+    return int(round((last_dm - first_dm) / step)) + 1
+
+
+
+def split_dm_runs(runs : list, n_ranges : int):
+    """
+    Splits a DM trial grid (see `dm_trial_runs`) into about `n_ranges` DM ranges in the
+    min:max:step format with about the same number of trials each, the dedispersion cost of a
+    job being proportional to its number of trials. Runs too short to make a range of their
+    own are searched with the (finer) step of the preceding run instead.
+    """
+    total = sum(run_trials(*x) for x in runs)
+    target = max(1, total / n_ranges)
+    merged = []
+    for first_dm, last_dm, step in runs:
+        if len(merged) > 0 and (run_trials(*merged[-1]) < target / 2 or run_trials(first_dm, last_dm, step) < target / 2):
+            previous_first, _, previous_step = merged[-1]
+            n_steps = math.ceil((last_dm - previous_first) / previous_step - 1e-9)
+            merged[-1] = (previous_first, round(previous_first + n_steps * previous_step, 6), previous_step)
+        else:
+            merged.append((first_dm, last_dm, step))
+
+    dm_ranges = []
+    for first_dm, last_dm, step in merged:
+        n_trials = run_trials(first_dm, last_dm, step)
+        n_pieces = max(1, int(round(n_trials / target)))
+        start = 0
+        for i in range(n_pieces):
+            end = (i + 1) * n_trials // n_pieces
+            dm_ranges.append(f"{round(first_dm + start * step, 6):g}:{round(first_dm + (end - 1) * step, 6):g}:{step:g}")
+            start = end
+    return dm_ranges
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Offline stand-ins for the SLURM commands used by the submission scripts.
+
+Submitted jobs are recorded, one JSON object per line, in `$FAKE_SLURM_DIR/jobs.jsonl`
+(default: /tmp/fake-slurm-$USER) and nothing is executed. Job states evolve with time:
+a job is PENDING for FAKE_SLURM_START seconds after submission (default 0), then RUNNING for
+FAKE_SLURM_RUNTIME seconds (default: forever), then COMPLETED and no longer listed by squeue.
+The state of a job can also be forced with `fake_slurm.py set-state <job_id> <state>`.
+
+With FAKE_SLURM_EXECUTE=1, sbatch instead runs the job (each task of an array in turn, with
+SLURM_JOB_ID, SLURM_ARRAY_JOB_ID, SLURM_ARRAY_TASK_ID and SLURM_CPUS_PER_TASK set) before
+returning, its output written to the --output file (%A, %a and %j replaced), and records each
+task as COMPLETED or FAILED from its exit code. Dependencies are ignored.
+
+Use it by setting BLINK_SBATCH and BLINK_SQUEUE to the `sbatch` and `squeue` scripts in this
+directory, or by prepending this directory to PATH.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+FINISHED_STATES = ('COMPLETED', 'FAILED', 'TIMEOUT', 'CANCELLED', 'OUT_OF_MEMORY', 'NODE_FAIL')
+
+
+def state_dir():
+    path = os.getenv("FAKE_SLURM_DIR", f"/tmp/fake-slurm-{os.getenv('USER', 'user')}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def load_jobs():
+    jobs_file = os.path.join(state_dir(), "jobs.jsonl")
+    if not os.path.exists(jobs_file):
+        return []
+    with open(jobs_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_jobs(jobs):
+    jobs_file = os.path.join(state_dir(), "jobs.jsonl")
+    with open(jobs_file + ".tmp", "w") as f:
+        for job in jobs:
+            f.write(json.dumps(job) + "\n")
+    os.replace(jobs_file + ".tmp", jobs_file)
+
+
+def parse_array(spec):
+    """
+    Returns the list of task ids and the throttle value of an --array specification.
+    """
+    throttle = 0
+    if '%' in spec:
+        spec, throttle = spec.split('%')
+        throttle = int(throttle)
+    tasks = []
+    for token in spec.split(','):
+        if '-' in token:
+            first, last = token.split('-')
+            step = 1
+            if ':' in last:
+                last, step = last.split(':')
+            tasks.extend(range(int(first), int(last) + 1, int(step)))
+        else:
+            tasks.append(int(token))
+    return tasks, throttle
+
+
+def task_states(job, now):
+    """
+    Returns the list of (task id or None, state) of a job at time `now`.
+    """
+    start = float(os.getenv("FAKE_SLURM_START", "0"))
+    runtime = float(os.getenv("FAKE_SLURM_RUNTIME", "inf"))
+    elapsed = now - job['submit_time']
+    if job.get('state') is not None:
+        state = job['state']
+    elif elapsed < start:
+        state = 'PENDING'
+    elif elapsed < start + runtime:
+        state = 'RUNNING'
+    else:
+        state = 'COMPLETED'
+    if job.get('array') is None:
+        return [(None, state)]
+    states = []
+    n_running = 0
+    for task in job['array']:
+        task_state = job.get('task_states', {}).get(str(task), state)
+        if task_state == 'RUNNING':
+            if job.get('throttle', 0) > 0 and n_running >= job['throttle']:
+                task_state = 'PENDING'
+            else:
+                n_running += 1
+        states.append((task, task_state))
+    return states
+
+
+def output_path(pattern, job_id, task):
+    path = pattern.replace('%A', str(job_id)).replace('%a', str(task) if task is not None else '4294967294')
+    return path.replace('%j', str(job_id) if task is None else f"{job_id}_{task}")
+
+
+def execute(job):
+    """
+    Runs the tasks of a job one after the other, returns their states by task id.
+    """
+    command = ["bash", "-c", job['wrap']] if job['wrap'] is not None else ["bash", job['script']]
+    states = {}
+    for task in job['array'] if job['array'] is not None else [None]:
+        env = dict(os.environ, SLURM_JOB_ID=str(job['job_id']), SLURM_JOB_NAME=job['name'])
+        if job.get('cpus_per_task') is not None:
+            env['SLURM_CPUS_PER_TASK'] = str(job['cpus_per_task'])
+        if task is not None:
+            env.update(SLURM_ARRAY_JOB_ID=str(job['job_id']), SLURM_ARRAY_TASK_ID=str(task))
+        output = output_path(job['output'] or "slurm-%j.out", job['job_id'], task)
+        with open(output, "w") as f:
+            returncode = subprocess.run(command, env=env, stdout=f, stderr=subprocess.STDOUT).returncode
+        states[str(task)] = 'COMPLETED' if returncode == 0 else 'FAILED'
+    return states
+
+
+def sbatch(argv):
+    parser = argparse.ArgumentParser(prog="sbatch")
+    parser.add_argument("--parsable", action="store_true")
+    parser.add_argument("-a", "--array", type=str, default=None)
+    parser.add_argument("-J", "--job-name", type=str, default=None)
+    parser.add_argument("-t", "--time", type=str, default="UNLIMITED")
+    parser.add_argument("-p", "--partition", type=str, default=None)
+    parser.add_argument("-A", "--account", type=str, default=None)
+    parser.add_argument("-o", "--output", type=str, default=None)
+    parser.add_argument("-d", "--dependency", type=str, default=None)
+    parser.add_argument("--gres", type=str, default=None)
+    parser.add_argument("-c", "--cpus-per-task", type=int, default=None)
+    parser.add_argument("--wrap", type=str, default=None)
+    parser.add_argument("script", nargs="?", default=None)
+    args, other = parser.parse_known_args(argv)
+    if args.wrap is None and args.script is None:
+        print("sbatch: error: no batch script or --wrap command given", file=sys.stderr)
+        return 1
+
+    jobs = load_jobs()
+    job_id = max([j['job_id'] for j in jobs], default=1000) + 1
+    job = {'job_id' : job_id, 'name' : args.job_name or (os.path.basename(args.script) if args.script else 'wrap'),
+        'time_limit' : args.time, 'partition' : args.partition, 'account' : args.account,
+        'output' : args.output, 'dependency' : args.dependency, 'gres' : args.gres,
+        'wrap' : args.wrap, 'script' : os.path.abspath(args.script) if args.script else None, 'cpus_per_task' : args.cpus_per_task,
+        'other_args' : other, 'submit_time' : time.time(), 'state' : None, 'array' : None, 'throttle' : 0}
+    if args.array is not None:
+        job['array'], job['throttle'] = parse_array(args.array)
+    jobs.append(job)
+    save_jobs(jobs)
+    if os.getenv("FAKE_SLURM_EXECUTE", "0") == "1":
+        states = execute(job)
+        # the job may have submitted others meanwhile
+        jobs = load_jobs()
+        for j in jobs:
+            if j['job_id'] != job_id: continue
+            if job['array'] is None:
+                j['state'] = states['None']
+            else:
+                j['task_states'] = states
+        save_jobs(jobs)
+    print(job_id if args.parsable else f"Submitted batch job {job_id}")
+    return 0
+
+
+def squeue(argv):
+    parser = argparse.ArgumentParser(prog="squeue", add_help=False)
+    parser.add_argument("-h", "--noheader", action="store_true")
+    parser.add_argument("-o", "--format", type=str, default="%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R")
+    parser.add_argument("-j", "--jobs", type=str, default=None)
+    parser.add_argument("-u", "--user", type=str, default=None)
+    parser.add_argument("--me", action="store_true")
+    parser.add_argument("-t", "--states", type=str, default=None)
+    args, _ = parser.parse_known_args(argv)
+
+    selected = None
+    if args.jobs is not None:
+        selected = set(x.split('_')[0] for x in args.jobs.split(','))
+    states = None if args.states is None else set(x.upper() for x in args.states.split(','))
+    now = time.time()
+    lines = []
+    for job in load_jobs():
+        if selected is not None and str(job['job_id']) not in selected: continue
+        for task, state in task_states(job, now):
+            if state in FINISHED_STATES: continue
+            if states is not None and state not in states: continue
+            fields = {
+                'i' : str(job['job_id']) if task is None else f"{job['job_id']}_{task}",
+                'A' : str(job['job_id']),
+                'F' : str(job['job_id']),
+                'a' : 'N/A' if task is None else str(task),
+                'K' : 'N/A' if task is None else str(task),
+                'T' : state,
+                't' : {'PENDING' : 'PD', 'RUNNING' : 'R'}.get(state, state[:2]),
+                'j' : job['name'],
+                'l' : job['time_limit'],
+                'P' : job['partition'] or '',
+                'u' : os.getenv('USER', 'user'),
+                'M' : '0:00',
+                'D' : '1',
+                'R' : '(None)' if state == 'PENDING' else 'fake-node'
+            }
+            def replace(match):
+                value = fields.get(match.group(3), '')
+                width = match.group(2)
+                if width:
+                    value = value[:int(width)] if match.group(1) else value.rjust(int(width))
+                return value
+            lines.append(re.sub(r"%(\.?)(\d*)([a-zA-Z])", replace, args.format))
+    if not args.noheader:
+        print(re.sub(r"%\.?\d*([a-zA-Z])", lambda m: m.group(1).upper(), args.format))
+    for line in lines:
+        print(line)
+    return 0
+
+
+def set_state(argv):
+    parser = argparse.ArgumentParser(prog="fake_slurm.py set-state")
+    parser.add_argument("job_id", type=str, help="Job ID, or <job_id>_<task_id> for an array task.")
+    parser.add_argument("state", type=str)
+    args = parser.parse_args(argv)
+    jobs = load_jobs()
+    job_id, _, task = args.job_id.partition('_')
+    for job in jobs:
+        if str(job['job_id']) != job_id: continue
+        if task:
+            job.setdefault('task_states', {})[task] = args.state.upper()
+        else:
+            job['state'] = args.state.upper()
+    save_jobs(jobs)
+    return 0
+
+
+COMMANDS = {'sbatch' : sbatch, 'squeue' : squeue, 'set-state' : set_state}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"Usage: {sys.argv[0]} {{{','.join(COMMANDS)}}} [args]", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
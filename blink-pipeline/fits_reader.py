@@ -0,0 +1,295 @@
+"""
+Minimal FITS reader for the submission path, depending only on NumPy.
+
+Importing `astropy.io.fits` takes a large share of the startup time of the submission
+scripts (more so from Python environments on a cold parallel filesystem), while they only
+need the primary header and a few columns of the TILEDATA table of metafits files, and the
+images of dynamic spectra. This module covers just that:
+
+- headers: fixed-format cards with logical, integer, floating point and string values
+  (including long strings split over `CONTINUE` cards), undefined values as None;
+  commentary cards and cards with other values (complex) are kept with their raw text;
+- binary tables with fixed-width columns (`TFORMn` codes L, X, B, I, J, K, A, E, D, C, M,
+  and P/Q array descriptors, returned as raw descriptors), scaled by `TSCALn`/`TZEROn`;
+- primary or image HDUs, scaled by `BSCALE`/`BZERO`.
+
+Data is never read when the file is opened: `HDU.data` and `BinaryTable.column` return
+arrays backed by a memory map of the file, so that only the bytes of the requested columns
+are actually read.
+"""
+import numpy as np
+
+# FITS files are made of blocks of this many bytes, headers of cards of CARD_SIZE bytes
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+COMMENTARY_KEYS = ('', 'COMMENT', 'HISTORY')
+
+BITPIX_DTYPES = {8 : '>u1', 16 : '>i2', 32 : '>i4', 64 : '>i8', -32 : '>f4', -64 : '>f8'}
+
+# binary table column type code -> (NumPy type, elements per repeat), X and A are special cases
+TFORM_DTYPES = {
+    'L' : ('S1', 1), 'B' : ('>u1', 1), 'I' : ('>i2', 1), 'J' : ('>i4', 1), 'K' : ('>i8', 1),
+    'E' : ('>f4', 1), 'D' : ('>f8', 1), 'C' : ('>c8', 1), 'M' : ('>c16', 1),
+    'P' : ('>i4', 2), 'Q' : ('>i8', 2)
+}
+
+
+def parse_value(text : str):
+    """
+    Returns the value of a card from the text after `= `, without its comment.
+    Strings are returned with trailing spaces removed, as astropy does.
+    """
+    text = text.strip()
+    if text.startswith("'"):
+        # a quote inside a string is written as two quotes
+        value, i = [], 1
+        while i < len(text):
+            if text[i] == "'":
+                if text[i + 1:i + 2] == "'":
+                    value.append("'")
+                    i += 2
+                    continue
+                break
+            value.append(text[i])
+            i += 1
+        return "".join(value).rstrip()
+    text = text.split('/')[0].strip()
+    if text == '':
+        # undefined value
+        return None
+    if text == 'T' or text == 'F':
+        return text == 'T'
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text.replace('D', 'E'))
+    except ValueError:
+        return text
+
+
+
+def parse_cards(raw : bytes):
+    """
+    Returns the list of (key, value) pairs of the cards of a header, merging long strings
+    continued over `CONTINUE` cards.
+    """
+    cards = []
+    continued = False
+    for i in range(0, len(raw), CARD_SIZE):
+        card = raw[i:i + CARD_SIZE].decode('ascii', 'replace')
+        key = card[:8].strip()
+        if key == 'CONTINUE' and continued:
+            value = parse_value(card[8:])
+            previous_key, previous_value = cards[-1]
+            cards[-1] = (previous_key, previous_value[:-1] + value)
+            continued = isinstance(value, str) and value.endswith('&')
+            continue
+        if card[8:10] == '= ' and key not in COMMENTARY_KEYS:
+            value = parse_value(card[10:])
+            continued = isinstance(value, str) and value.endswith('&') and card[10:].lstrip().startswith("'")
+        else:
+            value = card[8:].rstrip()
+            continued = False
+        cards.append((key, value))
+    return cards
+
+
+
+def read_header(f):
+    """
+    Reads a header from the current position of a binary file. Returns its list of cards,
+    or None at the end of the file. Raises EOFError if the header is truncated.
+    """
+    raw = b""
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if len(block) == 0 and len(raw) == 0:
+            return None
+        if len(block) < BLOCK_SIZE:
+            raise EOFError("Truncated FITS header.")
+        for i in range(0, BLOCK_SIZE, CARD_SIZE):
+            if block[i:i + 8] == b"END     ":
+                return parse_cards(raw + block[:i])
+        raw += block
+
+
+
+class HDU:
+    """
+    Header and location of the data of a header/data unit.
+    """
+    def __init__(self, path : str, cards : list, data_offset : int):
+        self.path = path
+        self.cards = cards
+        # first occurrence of each key, like astropy's header[key]
+        self.header = {}
+        for key, value in cards:
+            if key not in COMMENTARY_KEYS and key not in self.header:
+                self.header[key] = value
+        self.data_offset = data_offset
+
+    @property
+    def name(self):
+        return self.header.get('EXTNAME', 'PRIMARY' if 'SIMPLE' in self.header else '')
+
+    @property
+    def shape(self):
+        """
+        Shape of the data array (NumPy order, i.e. the first FITS axis last).
+        """
+        return tuple(int(self.header[f"NAXIS{i}"]) for i in range(int(self.header.get('NAXIS', 0)), 0, -1))
+
+    @property
+    def data_size(self):
+        """
+        Size in bytes of the data, including the heap of binary tables, without padding.
+        """
+        shape = self.shape
+        if len(shape) == 0:
+            return 0
+        if self.header.get('GROUPS') is True:
+            # random groups: NAXIS1 is 0 and does not count
+            shape = shape[:-1]
+        n_elements = int(np.prod(shape, dtype=np.int64))
+        return abs(int(self.header['BITPIX'])) // 8 * int(self.header.get('GCOUNT', 1)) * \
+            (int(self.header.get('PCOUNT', 0)) + n_elements)
+
+    @property
+    def end_offset(self):
+        """
+        Offset of the end of the HDU, including the padding of its data.
+        """
+        return self.data_offset + (self.data_size + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+    @property
+    def data(self):
+        """
+        Image data as a read-only memory mapped array, or a scaled copy if the HDU has
+        BSCALE/BZERO keys.
+        """
+        if len(self.shape) == 0:
+            return None
+        data = np.memmap(self.path, dtype=BITPIX_DTYPES[int(self.header['BITPIX'])], mode='r',
+            offset=self.data_offset, shape=self.shape)
+        return apply_scaling(data, self.header.get('BSCALE', 1), self.header.get('BZERO', 0))
+
+    def table(self):
+        return BinaryTable(self)
+
+
+
+def apply_scaling(values : np.ndarray, scale, zero):
+    """
+    Physical values of stored ones. Integers offset by an integer zero (e.g. unsigned integers,
+    stored with TZERO = 2^31) are returned as 64-bit integers, other scaled values as floats.
+    """
+    if scale == 1 and zero == 0:
+        return values
+    if scale == 1 and isinstance(zero, int) and values.dtype.kind in 'iu':
+        return values.astype(np.int64) + zero
+    return values * scale + zero
+
+
+
+def tform_dtype(tform : str):
+    """
+    NumPy type of a binary table column from its TFORMn value, e.g. `16I` or `8A`.
+    """
+    tform = tform.strip()
+    i = 0
+    while i < len(tform) and tform[i].isdigit():
+        i += 1
+    repeat = int(tform[:i]) if i > 0 else 1
+    code = tform[i]
+    if code == 'X':
+        return np.dtype(('u1', (repeat + 7) // 8))
+    if code == 'A':
+        return np.dtype(f"S{repeat}")
+    if code not in TFORM_DTYPES:
+        raise ValueError(f"Unsupported binary table column format {tform}.")
+    dtype, elements = TFORM_DTYPES[code]
+    if repeat * elements == 1:
+        return np.dtype(dtype)
+    return np.dtype((dtype, (repeat * elements,)))
+
+
+
+class BinaryTable:
+    """
+    Columns of a BINTABLE HDU, read on demand from a memory map of the file.
+    """
+    def __init__(self, hdu : HDU):
+        if hdu.header.get('XTENSION') != 'BINTABLE':
+            raise ValueError(f"HDU {hdu.name} of {hdu.path} is not a binary table.")
+        self.hdu = hdu
+        self.n_rows = int(hdu.header['NAXIS2'])
+        self.names, formats, offsets = [], [], []
+        offset = 0
+        for i in range(1, int(hdu.header['TFIELDS']) + 1):
+            dtype = tform_dtype(hdu.header[f"TFORM{i}"])
+            self.names.append(hdu.header.get(f"TTYPE{i}", f"col{i}"))
+            formats.append(dtype)
+            offsets.append(offset)
+            offset += dtype.itemsize
+        self.dtype = np.dtype({'names' : self.names, 'formats' : formats, 'offsets' : offsets,
+            'itemsize' : int(hdu.header['NAXIS1'])})
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = np.memmap(self.hdu.path, dtype=self.dtype, mode='r', offset=self.hdu.data_offset,
+                shape=(self.n_rows,))
+        return self._rows
+
+    def column(self, name : str):
+        """
+        Returns the values of a column (names are case insensitive, as in astropy): strings for
+        A columns, with trailing spaces removed, booleans for L and X columns, scaled values if
+        the column has TSCALn/TZEROn keys.
+        """
+        matches = [i for i, x in enumerate(self.names) if x.lower() == name.lower()]
+        if not matches:
+            raise KeyError(f"No column {name} in table {self.hdu.name} of {self.hdu.path}.")
+        i = matches[0]
+        values = self.rows[self.names[i]]
+        tform = self.hdu.header[f"TFORM{i + 1}"].strip()
+        if tform.endswith('A'):
+            return np.char.rstrip(np.char.decode(values, 'ascii'))
+        if tform.endswith('L'):
+            return values == b'T'
+        if tform.endswith('X'):
+            n_bits = int(tform[:-1] or 1)
+            return np.unpackbits(values, axis=-1)[..., :n_bits].astype(bool)
+        return apply_scaling(values, self.hdu.header.get(f"TSCAL{i + 1}", 1), self.hdu.header.get(f"TZERO{i + 1}", 0))
+
+    def __getitem__(self, name : str):
+        return self.column(name)
+
+
+
+def open_fits(path : str):
+    """
+    Returns the list of HDUs of a FITS file, reading only their headers.
+    """
+    hdus = []
+    with open(path, 'rb') as f:
+        while True:
+            cards = read_header(f)
+            if cards is None:
+                break
+            hdu = HDU(path, cards, f.tell())
+            hdus.append(hdu)
+            f.seek(hdu.end_offset)
+    return hdus
+
+
+
+def find_hdu(hdus : list, name : str):
+    for hdu in hdus:
+        if hdu.name.upper() == name.upper():
+            return hdu
+    raise KeyError(f"No HDU named {name}.")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Ledger of the submitted BLINK jobs, so that the same job is not submitted twice, e.g. when a
+search is run again with overlapping `--time-bins`/`--dm-bins`.
+
+Each job is identified by a canonical hash of the parameters defining its products (see
+`KEY_FIELDS`): observation, output directory and postfix, offset, duration, DM range, image
+size and the other imaging parameters, and module. The ledger is a file of JSON records, one
+per line, appended at every change, the last record of a job being its current state:
+
+- `SUBMITTED`: recorded with its job ID (`<job id>_<task>` for array tasks) and SLURM output
+  file when sbatch returned;
+- `PENDING`, `RUNNING`: as last seen in the queue;
+- `COMPLETED`, `FAILED`: the job left the queue, and `blink_pipeline` did or did not reach its
+  end marker in the SLURM output file (see `cost_model.py`).
+
+The state of a job still in the queue at the last check is refreshed (one squeue call) when
+it is looked up, so that a failed job can be submitted again. Jobs submitted, queued, running
+or completed are skipped by `blink-submit.py` unless `--resubmit` is given.
+
+The ledger of `blink-submit.py` is `blink_ledger.jsonl` in its data path prefix.
+
+Usage:
+    ledger.py coverage <obsid> --ledger <file>
+    ledger.py refresh --ledger <file>
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import slurm
+from cost_model import END_MARKER
+
+KEY_FIELDS = ('obsid', 'output_dir', 'postfix', 'offset', 'duration', 'dm_range', 'imgsize', 'oversampling',
+    'time_res', 'freq_avg_factor', 'n_antennas', 'flagged_antennas', 'ra', 'dec', 'dyspec', 'average_images', 'module')
+
+LEDGER_FILE_NAME = "blink_ledger.jsonl"
+
+ACTIVE_STATES = ('SUBMITTED', 'PENDING', 'RUNNING')
+# states of the jobs that must not be submitted again
+SKIPPED_STATES = ACTIVE_STATES + ('COMPLETED',)
+
+
+def canonical(value):
+    """
+    Value normalised for hashing: numbers as floats (so that 2 and 2.0 are the same), NumPy
+    scalars as Python ones, lists element-wise.
+    """
+    if hasattr(value, 'item') and not isinstance(value, (list, tuple)):
+        value = value.item()
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, (list, tuple)):
+        return [canonical(x) for x in value]
+    return str(value)
+
+
+
+def job_key(params : dict):
+    """
+    Returns the hash identifying the job with the given parameters.
+    """
+    fields = {k : canonical(params.get(k)) for k in KEY_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()[:20]
+
+
+
+def job_completed(output_file : str):
+    """
+    Whether the SLURM output file of a job shows that `blink_pipeline` completed.
+    """
+    if output_file is None or not os.path.exists(output_file):
+        return False
+    with open(output_file, errors='replace') as f:
+        return any(line.startswith(END_MARKER) for line in f)
+
+
+
+def pending_task_ids(job_id : str):
+    """
+    Returns the array task IDs listed together by squeue in a job ID such as 1234_[5-9%2] or
+    1234_[1,3-4].
+    """
+    tasks = set()
+    for token in job_id.split('[', 1)[1].split('%')[0].rstrip(']').split(','):
+        first, _, last = token.partition('-')
+        if first.isdigit() and (last == "" or last.isdigit()):
+            tasks.update(range(int(first), int(last or first) + 1))
+    return tasks
+
+
+
+class Ledger:
+    def __init__(self, path : str, resubmit : bool = False):
+        self.path = path
+        # if True, jobs are never skipped (but still recorded)
+        self.resubmit = resubmit
+        # job key -> last record
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for i, line in enumerate(f):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        print(f"Warning: skipping malformed record at {path}:{i + 1}")
+                        continue
+                    self.jobs[record['key']] = record
+
+    def record(self, key : str, **fields):
+        record = dict(self.jobs.get(key, {}), **fields, key=key, time=int(time.time()))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self.jobs[key] = record
+        return record
+
+    def submitted(self, key : str, params : dict, job_id, output_file : str):
+        return self.record(key, params=params, job_id=str(job_id), output_file=output_file, state='SUBMITTED')
+
+    def refresh(self, keys : list = None, queue = slurm.squeue):
+        """
+        Updates the state of the jobs (all of them, or the given ones) that were in the queue
+        at the last check.
+        """
+        active = [k for k in (keys if keys is not None else list(self.jobs)) if k in self.jobs and
+            self.jobs[k]['state'] in ACTIVE_STATES]
+        if not active:
+            return
+        job_ids = sorted({self.jobs[k]['job_id'].split('_')[0] for k in active})
+        jobs = queue(job_ids=job_ids)
+        states = {x['job_id'] : x['state'] for x in jobs}
+        # tasks of a pending array are listed together, e.g. as 1234_[5-9]
+        for x in jobs:
+            if '[' in x['job_id']:
+                states.update({f"{x['array_job_id']}_{i}" : x['state'] for i in pending_task_ids(x['job_id'])})
+        for key in active:
+            job = self.jobs[key]
+            state = states.get(job['job_id'])
+            if state is None:
+                state = 'COMPLETED' if job_completed(job.get('output_file')) else 'FAILED'
+            elif state not in ('PENDING', 'RUNNING'):
+                state = 'RUNNING' if state in ('CONFIGURING', 'COMPLETING') else 'PENDING'
+            if state != job['state']:
+                self.record(key, state=state)
+
+    def lookup(self, key : str, queue = slurm.squeue):
+        """
+        Returns the current record of a job, or None if it was never submitted.
+        """
+        self.refresh([key], queue)
+        return self.jobs.get(key)
+
+    def should_skip(self, key : str, refresh : bool = True, queue = slurm.squeue):
+        """
+        Returns the record of the job if it must not be submitted again, otherwise None.
+        """
+        if self.resubmit:
+            return None
+        job = self.lookup(key, queue) if refresh else self.jobs.get(key)
+        return job if job is not None and job['state'] in SKIPPED_STATES else None
+
+    def observation_jobs(self, obsid : int):
+        return [x for x in self.jobs.values() if int(x['params']['obsid']) == int(obsid)]
+
+
+
+def print_coverage(jobs : list):
+    """
+    Prints the jobs of an observation by output directory and DM range, and the number of
+    seconds of data in completed and active jobs.
+    """
+    groups = {}
+    for job in jobs:
+        params = job['params']
+        groups.setdefault((params['output_dir'], str(params.get('dm_range'))), []).append(job)
+    for (output_dir, dm_range), group in sorted(groups.items()):
+        print(f"{output_dir} DM range {dm_range}:")
+        seconds = {}
+        for job in sorted(group, key=lambda x : (x['params']['offset'], x['time'])):
+            params = job['params']
+            print(f"    offset {params['offset']:>6} duration {params['duration']:>6} {job['state']:<10} job {job['job_id']}")
+            covered = seconds.setdefault(job['state'], set())
+            if params['duration'] is not None and params['duration'] >= 0:
+                covered.update(range(params['offset'], params['offset'] + params['duration']))
+        done = seconds.get('COMPLETED', set())
+        active = set().union(*[seconds.get(x, set()) for x in ACTIVE_STATES]) - done
+        print(f"    {len(done)} seconds completed, {len(active)} more in submitted jobs")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the ledger of the submitted BLINK jobs.")
+    parser.add_argument("command", choices=["coverage", "refresh"])
+    parser.add_argument("obsid", type=int, nargs='?', default=None, help="Observation ID (coverage).")
+    parser.add_argument("--ledger", type=str, required=True, help="Ledger file (see blink-submit.py).")
+    args = parser.parse_args()
+
+    ledger = Ledger(args.ledger)
+    ledger.refresh()
+    if args.command == "coverage":
+        if args.obsid is None:
+            parser.error("coverage needs an observation ID.")
+        jobs = ledger.observation_jobs(args.obsid)
+        print(f"{len(jobs)} jobs of observation {args.obsid} in {args.ledger}.")
+        print_coverage(jobs)
+    else:
+        counts = {}
+        for job in ledger.jobs.values():
+            counts[job['state']] = counts.get(job['state'], 0) + 1
+        print(", ".join(f"{n} {state}" for state, n in sorted(counts.items())))
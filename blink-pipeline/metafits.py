@@ -0,0 +1,152 @@
+"""
+Metadata layer for MWA metafits files.
+
+A metafits file is parsed once into a compact, array-backed `Metafits` record holding the
+primary header keys and the per-input columns of the TILEDATA table. The record is cached:
+in memory for the lifetime of the process, and on disk as a NumPy `.npz` file keyed by the
+metafits path, modification time and size, so that later runs do not pay for FITS parsing.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+import fits_reader
+
+# Can be overridden with the BLINK_METAFITS_CACHE environment variable.
+# Set it to an empty string to disable the on-disk cache.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "blink-workflows", "metafits")
+
+# MWA coarse channel width in MHz
+COARSE_CHANNEL_WIDTH = 1.28
+
+# Bump when the layout of the cached record changes.
+CACHE_VERSION = 1
+
+_memory_cache = {}
+
+
+class Metafits:
+    """
+    Parsed content of a metafits file. There is one entry per input (i.e. two per tile,
+    one per polarisation) in the array attributes, in the same order as the TILEDATA table.
+    """
+    def __init__(self, header : dict, antenna, tile, tile_names, pol, flag, positions):
+        self.header = header
+        self.antenna = np.asarray(antenna, dtype=np.int32)
+        self.tile = np.asarray(tile, dtype=np.int32)
+        self.tile_names = np.asarray(tile_names, dtype=str)
+        self.pol = np.asarray(pol, dtype=str)
+        self.flag = np.asarray(flag, dtype=np.int32)
+        # East, North, Height in metres
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+
+    @property
+    def n_antennas(self):
+        return len(self.antenna) // 2
+
+    def observed_band(self):
+        """
+        Returns the lowest and highest observed frequency in MHz, from the coarse channel
+        numbers if available, otherwise from the central frequency and bandwidth.
+        """
+        if 'CHANNELS' in self.header:
+            channels = self.coarse_channels()
+            return (min(channels) - 0.5) * COARSE_CHANNEL_WIDTH, (max(channels) + 0.5) * COARSE_CHANNEL_WIDTH
+        half_bandwidth = self.header['BANDWDTH'] / 2
+        return self.header['FREQCENT'] - half_bandwidth, self.header['FREQCENT'] + half_bandwidth
+
+    def coarse_channels(self):
+        """
+        Returns the receiver channel numbers of the observed coarse channels, which name the
+        voltage files (see `obs_index.py`).
+        """
+        return [int(x) for x in str(self.header['CHANNELS']).split(',')]
+
+    def gps_span(self):
+        """
+        Returns the first GPS second and the number of seconds of the observation.
+        """
+        return int(self.header['GPSTIME']), int(self.header['EXPOSURE'])
+
+    def tiles(self):
+        """
+        Returns the indices of the first input of each tile, sorted by tile name.
+        """
+        _, rows = np.unique(self.tile_names, return_index=True)
+        return rows
+
+    def to_arrays(self):
+        return {
+            'header' : np.array(json.dumps(self.header)),
+            'antenna' : self.antenna,
+            'tile' : self.tile,
+            'tile_names' : self.tile_names,
+            'pol' : self.pol,
+            'flag' : self.flag,
+            'positions' : self.positions
+        }
+
+    @staticmethod
+    def from_arrays(arrays):
+        return Metafits(json.loads(str(arrays['header'])), arrays['antenna'], arrays['tile'],
+            arrays['tile_names'], arrays['pol'], arrays['flag'], arrays['positions'])
+
+
+
+def parse_metafits(metafits_file):
+    """
+    Reads a metafits file and returns the corresponding `Metafits` record. Only the primary
+    header and the needed columns of the TILEDATA table are read, without astropy.
+    """
+    hdus = fits_reader.open_fits(metafits_file)
+    header = {key : value for key, value in hdus[0].header.items() if isinstance(value, (bool, int, float, str))}
+    data = hdus[1].table()
+    return Metafits(header, data['Antenna'], data['Tile'], data['TileName'], data['Pol'], data['Flag'],
+        np.column_stack([data['East'], data['North'], data['Height']]))
+
+
+
+def cache_file_path(metafits_file, cache_dir):
+    path_hash = hashlib.sha1(os.path.abspath(metafits_file).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{path_hash}.npz")
+
+
+
+def load_metafits(metafits_file, cache_dir = None):
+    """
+    Returns the `Metafits` record of the given file, parsing the file only if it is
+    neither in the memory nor in the on-disk cache (or the file changed since it was cached).
+    """
+    if cache_dir is None:
+        cache_dir = os.getenv("BLINK_METAFITS_CACHE", DEFAULT_CACHE_DIR)
+    stat = os.stat(metafits_file)
+    key = (os.path.abspath(metafits_file), stat.st_mtime_ns, stat.st_size)
+    if key in _memory_cache:
+        return _memory_cache[key]
+
+    cache_file = cache_file_path(metafits_file, cache_dir) if cache_dir else None
+    record = None
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with np.load(cache_file) as arrays:
+                if arrays['key'].tolist() == [CACHE_VERSION, stat.st_mtime_ns, stat.st_size]:
+                    record = Metafits.from_arrays(arrays)
+        except (OSError, ValueError, KeyError):
+            # corrupted or incompatible cache entry, will be overwritten
+            record = None
+
+    if record is None:
+        record = parse_metafits(metafits_file)
+        if cache_file is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                # write to a temporary file first so that concurrent readers never see a partial file
+                tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+                with open(tmp_file, 'wb') as f:
+                    np.savez(f, key=np.array([CACHE_VERSION, stat.st_mtime_ns, stat.st_size]), **record.to_arrays())
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                print(f"Warning: could not write metafits cache file {cache_file}: {e}")
+
+    _memory_cache[key] = record
+    return record
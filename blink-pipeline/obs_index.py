@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Index of the voltage files of an observation's `combined` directory.
+
+The directory is scanned once and summarised in a compact manifest, a (GPS second x coarse channel)
+matrix of file sizes (-1 meaning missing), saved next to the directory. When the directory changes,
+the index is refreshed incrementally: only files not seen before, or whose size was not final, are
+stat'ed again. Files still being written in place do not change the directory's modification time,
+so the files of the index whose size was not final are stat'ed again even when it is unchanged.
+Submission scripts use the index to find the seconds with complete data instead of listing the
+directory every time.
+
+The index only knows the files present. A coarse channel missing for every second, or seconds
+missing at the end of the observation, only show up once the index is compared with the channels
+and the time span the observation should have, from its metafits file (see `with_expected`).
+Offsets count from the first second with files, the one `blink_pipeline` counts them from:
+seconds missing before it are reported separately.
+
+Usage:
+    obs_index.py <combined dir> [--metafits <metafits file>]
+    obs_index.py --list-complete <start GPS second> <end GPS second> <combined dir>
+"""
+import argparse
+import os
+import re
+import sys
+import numpy as np
+
+FILE_PATTERN = re.compile(r"^(\d+)_(\d+)_ch(\d+)\.dat$")
+
+# Bump when the layout of the saved index changes.
+INDEX_VERSION = 2
+
+
+class ObservationIndex:
+    """
+    `sizes[i, j]` is the size in bytes of the file of second `gps[i]` and coarse channel `channels[j]`,
+    or -1 if the file is missing.
+    """
+    def __init__(self, obsid : int, gps, channels, sizes, dir_mtime_ns : int = 0, missing_before : int = 0):
+        self.obsid = obsid
+        self.gps = np.asarray(gps, dtype=np.int64)
+        self.channels = np.asarray(channels, dtype=np.int64)
+        self.sizes = np.asarray(sizes, dtype=np.int64).reshape(len(self.gps), len(self.channels))
+        self.dir_mtime_ns = dir_mtime_ns
+        # number of seconds of the observation without files before the first one with files
+        self.missing_before = missing_before
+
+    @property
+    def start_gps(self):
+        return int(self.gps[0]) if len(self.gps) > 0 else None
+
+    @property
+    def n_seconds(self):
+        """
+        Number of seconds between the first and the last one with data, inclusive.
+        """
+        return int(self.gps[-1] - self.gps[0] + 1) if len(self.gps) > 0 else 0
+
+    def expected_size(self):
+        """
+        The most common file size, taken as the size of a complete file.
+        """
+        present = self.sizes[self.sizes >= 0]
+        if len(present) == 0:
+            return 0
+        values, counts = np.unique(present, return_counts=True)
+        return int(values[np.argmax(counts)])
+
+    def complete_seconds(self):
+        """
+        Boolean mask over the seconds from the first to the last one (see `n_seconds`), true
+        where all the coarse channels are present with the expected size.
+        """
+        complete = np.zeros(self.n_seconds, dtype=bool)
+        if self.n_seconds == 0:
+            return complete
+        complete[self.gps - self.gps[0]] = (self.sizes == self.expected_size()).all(axis=1)
+        return complete
+
+    def complete_segments(self, min_length : int = 1):
+        """
+        Returns the list of (offset, length) of the runs of consecutive complete seconds,
+        offsets being relative to the first second of the observation.
+        """
+        complete = np.concatenate([[False], self.complete_seconds(), [False]])
+        edges = np.flatnonzero(np.diff(complete.astype(np.int8)))
+        segments = [(int(s), int(e - s)) for s, e in zip(edges[::2], edges[1::2])]
+        return [x for x in segments if x[1] >= min_length]
+
+    def complete_gps_seconds(self, start_gps : int = None, end_gps : int = None):
+        """
+        Returns the GPS seconds with complete data within the given range, inclusive.
+        """
+        seconds = self.gps[0] + np.flatnonzero(self.complete_seconds()) if self.n_seconds > 0 else self.gps
+        if start_gps is not None: seconds = seconds[seconds >= start_gps]
+        if end_gps is not None: seconds = seconds[seconds <= end_gps]
+        return seconds.tolist()
+
+    def with_expected(self, channels : list, start_gps : int, n_seconds : int):
+        """
+        Returns the index extended to the coarse channels and the time span (first GPS second and
+        number of seconds) of the observation, e.g. from its metafits file: expected files
+        missing from the directory are missing in the returned index. Seconds missing before the
+        first one with files are only counted in `missing_before`.
+        """
+        channels = np.union1d(self.channels, np.asarray(channels, dtype=np.int64))
+        end_gps = start_gps + n_seconds - 1
+        if len(self.gps) > 0:
+            gps = np.union1d(self.gps, np.arange(self.gps[0], end_gps + 1, dtype=np.int64))
+            missing_before = max(int(self.gps[0]) - start_gps, 0)
+        else:
+            gps, missing_before = np.arange(start_gps, end_gps + 1, dtype=np.int64), 0
+        sizes = np.full((len(gps), len(channels)), -1, dtype=np.int64)
+        sizes[np.ix_(np.searchsorted(gps, self.gps), np.searchsorted(channels, self.channels))] = self.sizes
+        return ObservationIndex(self.obsid, gps, channels, sizes, self.dir_mtime_ns, missing_before)
+
+    def file_name(self, gps : int, channel : int):
+        return f"{self.obsid}_{gps}_ch{channel:03d}.dat"
+
+    def save(self, path : str):
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, version=INDEX_VERSION, obsid=self.obsid, gps=self.gps, channels=self.channels,
+                sizes=self.sizes, dir_mtime_ns=self.dir_mtime_ns)
+        os.replace(tmp_file, path)
+
+    @staticmethod
+    def load(path : str):
+        with np.load(path) as data:
+            if int(data['version']) != INDEX_VERSION:
+                raise ValueError(f"Index {path} has an incompatible version.")
+            return ObservationIndex(int(data['obsid']), data['gps'], data['channels'], data['sizes'], int(data['dir_mtime_ns']))
+
+
+
+def default_index_path(combined_dir : str):
+    return os.path.normpath(combined_dir) + ".index.npz"
+
+
+
+def refresh_incomplete(index : ObservationIndex, combined_dir : str):
+    """
+    Updates the sizes of the files of the index present with a size other than the expected one,
+    e.g. still being written. Returns whether any size changed.
+    """
+    expected = index.expected_size()
+    changed = False
+    for i, j in zip(*np.nonzero((index.sizes >= 0) & (index.sizes != expected))):
+        try:
+            size = os.stat(os.path.join(combined_dir, index.file_name(int(index.gps[i]), int(index.channels[j])))).st_size
+        except FileNotFoundError:
+            size = -1
+        if size != index.sizes[i, j]:
+            index.sizes[i, j] = size
+            changed = True
+    return changed
+
+
+
+def save_index(index : ObservationIndex, index_file : str):
+    try:
+        index.save(index_file)
+    except OSError as e:
+        print(f"Warning: could not save the observation index {index_file}: {e}", file=sys.stderr)
+
+
+
+def build_index(combined_dir : str, index_file : str = None, save : bool = True):
+    """
+    Returns the index of the given directory, loading the saved one and refreshing it
+    incrementally if the directory, or a file whose size was not final, was modified since
+    (see the module documentation). The updated index is saved to
+    `index_file` (default: next to the directory) if `save` is set.
+    """
+    if index_file is None:
+        index_file = default_index_path(combined_dir)
+    dir_mtime_ns = os.stat(combined_dir).st_mtime_ns
+    old = None
+    if os.path.exists(index_file):
+        try:
+            old = ObservationIndex.load(index_file)
+        except (OSError, ValueError, KeyError):
+            old = None
+        if old is not None and old.dir_mtime_ns == dir_mtime_ns:
+            if refresh_incomplete(old, combined_dir) and save:
+                save_index(old, index_file)
+            return old
+
+    files = {}
+    obsid = None
+    for name in os.listdir(combined_dir):
+        match = FILE_PATTERN.match(name)
+        if match is None: continue
+        obsid = int(match.group(1))
+        files[(int(match.group(2)), int(match.group(3)))] = name
+
+    # sizes known from the previous index that can be trusted to be final
+    known = {}
+    if old is not None:
+        expected = old.expected_size()
+        for i, gps in enumerate(old.gps.tolist()):
+            for j, channel in enumerate(old.channels.tolist()):
+                if old.sizes[i, j] == expected and expected > 0:
+                    known[(gps, channel)] = expected
+
+    gps_values = sorted(set(x[0] for x in files))
+    channels = sorted(set(x[1] for x in files))
+    gps_pos = {x : i for i, x in enumerate(gps_values)}
+    channel_pos = {x : i for i, x in enumerate(channels)}
+    sizes = np.full((len(gps_values), len(channels)), -1, dtype=np.int64)
+    for key, name in files.items():
+        size = known.get(key)
+        if size is None:
+            size = os.stat(os.path.join(combined_dir, name)).st_size
+        sizes[gps_pos[key[0]], channel_pos[key[1]]] = size
+
+    index = ObservationIndex(obsid if obsid is not None else 0, gps_values, channels, sizes, dir_mtime_ns)
+    if save:
+        save_index(index, index_file)
+    return index
+
+
+
+def format_gaps(index : ObservationIndex):
+    """
+    Returns a human readable list of the ranges of seconds with missing or incomplete data.
+    """
+    complete = index.complete_seconds()
+    gaps = []
+    i = 0
+    while i < len(complete):
+        if complete[i]:
+            i += 1
+            continue
+        j = i
+        while j < len(complete) and not complete[j]: j += 1
+        gaps.append(f"{i}" if j == i + 1 else f"{i}-{j - 1}")
+        i = j
+    return gaps
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the index of an observation's combined directory.")
+    parser.add_argument("combined_dir", type=str, help="Directory with the {obsid}_{gps}_ch{channel}.dat files.")
+    parser.add_argument("--index", type=str, default=None, help="Index file. Default: <combined_dir>.index.npz")
+    parser.add_argument("--list-complete", type=int, nargs=2, default=None, metavar=("START", "END"),
+        help="Only print the GPS seconds with complete data between START and END (inclusive), one per line.")
+    parser.add_argument("--metafits", type=str, default=None, help="Metafits file of the observation, giving the coarse " \
+        "channels and the time span expected in the directory.")
+    args = parser.parse_args()
+
+    index = build_index(args.combined_dir, args.index)
+    if args.metafits is not None:
+        from metafits import load_metafits
+        metadata = load_metafits(args.metafits)
+        index = index.with_expected(metadata.coarse_channels(), *metadata.gps_span())
+    if args.list_complete is not None:
+        for gps in index.complete_gps_seconds(*args.list_complete):
+            print(gps)
+        exit(0)
+    print(f"Observation {index.obsid}: {index.n_seconds} seconds from GPS time {index.start_gps}, {len(index.channels)} coarse channels.")
+    if index.missing_before > 0:
+        print(f"No data for the first {index.missing_before} seconds of the observation.")
+    gaps = format_gaps(index)
+    print(f"Seconds with complete data: {int(index.complete_seconds().sum())}")
+    if len(gaps) > 0:
+        print("Seconds (offsets) with missing or incomplete data: " + ", ".join(gaps))
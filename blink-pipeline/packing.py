@@ -0,0 +1,56 @@
+"""
+Pack search cells into GPU allocations.
+
+An allocation of `GPUS_PER_JOB` GPUs is split in lanes of a few GPUs each. Each lane runs
+its cells one after the other, as `srun` steps pinned to the lane's GPUs, and the lanes run
+at the same time. Cells are placed in decreasing order of predicted runtime on the least
+loaded lane where they fit within the allocation's walltime (longest processing time first),
+so that the lanes of an allocation finish at about the same time. A new allocation is opened
+only when no lane has room left for a cell.
+"""
+
+
+def scaled_runtime(runtime : float, gpus : int, total_gpus : int, scaling : float = 1.0):
+    """
+    Predicted runtime of a job on `gpus` GPUs, given its runtime on `total_gpus` GPUs.
+    With `scaling` = 1 the runtime grows linearly as GPUs are removed; lower values model
+    jobs that do not keep all the GPUs busy.
+    """
+    return runtime * (total_gpus / gpus)**scaling
+
+
+
+def pack(runtimes : list, n_lanes : int, capacity : float):
+    """
+    Packs items with the given runtimes into allocations of `n_lanes` lanes, the total
+    runtime of each lane not exceeding `capacity`.
+
+    Returns the list of allocations, each one a list of `n_lanes` lists of item indices,
+    and the list of the indices of the items longer than `capacity`.
+    """
+    allocations, loads, oversized = [], [], []
+    for i in sorted(range(len(runtimes)), key=lambda x : -runtimes[x]):
+        runtime = runtimes[i]
+        if runtime > capacity:
+            oversized.append(i)
+            continue
+        placed = False
+        for lanes, lane_loads in zip(allocations, loads):
+            lane = min(range(n_lanes), key=lambda x : lane_loads[x])
+            if lane_loads[lane] + runtime <= capacity:
+                lanes[lane].append(i)
+                lane_loads[lane] += runtime
+                placed = True
+                break
+        if not placed:
+            allocations.append([[i]] + [[] for _ in range(n_lanes - 1)])
+            loads.append([runtime] + [0.0] * (n_lanes - 1))
+    return allocations, oversized
+
+
+
+def allocation_runtime(lanes : list, runtimes : list):
+    """
+    Runtime of an allocation: the runtime of its longest lane.
+    """
+    return max(sum(runtimes[i] for i in lane) for lane in lanes)
@@ -0,0 +1,101 @@
+"""
+Work out how much of a search has been done by reading an observation's output directory,
+so that only the missing parts are resubmitted.
+
+Search jobs write their products with the `start_second_{offset}_dm_range_{min}_{max}_{step}`
+postfix, and one dynamic spectrum file per second of data processed. A job that completed
+is recognised from its SLURM output file, where the end marker follows the logged
+`blink_pipeline` command line (see `cost_model.py`).
+"""
+import os
+import re
+import shlex
+from cost_model import COMMAND_MARKER, END_MARKER
+
+# DM bounds and steps may be decimal, e.g. in the ranges of `--dm-plan` (see `dispersion.py`).
+DM_PATTERN = r"\d+(?:\.\d+)?"
+POSTFIX_PATTERN = re.compile(rf"start_second_(\d+)_dm_range_({DM_PATTERN})_({DM_PATTERN})_({DM_PATTERN})")
+
+
+def postfix_key(postfix : str):
+    """
+    Returns the (start second, DM range) pair encoded in a product postfix, or None.
+    """
+    match = POSTFIX_PATTERN.search(postfix)
+    if match is None:
+        return None
+    return int(match.group(1)), ":".join(match.group(i) for i in (2, 3, 4))
+
+
+
+def scan_output_dir(output_dir : str):
+    """
+    Returns a dictionary mapping the (start second, DM range) of each run found in the output
+    directory to a dictionary with the number of seconds with products (`products`), and, if the
+    run's SLURM output was found, the number of seconds requested (`duration`) and whether
+    the run completed (`completed`).
+    """
+    runs = {}
+    if not os.path.isdir(output_dir):
+        return runs
+    for name in os.listdir(output_dir):
+        if name.startswith("dynamic_spectrum_") and name.endswith(".fits"):
+            key = postfix_key(name)
+            if key is None: continue
+            run = runs.setdefault(key, {'products' : 0, 'duration' : None, 'completed' : False})
+            run['products'] += 1
+        elif name.startswith("slurm-") and name.endswith(".out"):
+            postfix, duration, completed = None, None, False
+            with open(os.path.join(output_dir, name), errors='replace') as f:
+                for line in f:
+                    if line.startswith(COMMAND_MARKER):
+                        tokens = shlex.split(line[len(COMMAND_MARKER):])
+                        for option, value in zip(tokens, tokens[1:]):
+                            if option == "-p": postfix = value
+                            elif option == "-Q": duration = int(value)
+                    elif line.startswith(END_MARKER):
+                        completed = True
+            key = None if postfix is None else postfix_key(postfix)
+            if key is None: continue
+            run = runs.setdefault(key, {'products' : 0, 'duration' : None, 'completed' : False})
+            run['duration'] = duration
+            run['completed'] = run['completed'] or completed
+    return runs
+
+
+
+def seconds_done(offset : int, duration : int, dm_range : str, runs : dict):
+    """
+    Number of consecutive seconds, starting at `offset`, of the given DM range that have
+    been processed by the runs found in the output directory.
+    """
+    covered = []
+    for (start, run_dm_range), run in runs.items():
+        if run_dm_range != dm_range or start < offset or start >= offset + duration: continue
+        if run['completed'] and run['duration'] is not None:
+            n_seconds = run['duration']
+        else:
+            # the last product of an interrupted run may be incomplete
+            n_seconds = max(run['products'] - 1, 0)
+        if n_seconds > 0:
+            covered.append((start, start + n_seconds))
+    done_until = offset
+    for start, end in sorted(covered):
+        if start > done_until: break
+        done_until = max(done_until, end)
+    return min(done_until - offset, duration)
+
+
+
+def plan_resume(cells : list, output_dir : str):
+    """
+    Returns the search cells still to be processed, with offset and duration shortened
+    to skip the seconds already processed. Cells fully processed are dropped.
+    """
+    runs = scan_output_dir(output_dir)
+    remaining = []
+    for cell in cells:
+        done = seconds_done(cell.offset, cell.duration, cell.dm_range, runs)
+        if done >= cell.duration: continue
+        remaining.append(cell._replace(offset=cell.offset + done, duration=cell.duration - done))
+    return remaining
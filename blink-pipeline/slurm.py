@@ -0,0 +1,145 @@
+"""
+Thin interface to the SLURM command line tools.
+
+The commands invoked can be overridden with the BLINK_SBATCH, BLINK_SQUEUE and BLINK_SINFO
+environment variables, e.g. to point them to the stand-ins in the `fake_slurm` directory when
+testing away from a cluster.
+"""
+import os
+import re
+import subprocess
+
+
+def sbatch_command():
+    return os.getenv("BLINK_SBATCH", "sbatch")
+
+
+def squeue_command():
+    return os.getenv("BLINK_SQUEUE", "squeue")
+
+
+def sinfo_command():
+    return os.getenv("BLINK_SINFO", "sinfo")
+
+
+
+def sbatch(sbatch_args : str, script : str = None):
+    """
+    Submits a job and returns its ID. `sbatch_args` is a shell-quoted string of sbatch options
+    (possibly including --wrap), `script` the optional path of the batch script to submit.
+    """
+    command_line = f"{sbatch_command()} --parsable {sbatch_args}"
+    if script is not None:
+        command_line += f" {script}"
+    result = subprocess.run(command_line, shell=True, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"sbatch failed with exit code {result.returncode}: {result.stderr.strip()}")
+    # --parsable prints "jobid" or "jobid;cluster"
+    return int(result.stdout.strip().split(';')[0])
+
+
+
+def array_spec(n_tasks : int, throttle : int = 0):
+    """
+    Returns the value of the sbatch --array option for `n_tasks` tasks, indexed from 0,
+    with at most `throttle` tasks running at the same time (0 means no limit).
+    """
+    if n_tasks <= 0:
+        raise ValueError("A job array needs at least one task.")
+    spec = f"0-{n_tasks - 1}"
+    if throttle > 0:
+        spec += f"%{throttle}"
+    return spec
+
+
+
+def write_parameter_table(path : str, columns : list, rows : list):
+    """
+    Writes a whitespace separated table whose first column is the array task index,
+    to be read by the array batch script through SLURM_ARRAY_TASK_ID.
+    """
+    with open(path, "w") as f:
+        f.write("# task " + " ".join(columns) + "\n")
+        for i, row in enumerate(rows):
+            if len(row) != len(columns):
+                raise ValueError(f"Row {i} has {len(row)} values, expected {len(columns)}.")
+            f.write(f"{i} " + " ".join(str(x) for x in row) + "\n")
+
+
+
+def squeue(user : str = None, job_ids : list = None):
+    """
+    Returns the list of jobs in the queue as dictionaries with keys
+    `job_id` (e.g. "1234" or "1234_5"), `array_job_id`, `state`, `name` and `time_limit`.
+    """
+    command_line = [squeue_command(), "--noheader", "--format=%i|%F|%T|%l|%j"]
+    if job_ids:
+        command_line.append(f"--jobs={','.join(str(x) for x in job_ids)}")
+    elif user is not None:
+        command_line.append(f"--user={user}")
+    result = subprocess.run(command_line, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"squeue failed with exit code {result.returncode}: {result.stderr.strip()}")
+    jobs = []
+    for line in result.stdout.splitlines():
+        tokens = line.strip().split('|', 4)
+        if len(tokens) != 5: continue
+        jobs.append({'job_id' : tokens[0], 'array_job_id' : tokens[1], 'state' : tokens[2],
+            'time_limit' : tokens[3], 'name' : tokens[4]})
+    return jobs
+
+
+
+def run_query(command_line : list):
+    result = subprocess.run(command_line, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"{command_line[0]} failed with exit code {result.returncode}: {result.stderr.strip()}")
+    return result.stdout
+
+
+
+def node_states(partition : str):
+    """
+    Returns the output of sinfo for a partition, one `<node state>|<number of nodes>` per line.
+    """
+    return run_query([sinfo_command(), "--noheader", f"--partition={partition}", "--format=%T|%D"])
+
+
+
+def expected_starts(partition : str):
+    """
+    Returns the output of squeue --start for the pending jobs of a partition, one
+    `<expected start time>|<number of nodes>` per line.
+    """
+    return run_query([squeue_command(), "--start", "--noheader", f"--partition={partition}", "--states=PENDING", "--format=%S|%D"])
+
+
+
+def parse_time_limit(time_limit : str):
+    """
+    Converts a SLURM time specification ([days-]hours:minutes:seconds, or minutes) to seconds.
+    """
+    match = re.fullmatch(r"(?:(\d+)-)?(\d+)(?::(\d+))?(?::(\d+))?", time_limit.strip())
+    if match is None:
+        raise ValueError(f"Malformed time limit: {time_limit}")
+    days, first, second, third = match.groups()
+    # with a days prefix, even 0-, the first field is hours
+    has_days = days is not None
+    days = int(days) if has_days else 0
+    if second is None:
+        # only minutes, or days-hours
+        seconds = int(first) * (3600 if has_days else 60)
+    elif third is None:
+        seconds = int(first) * 3600 + int(second) * 60 if has_days else int(first) * 60 + int(second)
+    else:
+        seconds = int(first) * 3600 + int(second) * 60 + int(third)
+    return days * 86400 + seconds
+
+
+
+def format_time_limit(seconds : int):
+    """
+    Converts seconds to a SLURM time specification (hours:minutes:seconds).
+    """
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,235 @@
+"""
+I/O staging and Lustre striping policy of BLINK jobs.
+
+By default BLINK jobs read the voltage files of the observation's `combined` directory from
+the shared scratch filesystem and write their products back there, thousands of small image
+and dynamic spectrum files per job. With many search jobs running at the same time, the
+metadata servers become a bottleneck. A staging policy, a dictionary built by `make_policy`
+and enabled per job (see `blink-submit.py`), can:
+
+- create the output directories with a Lustre layout (stripe count, stripe size, OST pool,
+  e.g. the flash pool) inherited by the files written there;
+- copy the job's inputs (metafits, calibration solutions, and the voltage files of the seconds
+  it processes, known from its offset and duration) to node-local storage, in the background
+  while the job starts up (loading its modules), the job waiting for the copy only before
+  running `blink_pipeline`. If any input cannot be copied, the job reads all of them from the
+  shared filesystem instead. `blink_pipeline` counts the offset of the job (-X) from the first
+  second in its input directory: the files of the first second present in the `combined`
+  directory (`start_gps` of the policy, see `observation_policy`) are linked in the node-local
+  directory too, so that the offsets of the job keep their meaning;
+- have the job write its products to node-local storage, and copy them back when it ends,
+  bundling the files smaller than a threshold in a tar archive per job. Products read by the
+  other tools (dynamic spectra, candidates and total power files) are never bundled.
+
+Layouts are applied through a filesystem backend: `lustre` runs `lfs setstripe` (the command
+can be overridden with the BLINK_LFS environment variable), `none` only creates directories,
+e.g. to test the submission scripts away from Lustre. Products written to node-local storage
+by a job killed at its time limit are lost: use it with walltimes from the cost model.
+"""
+import os
+import subprocess
+
+# Default node-local directory of the compute nodes.
+DEFAULT_LOCAL_DIR = "/tmp"
+
+# Products never bundled, as they are read by resume.py, totalpower.py and candidates.py.
+UNBUNDLED_PATTERNS = ['dynamic_spectrum_*', '*cand*', '*.power', 'fits_list_*']
+
+
+def lfs_command():
+    return os.getenv("BLINK_LFS", "lfs")
+
+
+
+def make_policy(stripe_count : int = None, stripe_size : str = None, pool : str = None, stage_inputs : bool = False,
+        stage_outputs : bool = False, bundle_size : int = 0, local_dir : str = DEFAULT_LOCAL_DIR, copy_workers : int = 8,
+        backend : str = "lustre"):
+    """
+    Returns a staging policy, or None if it does nothing (the default behaviour of the jobs).
+    """
+    if backend not in FILESYSTEMS:
+        raise ValueError(f"Unknown filesystem backend: {backend}")
+    if stripe_count is None and stripe_size is None and pool is None and not stage_inputs and not stage_outputs:
+        return None
+    return {'stripe_count' : stripe_count, 'stripe_size' : stripe_size, 'pool' : pool, 'stage_inputs' : stage_inputs,
+        'stage_outputs' : stage_outputs, 'bundle_size' : bundle_size, 'local_dir' : local_dir,
+        'copy_workers' : copy_workers, 'backend' : backend}
+
+
+
+class NullFilesystem:
+    """
+    Filesystem without layouts: directories are only created.
+    """
+    def layout_command(self, path : str, policy : dict):
+        return None
+
+    def make_dir(self, path : str, policy : dict):
+        os.makedirs(path, exist_ok=True)
+
+
+
+class LustreFilesystem(NullFilesystem):
+    def layout_command(self, path : str, policy : dict):
+        """
+        Returns the command setting the default layout of the files created in a directory,
+        or None if the policy does not set one.
+        """
+        options = ""
+        if policy.get('stripe_count') is not None:
+            options += f" -c {policy['stripe_count']}"
+        if policy.get('stripe_size') is not None:
+            options += f" -S {policy['stripe_size']}"
+        if policy.get('pool') is not None:
+            options += f" -p {policy['pool']}"
+        if options == "":
+            return None
+        return f"{lfs_command()} setstripe{options} {path}"
+
+    def make_dir(self, path : str, policy : dict):
+        super().make_dir(path, policy)
+        command = self.layout_command(path, policy)
+        if command is None:
+            return
+        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Warning: could not set the layout of {path}: {result.stderr.strip()}")
+
+
+
+FILESYSTEMS = {'lustre' : LustreFilesystem(), 'none' : NullFilesystem()}
+
+
+def filesystem(policy : dict):
+    return FILESYSTEMS[policy['backend']] if policy is not None else FILESYSTEMS['none']
+
+
+
+def make_output_dir(path : str, policy : dict = None):
+    """
+    Creates an output directory with the layout of the staging policy (if not None).
+    """
+    filesystem(policy).make_dir(path, policy)
+
+
+
+def make_dir_commands(path : str, policy : dict = None):
+    """
+    Shell commands creating an output directory from a job, see `make_output_dir`.
+    """
+    commands = f"mkdir -p {path}; "
+    layout = filesystem(policy).layout_command(path, policy)
+    if layout is not None:
+        commands += f"{layout} || true; "
+    return commands
+
+
+
+def observation_policy(policy : dict, obsid : int, start_gps : int, channels : list):
+    """
+    Adds to a policy what the jobs of an observation need to know to stage their inputs:
+    the voltage files are named after the observation ID, GPS second and coarse channel
+    (see `ObservationIndex.file_name`). `start_gps` is the first second with files in the
+    `combined` directory, the one job offsets count from.
+    """
+    if policy is None or not policy['stage_inputs']:
+        return policy
+    return dict(policy, obsid=int(obsid), start_gps=int(start_gps), channels=[int(x) for x in channels])
+
+
+
+def prefetch_commands(policy : dict, paths : dict, start_offset, duration):
+    """
+    Shell commands creating the job's node-local directory `$BLINK_STAGE` and, if the policy
+    stages inputs, starting the copy of its inputs there in the background (process
+    `$BLINK_STAGE_PID`). The paths of the inputs read by `blink_pipeline` are set in
+    `$BLINK_COMBINED`, `$BLINK_METAFITS` and `$BLINK_SOLUTIONS` (see `staged_paths` and
+    `wait_commands`). `start_offset` and `duration` may be shell variable references; all the
+    seconds are copied if `duration` is negative. Missing files (gaps) are not copied.
+    """
+    if policy is None or not (policy['stage_inputs'] or policy['stage_outputs']):
+        return ""
+    commands = f"BLINK_STAGE={policy['local_dir']}/blink_${{SLURM_JOB_ID}}_${{BASHPID:-$$}}; " \
+        "mkdir -p $BLINK_STAGE/combined $BLINK_STAGE/output; "
+    if not policy['stage_inputs']:
+        return commands
+    combined = paths['combined_files_path']
+    channels = " ".join(f"{x:03d}" for x in policy['channels'])
+    first_second = f"$(({policy['start_gps']} + {start_offset}))"
+    if isinstance(duration, int) and duration < 0:
+        file_list = f"find {combined} -maxdepth 1 -name '*.dat'"
+    else:
+        file_list = f"for s in $(seq {first_second} $(({policy['start_gps']} + {start_offset} + {duration} - 1))); do " \
+            f"for c in {channels}; do f={combined}/{policy['obsid']}_${{s}}_ch${{c}}.dat; [ -e $f ] && echo $f; done; done"
+    staged = staged_paths(policy, paths)
+    commands += f"BLINK_COMBINED={staged['combined_files_path']}; BLINK_METAFITS={staged['metafits_file']}; " \
+        f"BLINK_SOLUTIONS={staged['solutions_file']}; "
+    commands += f"for f in {combined}/{policy['obsid']}_{policy['start_gps']}_ch*.dat; do [ -e $f ] && ln -sf $f $BLINK_STAGE/combined/; done; "
+    # xargs fails if any copy does
+    commands += f"( cp {paths['metafits_file']} {paths['solutions_file']} $BLINK_STAGE/ && " \
+        f"{file_list} | xargs -P {policy['copy_workers']} -I @ cp --remove-destination @ $BLINK_STAGE/combined/ ) & " \
+        "BLINK_STAGE_PID=$!; "
+    return commands
+
+
+
+def staged_paths(policy : dict, paths : dict):
+    """
+    Paths of the inputs and outputs of `blink_pipeline` under the staging policy, the node-local
+    copies of the inputs if it stages them.
+    """
+    if policy is None:
+        return paths
+    staged = dict(paths)
+    if policy['stage_inputs']:
+        staged.update(combined_files_path="$BLINK_STAGE/combined",
+            metafits_file=f"$BLINK_STAGE/{os.path.basename(paths['metafits_file'])}",
+            solutions_file=f"$BLINK_STAGE/{os.path.basename(paths['solutions_file'])}")
+    if policy['stage_outputs']:
+        staged.update(output_dir="$BLINK_STAGE/output")
+    return staged
+
+
+
+def input_paths(policy : dict, paths : dict):
+    """
+    Paths of the inputs read by `blink_pipeline`: shell variables set by `prefetch_commands` if
+    the policy stages them (see `wait_commands`).
+    """
+    if policy is None or not policy['stage_inputs']:
+        return paths
+    return dict(paths, combined_files_path="$BLINK_COMBINED", metafits_file="$BLINK_METAFITS", solutions_file="$BLINK_SOLUTIONS")
+
+
+
+def wait_commands(policy : dict, paths : dict):
+    """
+    Shell commands waiting for the copy of the inputs started by `prefetch_commands`. If it
+    failed, `blink_pipeline` reads the inputs from the shared filesystem (`paths`).
+    """
+    if policy is None or not policy['stage_inputs']:
+        return ""
+    return f"wait $BLINK_STAGE_PID || {{ echo 'Warning: the inputs could not be staged, reading them from {paths['combined_files_path']}.'; " \
+        f"BLINK_COMBINED={paths['combined_files_path']}; BLINK_METAFITS={paths['metafits_file']}; BLINK_SOLUTIONS={paths['solutions_file']}; }}; "
+
+
+
+def stage_out_commands(policy : dict, output_dir : str, tag : str):
+    """
+    Shell commands copying the products of the job from node-local storage to `output_dir`,
+    the small ones bundled in `bundle_<tag>_<job id>.tar`, and removing the job's node-local
+    directory.
+    """
+    if policy is None or not (policy['stage_inputs'] or policy['stage_outputs']):
+        return ""
+    commands = ""
+    if policy['stage_outputs']:
+        commands += "( cd $BLINK_STAGE/output && "
+        if policy['bundle_size'] > 0:
+            excluded = " ".join(f"! -name '{x}'" for x in UNBUNDLED_PATTERNS)
+            commands += f"find . -type f -size -{policy['bundle_size']}c {excluded} > ../bundle.list && " \
+                f"if [ -s ../bundle.list ]; then tar -cf {output_dir}/bundle_{tag}_${{SLURM_JOB_ID}}.tar -T ../bundle.list && " \
+                "xargs rm -f < ../bundle.list; fi && "
+        commands += f"cp -r . {output_dir}/ ); "
+    commands += "rm -rf $BLINK_STAGE; "
+    return commands
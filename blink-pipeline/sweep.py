@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Parameter sweeps to benchmark how the cost of BLINK jobs scales with the job parameters.
+
+A sweep spec (JSON) lists values for some of the following axes; the others keep the values
+given on the `blink-submit.py` command line:
+
+- `imgsize`, `oversampling`, `freq_avg`, `time_res`, `avg_images`: as the options of the same name;
+- `dm_trials`: number of DM trials, from `dm_min` with step `dm_step`;
+- `extra_flagged`: number of antennas flagged on top of the ones flagged anyway.
+
+Other keys: `duration` (seconds of data of each job, default 60), `offset` (default 0),
+`dm_min` (default 10), `dm_step` (default 1), `repeats` (jobs per point, default 1). E.g.
+
+    {"duration" : 60, "imgsize" : [128, 256, 512], "dm_trials" : [10, 100, 1000], "repeats" : 2}
+
+`blink-submit.py --sweep spec.json` submits one short job per point of the cartesian product of the
+axes, in an output directory named after the sweep ID, where the sweep manifest (`sweep.json`) is
+written. Each job logs the sweep ID and its point index in its SLURM output. Once the jobs ran,
+`sweep.py report` parses their logs into a throughput table. `sweep.py synth` writes synthetic
+logs for the jobs of a sweep, to test the whole flow in dry run mode.
+
+Usage:
+    sweep.py report <sweep output dir> [--csv table.csv]
+    sweep.py synth <sweep output dir> [--cost-model model.json]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from itertools import product
+import numpy as np
+from cost_model import CostModel, COMMAND_MARKER, START_MARKER, END_MARKER
+
+SWEEP_AXES = ['imgsize', 'oversampling', 'freq_avg', 'time_res', 'avg_images', 'dm_trials', 'extra_flagged']
+
+SPEC_DEFAULTS = {'duration' : 60, 'offset' : 0, 'dm_min' : 10, 'dm_step' : 1, 'repeats' : 1}
+
+# Printed by the jobs of a sweep: "BLINK_SWEEP: <sweep id> <point index>"
+SWEEP_MARKER = "BLINK_SWEEP:"
+
+MANIFEST_FILE_NAME = "sweep.json"
+
+# Coefficients of the runtime model used to generate synthetic logs (see cost_model.py).
+SYNTHETIC_COEFFICIENTS = [30.0, 0.5, 2e-6, 2e-9, 2e-9]
+
+
+def load_spec(path : str):
+    with open(path) as f:
+        spec = json.load(f)
+    unknown = [x for x in spec if x not in SWEEP_AXES and x not in SPEC_DEFAULTS]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown keys in the sweep spec: {', '.join(unknown)}")
+    return dict(SPEC_DEFAULTS, **spec)
+
+
+
+def make_sweep_id(spec : dict):
+    spec_hash = hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:6]
+    return f"sweep_{time.strftime('%Y%m%d%H%M%S')}_{spec_hash}"
+
+
+
+def dm_range_for(n_trials : int, dm_min : float, dm_step : float):
+    return f"{dm_min:g}:{dm_min + (n_trials - 1) * dm_step:g}:{dm_step:g}"
+
+
+
+def expand_sweep(spec : dict, base : dict):
+    """
+    Returns the list of points of the sweep, as dictionaries with a value for each axis
+    (from the spec or, if the axis is not swept, from `base`) plus the point `index` and `repeat`.
+    """
+    values = []
+    for axis in SWEEP_AXES:
+        value = spec.get(axis, base[axis])
+        values.append(value if isinstance(value, list) else [value])
+    points = []
+    for combination in product(*values):
+        for repeat in range(spec['repeats']):
+            point = dict(zip(SWEEP_AXES, combination), index=len(points), repeat=repeat)
+            point['dm_range'] = dm_range_for(point['dm_trials'], spec['dm_min'], spec['dm_step'])
+            points.append(point)
+    return points
+
+
+
+def write_manifest(output_dir : str, manifest : dict):
+    with open(os.path.join(output_dir, MANIFEST_FILE_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+
+def load_manifest(output_dir : str):
+    with open(os.path.join(output_dir, MANIFEST_FILE_NAME)) as f:
+        return json.load(f)
+
+
+
+def parse_sweep_logs(output_dir : str, sweep_id : str):
+    """
+    Returns a dictionary mapping the point index to the list of elapsed seconds of the
+    completed jobs of the sweep found in the output directory.
+    """
+    elapsed = {}
+    for name in sorted(os.listdir(output_dir)):
+        if not (name.startswith("slurm-") and name.endswith(".out")): continue
+        index, start, end = None, None, None
+        with open(os.path.join(output_dir, name), errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith(SWEEP_MARKER):
+                    tokens = line[len(SWEEP_MARKER):].split()
+                    if len(tokens) == 2 and tokens[0] == sweep_id:
+                        index = int(tokens[1])
+                elif line.startswith(START_MARKER):
+                    start = int(line[len(START_MARKER):])
+                elif line.startswith(END_MARKER):
+                    end = int(line[len(END_MARKER):])
+        if index is not None and start is not None and end is not None:
+            elapsed.setdefault(index, []).append(end - start)
+    return elapsed
+
+
+
+def throughput_table(manifest : dict, elapsed : dict):
+    """
+    Returns one row per distinct point of the sweep (repeats merged) with the median wall time,
+    and the seconds of data processed per wall-second, overall and per GPU.
+    """
+    rows = {}
+    for point in manifest['points']:
+        key = tuple(point[x] for x in SWEEP_AXES)
+        row = rows.setdefault(key, dict({x : point[x] for x in SWEEP_AXES}, runs=[]))
+        row['runs'] += elapsed.get(point['index'], [])
+    table = []
+    for row in rows.values():
+        runs = row.pop('runs')
+        row['jobs'] = len(runs)
+        row['wall'] = float(np.median(runs)) if runs else None
+        row['throughput'] = manifest['duration'] / row['wall'] if runs and row['wall'] > 0 else None
+        row['throughput_per_gpu'] = row['throughput'] / manifest['gpus_per_job'] if row['throughput'] else None
+        table.append(row)
+    return table
+
+
+
+def print_table(table : list, csv_file : str = None):
+    columns = SWEEP_AXES + ['jobs', 'wall', 'throughput', 'throughput_per_gpu']
+    def cell(value):
+        if value is None: return "-"
+        return f"{value:.4g}" if isinstance(value, float) else str(value)
+    print(" ".join(f"{x:>18}" for x in columns))
+    for row in table:
+        print(" ".join(f"{cell(row[x]):>18}" for x in columns))
+    if csv_file is not None:
+        with open(csv_file, "w") as f:
+            f.write(",".join(columns) + "\n")
+            for row in table:
+                f.write(",".join("" if row[x] is None else str(row[x]) for x in columns) + "\n")
+
+
+
+def synthesize_logs(output_dir : str, manifest : dict, model : CostModel = None, noise : float = 0.05, seed : int = 0):
+    """
+    Writes a SLURM output file for each job of the sweep, with the markers of a completed run
+    taking the runtime predicted by `model` (default: `SYNTHETIC_COEFFICIENTS`) with log-normal noise.
+    """
+    if model is None:
+        model = CostModel(SYNTHETIC_COEFFICIENTS)
+    rng = np.random.default_rng(seed)
+    start = int(time.time())
+    for point in manifest['points']:
+        params = {'imgsize' : point['imgsize'], 'oversampling' : point['oversampling'], 'duration' : manifest['duration'],
+            'dm_range' : point['dm_range'], 'time_res' : point['time_res'], 'freq_avg_factor' : point['freq_avg'],
+            'n_antennas' : point['n_antennas']}
+        runtime = int(round(model.predict(params) * rng.lognormal(0, noise)))
+        command = f"blink_pipeline -R {point['n_antennas']} -c {point['freq_avg']} -t {point['time_res']}s " \
+            f"-n {point['imgsize']} -O {point['oversampling']} -Q {manifest['duration']} -D {point['dm_range']}"
+        job_id = point.get('job_id') or 9000000 + point['index']
+        with open(os.path.join(output_dir, f"slurm-{job_id}.out"), "w") as f:
+            f.write(f"{SWEEP_MARKER} {manifest['sweep_id']} {point['index']}\n")
+            f.write(f"{COMMAND_MARKER} {command}\n{START_MARKER}{start}\n{END_MARKER}{start + runtime}\n")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on, or generate synthetic logs for, a BLINK parameter sweep.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Print the throughput table of a sweep.")
+    report_parser.add_argument("output_dir", help="Output directory of the sweep.")
+    report_parser.add_argument("--csv", type=str, default=None, help="Also write the table to this CSV file.")
+    synth_parser = subparsers.add_parser("synth", help="Write synthetic logs for the jobs of a sweep.")
+    synth_parser.add_argument("output_dir", help="Output directory of the sweep.")
+    synth_parser.add_argument("--cost-model", type=str, default=None, help="Runtime model used to generate the runtimes.")
+    synth_parser.add_argument("--noise", type=float, default=0.05, help="Standard deviation of the log-normal runtime noise.")
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.output_dir)
+    if args.command == "synth":
+        model = CostModel.load(args.cost_model) if args.cost_model else None
+        synthesize_logs(args.output_dir, manifest, model, args.noise)
+        print(f"Wrote synthetic logs for the {len(manifest['points'])} jobs of {manifest['sweep_id']}.")
+    else:
+        elapsed = parse_sweep_logs(args.output_dir, manifest['sweep_id'])
+        print(f"Sweep {manifest['sweep_id']}: {sum(len(x) for x in elapsed.values())} of {len(manifest['points'])} jobs completed, "
+            f"{manifest['duration']} seconds of data each.")
+        print_table(throughput_table(manifest, elapsed), args.csv)
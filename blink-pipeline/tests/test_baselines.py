@@ -0,0 +1,51 @@
+import itertools
+import numpy as np
+from baselines import greedy_cover, prune_cover, exact_cover, minimum_cover, long_baseline_cover
+
+
+def random_graph(rng, n_nodes, p):
+    upper = np.triu(rng.uniform(size=(n_nodes, n_nodes)) < p, 1)
+    return upper | upper.T
+
+
+def is_cover(adjacency, cover):
+    remaining = np.ones(len(adjacency), dtype=bool)
+    remaining[list(cover)] = False
+    return not adjacency[np.ix_(remaining, remaining)].any()
+
+
+def brute_force_size(adjacency):
+    for size in range(len(adjacency) + 1):
+        if any(is_cover(adjacency, x) for x in itertools.combinations(range(len(adjacency)), size)):
+            return size
+
+
+def test_covers_against_brute_force():
+    rng = np.random.default_rng(3)
+    for n_nodes in range(1, 11):
+        for p in (0.2, 0.4, 0.7):
+            adjacency = random_graph(rng, n_nodes, p)
+            greedy = greedy_cover(adjacency)
+            pruned = prune_cover(adjacency, greedy)
+            assert is_cover(adjacency, greedy)
+            assert is_cover(adjacency, pruned)
+            assert set(pruned) <= set(greedy)
+            size = brute_force_size(adjacency)
+            exact = exact_cover(adjacency)
+            assert is_cover(adjacency, exact)
+            assert len(exact) == size
+            assert len(minimum_cover(adjacency)) == size
+            assert len(minimum_cover(adjacency, exact=False)) >= size
+
+
+def test_exact_cover_step_limit():
+    # the search stops early with a valid cover
+    adjacency = random_graph(np.random.default_rng(4), 30, 0.3)
+    assert is_cover(adjacency, exact_cover(adjacency, max_steps=5))
+
+
+def test_long_baseline_cover():
+    # three close stations and two far from them and from each other
+    positions = np.array([[0, 0, 0], [10, 0, 0], [0, 10, 0], [1000, 0, 0], [0, 1000, 0]])
+    assert long_baseline_cover(positions, 100) == [3, 4]
+    assert long_baseline_cover(positions, 2000) == []
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from cost_model import CostModel, nnls, job_terms, collect_records, COMMAND_MARKER, START_MARKER, END_MARKER, GPUS_MARKER
+
+
+def test_nnls_recovers_non_negative_solution():
+    rng = np.random.default_rng(1)
+    A = rng.uniform(0, 1, (20, 4))
+    x = np.array([2.0, 0.0, 0.5, 3.0])
+    assert nnls(A, A @ x) == pytest.approx(x, abs=1e-8)
+
+
+def test_nnls_optimality():
+    rng = np.random.default_rng(2)
+    A = rng.normal(size=(30, 5))
+    b = rng.normal(size=30)
+    x = nnls(A, b)
+    assert (x >= 0).all()
+    # Karush-Kuhn-Tucker conditions: no descent direction keeping x >= 0
+    gradient = A.T @ (b - A @ x)
+    assert gradient[x > 0] == pytest.approx(0, abs=1e-8)
+    assert (gradient[x == 0] <= 1e-8).all()
+    assert np.linalg.lstsq(A, b, rcond=None)[0].min() < 0
+
+
+def job(imgsize, duration, dm_range):
+    return {'imgsize' : imgsize, 'oversampling' : 1, 'duration' : duration, 'dm_range' : dm_range,
+        'time_res' : 0.02, 'freq_avg_factor' : 4, 'n_antennas' : 110}
+
+
+def test_fit_predicts_training_jobs():
+    coefficients = np.array([120.0, 0.5, 1e-6, 2e-8, 1e-9])
+    jobs = [job(s, d, r) for s in (128, 256, 512) for d in (60, 300, 600) for r in (None, "10:100:1", "101:200:1")]
+    model = CostModel().fit([(x, float(job_terms(x) @ coefficients)) for x in jobs])
+    assert model.n_records == len(jobs)
+    for x in jobs:
+        assert model.predict(x) == pytest.approx(job_terms(x) @ coefficients, rel=1e-6)
+    with pytest.raises(ValueError):
+        CostModel().fit([])
+
+
+def test_collect_records_skips_runs_on_fewer_gpus(tmp_path):
+    command = "blink_pipeline -n 256 -O 1 -Q 60 -D 10:20:1"
+    outputs = {'slurm-1.out' : "", 'slurm-2.out' : f"{GPUS_MARKER}8\n", 'slurm-3.out' : f"{GPUS_MARKER}2\n",
+        'slurm-4_cell0.out' : "", 'slurm-5_cell1.out' : f"{GPUS_MARKER}8\n"}
+    for name, header in outputs.items():
+        (tmp_path / name).write_text(f"{header}{COMMAND_MARKER} {command}\n{START_MARKER}100\n{END_MARKER}200\n")
+    records = collect_records([str(tmp_path)])
+    assert len(records) == 3
+    assert all(params['duration'] == 60 and elapsed == 100 for params, elapsed in records)
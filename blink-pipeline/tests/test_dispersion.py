@@ -0,0 +1,51 @@
+import math
+import pytest
+from dispersion import DISPERSION_CONSTANT, dm_range_overlap, dm_trial_runs, split_dm_runs, run_trials
+
+BAND = (138.88, 169.60)
+
+
+def test_dm_range_overlap():
+    delay = DISPERSION_CONSTANT * 100 * (BAND[0]**-2 - BAND[1]**-2)
+    assert dm_range_overlap("10:100:1", *BAND, 0) == math.ceil(delay)
+    assert dm_range_overlap("10:100:1", *BAND, 5) == math.ceil(delay + 5)
+    # only the highest DM of the range matters
+    assert dm_range_overlap("90:100:0.5", *BAND, 0) == dm_range_overlap("10:100:1", *BAND, 0)
+    assert dm_range_overlap("10:200:1", *BAND, 0) > dm_range_overlap("10:100:1", *BAND, 0)
+
+
+def test_dm_range_overlap_malformed():
+    with pytest.raises(ValueError):
+        dm_range_overlap("10:100", *BAND, 0)
+
+
+def test_dm_trial_runs_grid():
+    runs = dm_trial_runs(10, 600, BAND, 0.01, 0.02)
+    assert runs[0][0] == 10
+    assert runs[-1][1] >= 600
+    for (first, last, step), (next_first, _, next_step) in zip(runs, runs[1:]):
+        # runs are contiguous, with steps growing with DM
+        assert next_first == pytest.approx(last + step)
+        assert next_step > step
+    for first, last, step in runs:
+        assert last >= first
+        mantissa = step / 10**math.floor(math.log10(step))
+        assert round(mantissa, 6) in (1, 2, 5)
+
+
+def test_dm_trial_runs_loss():
+    coarse = dm_trial_runs(10, 600, BAND, 0.01, 0.02, snr_loss=0.2)
+    fine = dm_trial_runs(10, 600, BAND, 0.01, 0.02, snr_loss=0.05)
+    assert sum(run_trials(*x) for x in coarse) < sum(run_trials(*x) for x in fine)
+    with pytest.raises(ValueError):
+        dm_trial_runs(10, 600, BAND, 0.01, 0.02, snr_loss=1)
+
+
+def test_split_dm_runs_covers_the_grid():
+    runs = dm_trial_runs(10, 600, BAND, 0.01, 0.02)
+    dm_ranges = split_dm_runs(runs, 5)
+    bounds = [tuple(float(x) for x in r.split(':')) for r in dm_ranges]
+    assert bounds[0][0] == 10
+    assert bounds[-1][1] >= runs[-1][1]
+    for (_, last, step), (next_first, _, _) in zip(bounds, bounds[1:]):
+        assert next_first <= last + step + 1e-6
@@ -0,0 +1,39 @@
+from cost_model import END_MARKER
+from ledger import Ledger, job_key, pending_task_ids
+
+
+def test_pending_task_ids():
+    assert pending_task_ids("1234_[5-9%2]") == {5, 6, 7, 8, 9}
+    assert pending_task_ids("1234_[1,3-4]") == {1, 3, 4}
+    assert pending_task_ids("1234_[7]") == {7}
+
+
+def test_job_key_canonical():
+    params = {'obsid' : 1, 'offset' : 0, 'duration' : 60, 'imgsize' : 256, 'flagged_antennas' : [1, 2]}
+    assert job_key(params) == job_key(dict(params, offset=0.0, duration=60.0))
+    assert job_key(params) != job_key(dict(params, offset=1))
+
+
+def test_refresh_array_tasks(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.jsonl"))
+    completed_output = tmp_path / "slurm-1234_0.out"
+    completed_output.write_text(f"{END_MARKER}100\n")
+    outputs = {0 : str(completed_output), 1 : str(tmp_path / "slurm-1234_1.out")}
+    for task in range(8):
+        ledger.submitted(f"k{task}", {'obsid' : 1, 'offset' : task}, f"1234_{task}", outputs.get(task))
+    calls = []
+    def queue(job_ids):
+        calls.append(job_ids)
+        # pending tasks are listed together, running ones one by one
+        return [{'job_id' : "1234_[5-7%2]", 'array_job_id' : "1234", 'state' : "PENDING"},
+            {'job_id' : "1234_2", 'array_job_id' : "1234", 'state' : "RUNNING"},
+            {'job_id' : "1234_3", 'array_job_id' : "1234", 'state' : "COMPLETING"}]
+    ledger.refresh(queue=queue)
+    assert calls == [["1234"]]
+    states = [ledger.jobs[f"k{task}"]['state'] for task in range(8)]
+    assert states == ['COMPLETED', 'FAILED', 'RUNNING', 'RUNNING', 'FAILED', 'PENDING', 'PENDING', 'PENDING']
+    # the ledger file replays to the same states
+    assert {k : x['state'] for k, x in Ledger(ledger.path).jobs.items()} == {f"k{task}" : states[task] for task in range(8)}
+    assert ledger.should_skip("k0", refresh=False) is not None
+    assert ledger.should_skip("k1", refresh=False) is None
+    assert Ledger(ledger.path, resubmit=True).should_skip("k0", refresh=False) is None
@@ -0,0 +1,73 @@
+from obs_index import build_index, format_gaps
+
+OBSID = 1000000000
+START_GPS = 1000000000
+
+
+def make_combined(tmp_path, seconds, channels, missing = (), size = 16):
+    combined = tmp_path / "combined"
+    combined.mkdir()
+    for s in seconds:
+        for c in channels:
+            if (s, c) not in missing:
+                (combined / f"{OBSID}_{s}_ch{c:03d}.dat").write_bytes(b"x" * size)
+    return str(combined)
+
+
+def test_expected_channel_missing_everywhere(tmp_path):
+    combined = make_combined(tmp_path, range(START_GPS, START_GPS + 10), [109, 110])
+    index = build_index(combined, save=False)
+    assert index.complete_segments() == [(0, 10)]
+    index = index.with_expected([109, 110, 111], START_GPS, 10)
+    assert index.channels.tolist() == [109, 110, 111]
+    assert index.complete_segments() == []
+    assert format_gaps(index) == ["0-9"]
+
+
+def test_expected_span_missing_end(tmp_path):
+    combined = make_combined(tmp_path, range(START_GPS, START_GPS + 8), [109])
+    index = build_index(combined, save=False).with_expected([109], START_GPS, 10)
+    assert index.n_seconds == 10
+    assert index.complete_segments() == [(0, 8)]
+    assert format_gaps(index) == ["8-9"]
+
+
+def test_expected_span_missing_start(tmp_path):
+    # offsets keep counting from the first second with files
+    combined = make_combined(tmp_path, range(START_GPS + 3, START_GPS + 10), [109])
+    index = build_index(combined, save=False).with_expected([109], START_GPS, 10)
+    assert index.start_gps == START_GPS + 3
+    assert index.missing_before == 3
+    assert index.complete_segments() == [(0, 7)]
+    assert format_gaps(index) == []
+
+
+def test_gaps_missing_and_incomplete_files(tmp_path):
+    combined = make_combined(tmp_path, range(START_GPS, START_GPS + 10), [109, 110],
+        missing=[(START_GPS + 3, 110), (START_GPS + 6, 109)])
+    # a file still being written
+    (tmp_path / "combined" / f"{OBSID}_{START_GPS + 5}_ch109.dat").write_bytes(b"x")
+    index = build_index(combined, save=False)
+    assert index.expected_size() == 16
+    assert format_gaps(index) == ["3", "5-6"]
+    assert index.complete_segments() == [(0, 3), (4, 1), (7, 3)]
+    assert index.complete_segments(min_length=2) == [(0, 3), (7, 3)]
+    assert index.complete_gps_seconds(START_GPS + 2, START_GPS + 7) == [START_GPS + 2, START_GPS + 4, START_GPS + 7]
+
+
+def test_gaps_missing_seconds(tmp_path):
+    seconds = [s for s in range(START_GPS, START_GPS + 10) if s not in (START_GPS + 2, START_GPS + 3)]
+    index = build_index(make_combined(tmp_path, seconds, [109]), save=False)
+    assert index.n_seconds == 10
+    assert format_gaps(index) == ["2-3"]
+
+
+def test_index_refreshed_when_a_file_grows(tmp_path):
+    combined = make_combined(tmp_path, range(START_GPS, START_GPS + 4), [109])
+    path = tmp_path / "combined" / f"{OBSID}_{START_GPS + 1}_ch109.dat"
+    path.write_bytes(b"x")
+    index_file = str(tmp_path / "index.npz")
+    assert format_gaps(build_index(combined, index_file)) == ["1"]
+    # written in place: the directory is unchanged
+    path.write_bytes(b"x" * 16)
+    assert format_gaps(build_index(combined, index_file)) == []
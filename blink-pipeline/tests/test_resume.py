@@ -0,0 +1,49 @@
+from collections import namedtuple
+from cost_model import COMMAND_MARKER, END_MARKER
+from resume import postfix_key, scan_output_dir, seconds_done, plan_resume
+
+Cell = namedtuple('Cell', ['offset', 'duration', 'dm_range'])
+DM_RANGE = "10:100:1"
+
+
+def run(products = 0, duration = None, completed = False):
+    return {'products' : products, 'duration' : duration, 'completed' : completed}
+
+
+def test_postfix_key():
+    assert postfix_key("dynamic_spectrum_5_start_second_120_dm_range_10_100_1.fits") == (120, "10:100:1")
+    assert postfix_key("start_second_0_dm_range_10.5_20_0.25") == (0, "10.5:20:0.25")
+    assert postfix_key("image_0001.fits") is None
+
+
+def test_coverage_chains_consecutive_runs():
+    runs = {(0, DM_RANGE) : run(100, 100, True), (100, DM_RANGE) : run(51), (150, DM_RANGE) : run(20, 20, True)}
+    # the interrupted run's last product may be incomplete: 50 seconds done
+    assert seconds_done(0, 300, DM_RANGE, runs) == 170
+    assert seconds_done(100, 200, DM_RANGE, runs) == 70
+
+
+def test_coverage_stops_at_a_hole():
+    runs = {(0, DM_RANGE) : run(100, 100, True), (120, DM_RANGE) : run(50, 50, True)}
+    assert seconds_done(0, 300, DM_RANGE, runs) == 100
+    # runs of other DM ranges and starting before the cell do not count
+    assert seconds_done(0, 300, "101:200:1", runs) == 0
+    assert seconds_done(10, 300, DM_RANGE, runs) == 0
+
+
+def test_coverage_is_capped_to_the_cell():
+    runs = {(0, DM_RANGE) : run(300, 300, True)}
+    assert seconds_done(0, 200, DM_RANGE, runs) == 200
+
+
+def test_plan_resume(tmp_path):
+    postfix = "start_second_0_dm_range_10_100_1"
+    (tmp_path / "slurm-1.out").write_text(f"{COMMAND_MARKER} blink_pipeline -Q 100 -D {DM_RANGE} -p {postfix}\n{END_MARKER}10\n")
+    postfix = "start_second_100_dm_range_10_100_1"
+    (tmp_path / "slurm-2.out").write_text(f"{COMMAND_MARKER} blink_pipeline -Q 100 -D {DM_RANGE} -p {postfix}\n")
+    for i in range(31):
+        (tmp_path / f"dynamic_spectrum_{i}_{postfix}.fits").write_text("")
+    runs = scan_output_dir(str(tmp_path))
+    assert runs[(100, DM_RANGE)] == run(31, 100, False)
+    cells = [Cell(0, 100, DM_RANGE), Cell(0, 300, DM_RANGE), Cell(0, 100, "101:200:1")]
+    assert plan_resume(cells, str(tmp_path)) == [Cell(130, 170, DM_RANGE), Cell(0, 100, "101:200:1")]
@@ -0,0 +1,34 @@
+import pytest
+import slurm
+
+
+@pytest.mark.parametrize("time_limit, seconds", [
+    ("30", 1800),
+    ("10:30", 630),
+    ("12:00:00", 43200),
+    ("1-12", 129600),
+    ("1-12:30", 131400),
+    ("1-12:30:15", 131415),
+    ("0-12", 43200),
+    ("0-12:30", 45000),
+    ("0-00:00:05", 5),
+])
+def test_parse_time_limit(time_limit, seconds):
+    assert slurm.parse_time_limit(time_limit) == seconds
+
+
+def test_parse_time_limit_malformed():
+    with pytest.raises(ValueError):
+        slurm.parse_time_limit("12h")
+
+
+def test_format_time_limit_round_trip():
+    assert slurm.format_time_limit(slurm.parse_time_limit("1-02:03:04")) == "26:03:04"
+
+
+def test_array_spec():
+    assert slurm.array_spec(1) == "0-0"
+    assert slurm.array_spec(10) == "0-9"
+    assert slurm.array_spec(10, 4) == "0-9%4"
+    with pytest.raises(ValueError):
+        slurm.array_spec(0)
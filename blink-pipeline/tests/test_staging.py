@@ -0,0 +1,64 @@
+import os
+import subprocess
+import staging
+
+OBSID = 1000000000
+START_GPS = 1000000100
+
+
+def make_observation(tmp_path, seconds, channels, missing = ()):
+    observation = tmp_path / "obs"
+    combined = observation / "combined"
+    combined.mkdir(parents=True)
+    for s in seconds:
+        for c in channels:
+            if (s, c) not in missing:
+                (combined / f"{OBSID}_{s}_ch{c:03d}.dat").write_text(f"{s} {c}")
+    (observation / f"{OBSID}.metafits").write_text("metafits")
+    (observation / "solutions.bin").write_text("solutions")
+    return {'combined_files_path' : str(combined), 'metafits_file' : str(observation / f"{OBSID}.metafits"),
+        'solutions_file' : str(observation / "solutions.bin"), 'output_dir' : str(tmp_path / "output")}
+
+
+def run_staging(tmp_path, paths, start_offset, duration, channels):
+    policy = staging.observation_policy(staging.make_policy(stage_inputs=True, local_dir=str(tmp_path / "local"), backend="none"),
+        OBSID, START_GPS, channels)
+    script = staging.prefetch_commands(policy, paths, start_offset, duration) + staging.wait_commands(policy, paths) + \
+        'echo "$BLINK_COMBINED $BLINK_METAFITS $BLINK_SOLUTIONS"'
+    result = subprocess.run(["bash", "-c", script], capture_output=True, text=True, env=dict(os.environ, SLURM_JOB_ID="1"))
+    return result.stdout.strip().splitlines()
+
+
+def staged_files(tmp_path):
+    combined = next((tmp_path / "local").glob("blink_1_*")) / "combined"
+    return {x.name : x for x in combined.iterdir()}
+
+
+def test_prefetch_copies_the_seconds_of_the_job(tmp_path):
+    channels = [1, 2]
+    # the first second misses a channel, and the job's range a file
+    paths = make_observation(tmp_path, range(START_GPS, START_GPS + 10), channels,
+        missing=[(START_GPS, 2), (START_GPS + 4, 1)])
+    output = run_staging(tmp_path, paths, 3, 3, channels)
+    combined, metafits, solutions = output[-1].split()
+    assert combined.endswith("/combined") and combined != paths['combined_files_path']
+    assert os.path.exists(metafits) and os.path.exists(solutions)
+
+    files = staged_files(tmp_path)
+    copied = {f"{OBSID}_{s}_ch{c:03d}.dat" for s in range(START_GPS + 3, START_GPS + 6) for c in channels} - \
+        {f"{OBSID}_{START_GPS + 4}_ch001.dat"}
+    linked = {f"{OBSID}_{START_GPS}_ch001.dat"}
+    assert set(files) == copied | linked
+    assert all(not files[x].is_symlink() for x in copied)
+    assert all(files[x].is_symlink() and files[x].exists() for x in linked)
+    # blink_pipeline counts offsets from the first second of its input directory
+    assert min(files) == min(os.listdir(paths['combined_files_path']))
+
+
+def test_prefetch_falls_back_to_the_shared_inputs(tmp_path):
+    channels = [1]
+    paths = make_observation(tmp_path, range(START_GPS, START_GPS + 5), channels)
+    os.remove(paths['solutions_file'])
+    output = run_staging(tmp_path, paths, 1, 2, channels)
+    assert any(x.startswith("Warning: the inputs could not be staged") for x in output)
+    assert output[-1].split() == [paths['combined_files_path'], paths['metafits_file'], paths['solutions_file']]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Summarises the timing records written by BLINK jobs (`timings.jsonl` in the output directories,
+see `blink-submit.py`) and by the stages of the wsclean pipeline (`timings.jsonl` in the work
+directory, see `wsclean-pipeline/lib/mwa-wsclean-workflow.sh`).
+
+Each record is a JSON object on its own line, with at least the `stage`, the number of seconds of
+data processed (`seconds`), the wall and CPU time in seconds (`wall`, `cpu`), the bytes read
+(`input_bytes`), the `module` (software version) and the stage `params`.
+
+The report shows, for each stage, the throughput in seconds of data processed per hour of wall
+time. Then, for each stage and set of parameters run with more than one module, the wall time
+per second of data of each module compared to a baseline module, so that a new build of
+`blink-pipeline-gpu` processing the same kind of job faster or slower stands out.
+
+Usage:
+    timing_report.py [--stage blink_pipeline] [--modules A B] [--baseline A] <timings files or directories>
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+TIMINGS_FILE_NAME = "timings.jsonl"
+
+
+def find_timing_files(paths : list):
+    """
+    Returns the timing files given, and those found (recursively) in the directories given.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                if TIMINGS_FILE_NAME in names:
+                    files.append(os.path.join(root, TIMINGS_FILE_NAME))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+
+def load_records(paths : list):
+    records = []
+    for path in find_timing_files(paths):
+        with open(path) as f:
+            for i, line in enumerate(f):
+                if not line.strip(): continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"Warning: skipping malformed record at {path}:{i + 1}", file=sys.stderr)
+                    continue
+                records.append(record)
+    return records
+
+
+
+def parameters_key(record : dict):
+    """
+    Records with the same stage and parameters are comparable across modules.
+    """
+    return record['stage'], json.dumps(record.get('params', {}), sort_keys=True)
+
+
+
+def stage_summary(records : list):
+    """
+    Returns one row per stage with the number of runs, seconds of data processed, total wall hours,
+    seconds of data processed per wall hour, CPU utilisation (CPU time over wall time, in cores)
+    and input read rate in MB/s.
+    """
+    rows = []
+    for stage in sorted(set(r['stage'] for r in records)):
+        stage_records = [r for r in records if r['stage'] == stage and r.get('seconds', 0) > 0 and r['wall'] > 0]
+        if len(stage_records) == 0: continue
+        seconds = sum(r['seconds'] for r in stage_records)
+        wall = sum(r['wall'] for r in stage_records)
+        cpu = sum(r.get('cpu', 0) for r in stage_records)
+        input_bytes = sum(r.get('input_bytes', 0) for r in stage_records)
+        rows.append({'stage' : stage, 'runs' : len(stage_records), 'seconds' : seconds, 'wall_hours' : wall / 3600,
+            'seconds_per_hour' : seconds / wall * 3600, 'cpu_cores' : cpu / wall, 'input_mb_per_s' : input_bytes / wall / 1e6})
+    return rows
+
+
+
+def module_comparison(records : list, baseline : str = None, modules : list = None):
+    """
+    Compares the median wall time per second of data of the modules that ran the same stage with
+    the same parameters. Returns one row per (stage, parameters, module), with the relative change
+    with respect to the baseline module (by default the one that ran first).
+    """
+    groups = {}
+    for r in records:
+        if r.get('seconds', 0) <= 0 or r['wall'] <= 0: continue
+        module = r.get('module') or "unknown"
+        if modules and module not in modules: continue
+        groups.setdefault(parameters_key(r), {}).setdefault(module, []).append(r)
+
+    rows = []
+    for (stage, params), by_module in sorted(groups.items()):
+        if len(by_module) < 2: continue
+        first_run = {m : min(r.get('time', 0) for r in rs) for m, rs in by_module.items()}
+        reference = baseline if baseline in by_module else min(first_run, key=first_run.get)
+        per_second = {m : float(np.median([r['wall'] / r['seconds'] for r in rs])) for m, rs in by_module.items()}
+        for module in sorted(by_module, key=first_run.get):
+            rows.append({'stage' : stage, 'params' : params, 'module' : module, 'runs' : len(by_module[module]),
+                'wall_per_second' : per_second[module], 'baseline' : reference,
+                'change' : per_second[module] / per_second[reference] - 1})
+    return rows
+
+
+
+def print_report(records : list, baseline : str = None, modules : list = None, threshold : float = 0.1):
+    print(f"{len(records)} timing records.\n")
+    print(f"{'stage':>18} {'runs':>6} {'data seconds':>13} {'wall hours':>11} {'seconds/hour':>13} {'CPU cores':>10} {'input MB/s':>11}")
+    for row in stage_summary(records):
+        print(f"{row['stage']:>18} {row['runs']:>6} {row['seconds']:>13} {row['wall_hours']:>11.2f} "
+            f"{row['seconds_per_hour']:>13.1f} {row['cpu_cores']:>10.2f} {row['input_mb_per_s']:>11.1f}")
+
+    rows = module_comparison(records, baseline, modules)
+    if len(rows) == 0:
+        return
+    print("\nComparison between modules (median wall time per second of data):")
+    current = None
+    for row in rows:
+        if (row['stage'], row['params']) != current:
+            current = (row['stage'], row['params'])
+            print(f"\n{row['stage']} {row['params']}")
+        flag = ""
+        if row['module'] != row['baseline'] and abs(row['change']) >= threshold:
+            flag = "  <- SLOWER" if row['change'] > 0 else "  <- faster"
+        baseline_note = " (baseline)" if row['module'] == row['baseline'] else f" {row['change']:+.1%}"
+        print(f"    {row['module']:<40} {row['runs']:>5} runs {row['wall_per_second']:>9.2f} s{baseline_note}{flag}")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the timing records of BLINK jobs and wsclean pipeline stages.")
+    parser.add_argument("inputs", nargs='+', help="timings.jsonl files, or directories to search for them.")
+    parser.add_argument("--stage", type=str, nargs='*', default=[], help="Only report these stages.")
+    parser.add_argument("--obsid", type=int, nargs='*', default=[], help="Only report these observations.")
+    parser.add_argument("--modules", type=str, nargs='*', default=[], help="Only compare these modules.")
+    parser.add_argument("--baseline", type=str, default=None, help="Module the others are compared to. Default: the one that ran first.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change in wall time flagged in the module comparison.")
+    args = parser.parse_args()
+
+    records = load_records(args.inputs)
+    if args.stage:
+        records = [r for r in records if r['stage'] in args.stage]
+    if args.obsid:
+        records = [r for r in records if r.get('obsid') in args.obsid]
+    print_report(records, args.baseline, args.modules, args.threshold)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Total power time series from the dynamic spectra written by BLINK jobs in dedispersion +
+dynamic spectrum mode, off the GPU nodes.
+
+BLINK writes one `dynamic_spectrum_<...>_<postfix>.fits` file per second of data, each an
+image of channels by time samples. The total power of a time sample is the sum over the
+channels of its (finite) values. The files of each run (product postfix) are reduced in parallel
+across a pool of processes, each streaming its file through a memory map in chunks of time
+samples, and the time series of the run is written to `totalpower_<postfix>.power`, one
+`<time sample> <total power>` line per sample, in the order of the seconds (the name under
+which the jobs reducing on the GPU write it too, see `blink-submit.py --totalpower`).
+A dependent job only reduces the runs of the BLINK job it follows (`--postfix`), as other runs
+of the directory may still be being written.
+
+With `--follow <job id>` the reducer starts on the files while the job is still writing them:
+a file is reduced once it has reached the size declared by its header, and the outputs are
+written when the job has left the queue. Otherwise runs whose output is newer than all their
+files are skipped, so that the reducer can be rerun, e.g. as a dependent CPU job
+(`blink-submit.py --totalpower cpu`).
+
+Usage:
+    totalpower.py <output dir> [--postfix <postfix> ...] [--workers 8] [--follow <job id>]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import fits_reader
+import slurm
+from resume import POSTFIX_PATTERN
+
+FILE_PATTERN = re.compile(rf"dynamic_spectrum_.*_({POSTFIX_PATTERN.pattern})\.fits$")
+
+# Time samples reduced at once
+CHUNK_SIZE = 4096
+
+
+def natural_key(name : str):
+    return [int(x) if x.isdigit() else x for x in re.split(r"(\d+)", name)]
+
+
+
+def find_runs(output_dir : str, postfixes : list = None):
+    """
+    Returns a dictionary mapping the postfix of each run (only the given ones if not None) to
+    the list of its dynamic spectrum files, in the order of the seconds.
+    """
+    runs = {}
+    for name in os.listdir(output_dir):
+        match = FILE_PATTERN.match(name)
+        if match is None or (postfixes is not None and match.group(1) not in postfixes): continue
+        runs.setdefault(match.group(1), []).append(os.path.join(output_dir, name))
+    return {k : sorted(v, key=natural_key) for k, v in runs.items()}
+
+
+
+def expected_size(path : str):
+    """
+    Size in bytes of a complete FITS file with a single HDU, from its header, or None if the
+    header has not been fully written yet.
+    """
+    with open(path, 'rb') as f:
+        try:
+            cards = fits_reader.read_header(f)
+        except EOFError:
+            return None
+        if cards is None:
+            return None
+        return fits_reader.HDU(path, cards, f.tell()).end_offset
+
+
+
+def is_complete(path : str):
+    size = expected_size(path)
+    return size is not None and os.path.getsize(path) >= size
+
+
+
+def file_total_power(path : str, chunk_size : int = CHUNK_SIZE):
+    """
+    Total power of each time sample of a dynamic spectrum (time along the first FITS axis,
+    i.e. the last array axis), read through a memory map `chunk_size` samples at a time.
+    """
+    data = fits_reader.open_fits(path)[0].data
+    n_samples = data.shape[-1]
+    power = np.empty(n_samples)
+    for start in range(0, n_samples, chunk_size):
+        chunk = np.asarray(data[..., start:start + chunk_size], dtype=np.float64)
+        power[start:start + chunk_size] = np.nansum(chunk.reshape(-1, chunk.shape[-1]), axis=0)
+    return power
+
+
+
+def write_power(path : str, power : np.ndarray):
+    tmp_path = path + ".tmp"
+    np.savetxt(tmp_path, np.column_stack([np.arange(len(power)), power]), fmt=["%d", "%.8e"])
+    os.replace(tmp_path, path)
+
+
+
+def output_path(output_dir : str, postfix : str):
+    return os.path.join(output_dir, f"totalpower_{postfix}.power")
+
+
+
+def is_up_to_date(output_dir : str, postfix : str, files : list):
+    path = output_path(output_dir, postfix)
+    return os.path.exists(path) and os.path.getmtime(path) >= max(os.path.getmtime(x) for x in files)
+
+
+
+def reduce_dir(output_dir : str, postfixes : list = None, workers : int = None, follow_job : int = None, poll_interval : float = 30):
+    """
+    Reduces the runs found in the output directory (only the ones with the given postfixes if
+    not None) and returns the list of the output files written. See the module documentation.
+    """
+    def runs_to_reduce():
+        runs = find_runs(output_dir, postfixes)
+        if follow_job is None:
+            runs = {k : v for k, v in runs.items() if not is_up_to_date(output_dir, k, v)}
+        return runs
+
+    results = {}
+    with ProcessPoolExecutor(workers) as pool:
+        while True:
+            job_running = follow_job is not None and len(slurm.squeue(job_ids=[follow_job])) > 0
+            runs = runs_to_reduce()
+            pending = {}
+            for files in runs.values():
+                for path in files:
+                    if path in results: continue
+                    if not is_complete(path):
+                        # while the job runs, the last files may still be being written
+                        if job_running: continue
+                        print(f"Warning: skipping the truncated file {path}", file=sys.stderr)
+                        results[path] = np.zeros(0)
+                        continue
+                    pending[path] = pool.submit(file_total_power, path)
+            for path, future in pending.items():
+                results[path] = future.result()
+            if not job_running:
+                break
+            time.sleep(poll_interval)
+
+    written = []
+    for run_postfix, files in sorted(runs.items()):
+        write_power(output_path(output_dir, run_postfix), np.concatenate([results[x] for x in files]))
+        written.append(output_path(output_dir, run_postfix))
+    return written
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reduce the dynamic spectra of BLINK runs to total power time series.")
+    parser.add_argument("output_dir", help="Output directory of the BLINK jobs.")
+    parser.add_argument("--postfix", type=str, nargs='+', default=None, help="Only reduce the runs with these product postfixes.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes. Default: one per CPU core.")
+    parser.add_argument("--follow", type=int, default=None, help="Reduce files as they are written by this SLURM job, until it ends.")
+    parser.add_argument("--poll-interval", type=float, default=30, help="Seconds between directory scans in follow mode.")
+    args = parser.parse_args()
+
+    start = time.time()
+    written = reduce_dir(args.output_dir, args.postfix, args.workers, args.follow, args.poll_interval)
+    print(f"Wrote {len(written)} total power files in {time.time() - start:.1f} s.", file=sys.stderr)
+    for path in written:
+        print(path)
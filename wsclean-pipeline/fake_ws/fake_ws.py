@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the MWA web services used by `lib/prefetch.py`, to test downloads away
+from the internet.
+
+Files are served from a directory: `<obsid>.metafits` for /metadata/fits?obs_id=<obsid>
+and `<obsid>_solutions.zip` for /calib/get_calfile_for_obsid?obs_id=<obsid>. Unknown
+observations get a 404. A fraction of the requests can be made to fail with a 503, and the
+responses delayed, to exercise retries and concurrent downloads. Requests are logged to stdout.
+
+Usage:
+    fake_ws.py --root <dir> [--port 8000] [--fail-rate 0.2] [--delay 0.5]
+    MWA_WS_URL=http://localhost:8000 prefetch.py prefetch <obsids...>
+"""
+import argparse
+import os
+import random
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+FILE_NAMES = {
+    '/metadata/fits' : "{obsid}.metafits",
+    '/calib/get_calfile_for_obsid' : "{obsid}_solutions.zip"
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        obsid = parse_qs(url.query).get('obs_id', [''])[0]
+        if url.path not in FILE_NAMES or not obsid.isdigit():
+            self.send_error(400, "Malformed request")
+            return
+        time.sleep(self.server.delay)
+        if random.random() < self.server.fail_rate:
+            self.send_error(503, "Service temporarily unavailable")
+            return
+        path = os.path.join(self.server.root, FILE_NAMES[url.path].format(obsid=obsid))
+        if not os.path.exists(path):
+            self.send_error(404, f"No data for observation {obsid}")
+            return
+        with open(path, 'rb') as f:
+            content = f.read()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the MWA web services.")
+    parser.add_argument("--root", type=str, required=True, help="Directory with the files to serve.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    parser.add_argument("--fail-rate", type=float, default=0, help="Fraction of the requests answered with a 503 error.")
+    parser.add_argument("--delay", type=float, default=0, help="Seconds to wait before answering a request.")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("localhost", args.port), Handler)
+    server.root, server.fail_rate, server.delay = args.root, args.fail_rate, args.delay
+    print(f"Serving {args.root} on http://localhost:{args.port}", flush=True)
+    server.serve_forever()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Fan-out of the wsclean pipeline over many nodes: the seconds of an observation are imaged by a
+single SLURM job array, each task running `workflow.py` on a batch of seconds with a whole node.
+
+wsclean and cotter scale poorly with the number of cores on a single second, so each node
+processes several seconds at the same time, each stage on a share of the node's cores. The
+share is chosen from the measured scaling of the stages: the `timings.jsonl` records of past
+runs (see `mwa-wsclean-workflow.sh`) are fitted with Amdahl's law, wall = serial + parallel / cores,
+and the number of cores per second minimising the time to process a task's batch of seconds is
+used, with at most `--max-concurrent` seconds per node (their memory has to fit).
+
+The progress of the fan-out is kept in `fanout/state.json` in the observation's work directory.
+A second is complete once its wsclean stage is recorded as done in the workflow manifest
+(see `workflow.py`). When the job array has left the queue, the seconds it did not complete
+are submitted again in a new array, up to `--max-retries` times. The queue is read and jobs are
+submitted through `blink-pipeline/slurm.py`, so that BLINK_SBATCH and BLINK_SQUEUE can point to
+the `fake_slurm` stand-ins to test the fan-out away from a cluster.
+
+Usage:
+    fanout.py submit --obsid 1276619416 --observations-dir <combined dir> --work-dir <dir> --start-gps A --end-gps B
+    fanout.py plan --obsid 1276619416 --observations-dir <combined dir> --work-dir <dir> --start-gps A --end-gps B
+    fanout.py status --obsid 1276619416 --work-dir <dir>
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+from workflow import SCRIPT_DIR, read_manifest
+
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "..", "blink-pipeline"))
+import slurm
+from obs_index import build_index
+from timing_report import load_records
+
+WORKFLOW = os.path.join(SCRIPT_DIR, "workflow.py")
+
+DEFAULT_MODULES = "python/3.11.6 cotter/latest wsclean/3.4-idg-everybeam blink-correlator/master"
+
+# Scaling of the CPU bound stages when no timing records are available, as (serial seconds,
+# parallel core-seconds) for one second of data at 1024 x 1024 pixels. Rough values, measure them.
+DEFAULT_SCALING = {
+    'run_cotter' : (4.0, 60.0),
+    'run_birli' : (4.0, 60.0),
+    'run_wsclean' : (10.0, 200.0)
+}
+
+STATUSES = ('pending', 'queued', 'done', 'failed')
+
+
+def fit_scaling(records : list):
+    """
+    Fits wall = serial + parallel / cores to the timing records of a stage. Returns the
+    (serial, parallel) pair, or None if there are no records.
+    """
+    if len(records) == 0:
+        return None
+    cores = np.array([float(r['ncores']) for r in records])
+    wall = np.array([float(r['wall']) for r in records])
+    if len(np.unique(cores)) == 1:
+        # nothing to tell the serial part apart: assume it scales
+        return 0.0, float(np.median(wall * cores))
+    A = np.column_stack([np.ones(len(cores)), 1.0 / cores])
+    serial, parallel = np.linalg.lstsq(A, wall, rcond=None)[0]
+    if serial < 0:
+        return 0.0, float(np.sum(wall / cores) / np.sum(1.0 / cores**2))
+    if parallel < 0:
+        return float(np.mean(wall)), 0.0
+    return float(serial), float(parallel)
+
+
+
+def measured_scaling(timing_paths : list, converter : str, imagesize : int):
+    """
+    Returns the scaling of the converter and wsclean stages, fitted on the timing records found
+    in the given files or directories (wsclean records of the same image size only), or the
+    defaults for stages without records.
+    """
+    records = [r for r in load_records(timing_paths) if 'ncores' in r] if timing_paths else []
+    scaling = {}
+    for stage in (converter, 'run_wsclean'):
+        stage_records = [r for r in records if r.get('stage') == stage and
+            (stage != 'run_wsclean' or str(r.get('params', {}).get('imagesize')) == str(imagesize))]
+        fitted = fit_scaling(stage_records)
+        scaling[stage] = fitted if fitted is not None else DEFAULT_SCALING[stage]
+        print(f"{stage}: {'fitted on ' + str(len(stage_records)) + ' records' if fitted is not None else 'default scaling'}, " \
+            f"{scaling[stage][0]:.1f} s + {scaling[stage][1]:.1f} core-s / cores")
+    return scaling
+
+
+
+def second_time(scaling : dict, cores : int):
+    """
+    Predicted wall time of the CPU bound stages of one second run on `cores` cores.
+    """
+    return sum(serial + parallel / cores for serial, parallel in scaling.values())
+
+
+
+def choose_split(node_cores : int, n_seconds : int, scaling : dict, max_concurrent : int):
+    """
+    Returns the number of cores per second, among the divisors of `node_cores` leaving at most
+    `max_concurrent` seconds at the same time, minimising the predicted time to process
+    `n_seconds` seconds on a node, and that time.
+    """
+    best = None
+    for cores in range(1, node_cores + 1):
+        concurrent = node_cores // cores
+        if node_cores % cores != 0 or concurrent > max_concurrent: continue
+        makespan = math.ceil(n_seconds / concurrent) * second_time(scaling, cores)
+        if best is None or makespan < best[1]:
+            best = (cores, makespan)
+    if best is None:
+        raise ValueError(f"No split of {node_cores} cores runs at most {max_concurrent} seconds at the same time.")
+    return best
+
+
+
+class FanoutState:
+    def __init__(self, path : str, seconds : dict, jobs : list):
+        self.path = path
+        # GPS second (string) -> {'status' : ..., 'attempts' : ..., 'job_id' : ...}
+        self.seconds = seconds
+        self.jobs = jobs
+
+    @staticmethod
+    def load_or_create(path : str, seconds : list):
+        """
+        Loads the state, adding the seconds not in it yet as pending.
+        """
+        state = FanoutState(path, {}, [])
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            state = FanoutState(path, data['seconds'], data['jobs'])
+        for gps in seconds:
+            state.seconds.setdefault(str(gps), {'status' : 'pending', 'attempts' : 0, 'job_id' : None})
+        state.save()
+        return state
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({'seconds' : self.seconds, 'jobs' : self.jobs}, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+    def with_status(self, status : str):
+        return sorted(int(gps) for gps, x in self.seconds.items() if x['status'] == status)
+
+    def summary(self):
+        return ", ".join(f"{len(self.with_status(x))} {x}" for x in STATUSES if len(self.with_status(x)) > 0)
+
+    def update(self, completed : set, active_jobs : set, max_retries : int):
+        """
+        Marks the completed seconds as done, and the seconds of the jobs no longer active that
+        did not complete as pending, or failed after `max_retries` retries.
+        """
+        for gps, second in self.seconds.items():
+            if second['status'] in ('pending', 'queued', 'failed') and int(gps) in completed:
+                second['status'] = 'done'
+            elif second['status'] == 'queued' and str(second['job_id']) not in active_jobs:
+                second['status'] = 'pending' if second['attempts'] <= max_retries else 'failed'
+        self.save()
+
+
+
+def completed_seconds(work_dir : str, obsid : int):
+    """
+    GPS seconds whose wsclean stage is recorded as done in the workflow manifest.
+    """
+    done = read_manifest(os.path.join(work_dir, str(obsid), "workflow_manifest.jsonl"))
+    return {int(x.split('/')[0]) for x in done if x.endswith("/run_wsclean")}
+
+
+
+def active_jobs(state : FanoutState, queue = slurm.squeue):
+    """
+    IDs of the job arrays of the queued seconds still in the queue.
+    """
+    job_ids = sorted({str(x['job_id']) for x in state.seconds.values() if x['status'] == 'queued'})
+    return {x['array_job_id'] for x in queue(job_ids=job_ids)} if job_ids else set()
+
+
+
+def task_batches(seconds : list, seconds_per_task : int):
+    return [seconds[i:i + seconds_per_task] for i in range(0, len(seconds), seconds_per_task)]
+
+
+
+def submit_array(args, seconds : list, cores_per_second : int, time_limit : int):
+    """
+    Submits the given seconds as a job array of batches of `args.seconds_per_task` seconds,
+    and returns its job ID (None in dry run mode).
+    """
+    fanout_dir = os.path.join(args.work_dir, str(args.obsid), "fanout")
+    os.makedirs(fanout_dir, exist_ok=True)
+    name = f"array_{len([x for x in os.listdir(fanout_dir) if x.startswith('array_') and x.endswith('.sh')])}"
+    table_file = os.path.join(fanout_dir, f"{name}.txt")
+    script_file = os.path.join(fanout_dir, f"{name}.sh")
+    batches = task_batches(seconds, args.seconds_per_task)
+    slurm.write_parameter_table(table_file, ["seconds"], [(",".join(str(x) for x in batch),) for batch in batches])
+
+    stage_cpus = " ".join(f"{stage}={cores_per_second}" for stage in ('run_cotter', 'run_birli', 'run_wsclean'))
+    script  = "#!/bin/bash\n"
+    script += f"# Generated by fanout.py: each array task images the seconds of one row of {table_file}\n"
+    script += f"SECONDS_LIST=$(awk -v task=${{SLURM_ARRAY_TASK_ID}} '$1 == task {{ print $2 }}' {table_file} | tr ',' ' ')\n"
+    if args.modules:
+        script += f"module load {args.modules}\n"
+    script += f"python3 {WORKFLOW} ${{SECONDS_LIST}} --obsid {args.obsid} --observations-dir {args.observations_dir} --work-dir {args.work_dir} " \
+        f"--time-res {args.time_res} --converter {args.converter} --imagesize {args.imagesize} --pixscale {args.pixscale} " \
+        f"--weighting {args.weighting} --cpus {args.node_cores} --io-slots {max(4, args.node_cores // cores_per_second)} " \
+        f"--stage-cpus {stage_cpus}\n"
+    with open(script_file, "w") as f:
+        f.write(script)
+
+    sbatch_args = f"--array={slurm.array_spec(len(batches), args.nodes)} --partition={args.partition} --account={args.account} " \
+        f"--job-name=\"wsclean fan-out - {args.obsid}\" --nodes=1 --ntasks=1 --cpus-per-task={args.node_cores} " \
+        f"--time={slurm.format_time_limit(time_limit)} --output={fanout_dir}/slurm-%A_%a.out"
+    print(f"Submitting {len(seconds)} seconds as {len(batches)} array tasks with the following command:\n" \
+        f"sbatch {sbatch_args} {script_file}")
+    if args.dry_run:
+        return None
+    return slurm.sbatch(sbatch_args, script_file)
+
+
+
+def run_fanout(state : FanoutState, submit, completed, max_retries : int, poll_interval : float,
+        queue = slurm.squeue, wait : bool = True):
+    """
+    Submits the pending seconds with `submit(seconds)`, returning the job ID, and retries the
+    seconds their jobs did not complete (`completed()` returns the set of completed seconds),
+    until all seconds are done or have failed `max_retries` times (or after one submission if not
+    `wait`). Returns the list of failed seconds.
+    """
+    while True:
+        state.update(completed(), active_jobs(state, queue), max_retries)
+        pending = state.with_status('pending')
+        if pending:
+            job_id = submit(pending)
+            if job_id is None:
+                break
+            for gps in pending:
+                second = state.seconds[str(gps)]
+                second.update(status='queued', job_id=job_id, attempts=second['attempts'] + 1)
+            state.jobs.append({'job_id' : job_id, 'seconds' : len(pending), 'submit_time' : int(time.time())})
+            state.save()
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} seconds: {state.summary()}", flush=True)
+        if not wait or len(state.with_status('queued')) == 0:
+            break
+        time.sleep(poll_interval)
+    return state.with_status('failed')
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image the seconds of an observation with the wsclean pipeline as a job array.")
+    parser.add_argument("command", choices=["plan", "submit", "status"])
+    parser.add_argument("seconds", type=int, nargs='*', help="GPS seconds to process. Default: the complete seconds from --start-gps to --end-gps.")
+    parser.add_argument("--obsid", type=int, required=True, help="Observation ID.")
+    parser.add_argument("--observations-dir", type=str, default=None, help="Directory with the combined .dat files.")
+    parser.add_argument("--work-dir", type=str, required=True, help="Top level working directory.")
+    parser.add_argument("--start-gps", type=int, default=None, help="First GPS second to process.")
+    parser.add_argument("--end-gps", type=int, default=None, help="Last GPS second to process (inclusive).")
+    parser.add_argument("--time-res", type=str, default="1s", help="Time resolution (1s, 50ms or 20ms).")
+    parser.add_argument("--converter", type=str, default="cotter", choices=["cotter", "birli"], help="Tool converting the visibilities to a measurement set.")
+    parser.add_argument("--imagesize", type=int, default=1024, help="Image size (side, in pixels).")
+    parser.add_argument("--pixscale", type=float, default=0.006, help="Pixel scale in degrees.")
+    parser.add_argument("--weighting", type=str, default="natural", help="WSClean weighting.")
+    parser.add_argument("--timings", type=str, nargs='*', default=None, help="Timing files or directories with the measured scaling " \
+                        "of the stages. Default: the timings.jsonl file of the work directory.")
+    parser.add_argument("--node-cores", type=int, default=128, help="Number of cores of a node, all used by each array task.")
+    parser.add_argument("--max-concurrent", type=int, default=16, help="Maximum number of seconds processed at the same time on a node.")
+    parser.add_argument("--seconds-per-task", type=int, default=None, help="Number of seconds of each array task. " \
+                        "Default: up to 8 rounds of the seconds processed at the same time on a node, fewer to use --nodes nodes.")
+    parser.add_argument("--nodes", type=int, default=8, help="Maximum number of array tasks running at the same time (0: no limit).")
+    parser.add_argument("--max-retries", type=int, default=2, help="Number of times the seconds not completed are submitted again.")
+    parser.add_argument("--poll-interval", type=float, default=300, help="Seconds between checks of the queue.")
+    parser.add_argument("--no-wait", action='store_true', help="Submit the pending seconds and exit. Run the command again " \
+                        "later to collect the completed seconds and retry the others.")
+    parser.add_argument("--modules", type=str, default=DEFAULT_MODULES, help="LMOD modules loaded by the array tasks.")
+    parser.add_argument("--partition", type=str, default="work", help="SLURM partition.")
+    parser.add_argument("--account", type=str, default="pawsey1154", help="SLURM account.")
+    parser.add_argument("--dry-run", action='store_true', help="Do not actually submit jobs.")
+    args = parser.parse_args()
+
+    state_file = os.path.join(args.work_dir, str(args.obsid), "fanout", "state.json")
+    if args.command == "status":
+        if not os.path.exists(state_file):
+            raise SystemExit(f"No fan-out state in {state_file}")
+        state = FanoutState.load_or_create(state_file, [])
+        state.update(completed_seconds(args.work_dir, args.obsid), active_jobs(state), args.max_retries)
+        print(f"Seconds: {state.summary()}")
+        for status in ('pending', 'queued', 'failed'):
+            if state.with_status(status):
+                print(f"{status}: {' '.join(str(x) for x in state.with_status(status))}")
+        raise SystemExit(0)
+
+    if args.observations_dir is None:
+        parser.error("--observations-dir is required to plan or submit.")
+    seconds = sorted(set(args.seconds))
+    if not seconds:
+        if args.start_gps is None:
+            parser.error("Give the seconds to process, or --start-gps.")
+        end_gps = args.end_gps if args.end_gps is not None else args.start_gps
+        seconds = build_index(args.observations_dir).complete_gps_seconds(args.start_gps, end_gps)
+    if not seconds:
+        raise SystemExit("No seconds with complete data to process.")
+
+    timing_paths = args.timings if args.timings is not None else [os.path.join(args.work_dir, "timings.jsonl")]
+    scaling = measured_scaling([x for x in timing_paths if os.path.exists(x)], f"run_{args.converter}", args.imagesize)
+    # a task processes a few rounds of concurrent seconds, fewer if that leaves nodes idle
+    n_seconds = args.seconds_per_task or min(args.max_concurrent * 8, math.ceil(len(seconds) / max(args.nodes, 1)))
+    cores, makespan = choose_split(args.node_cores, n_seconds, scaling, args.max_concurrent)
+    concurrent = args.node_cores // cores
+    if args.seconds_per_task is None:
+        args.seconds_per_task = min(concurrent * 8, math.ceil(n_seconds / concurrent) * concurrent)
+    # margin for the correlator and metadata stages, and the model error
+    time_limit = int(math.ceil(1.5 * makespan / 900 + 1) * 900)
+    print(f"{len(seconds)} seconds, {concurrent} at the same time per node on {cores} cores each " \
+        f"({second_time(scaling, cores):.0f} s per second), {args.seconds_per_task} per task: " \
+        f"{math.ceil(len(seconds) / args.seconds_per_task)} task(s) of about {makespan / 60:.1f} minutes.")
+    if args.command == "plan":
+        raise SystemExit(0)
+
+    state = FanoutState.load_or_create(None if args.dry_run else state_file, seconds)
+    failed = run_fanout(state, lambda x : submit_array(args, x, cores, time_limit),
+        lambda : completed_seconds(args.work_dir, args.obsid), args.max_retries, args.poll_interval,
+        wait=not (args.no_wait or args.dry_run))
+    if failed:
+        print(f"{len(failed)} seconds failed after {args.max_retries} retries: {' '.join(str(x) for x in failed)}")
+        sys.exit(1)
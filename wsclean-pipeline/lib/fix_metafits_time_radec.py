@@ -1,70 +1,154 @@
 #!/usr/bin/env python3
 
-import astropy.io.fits as pyfits
-import math 
+import math
 from array import *
 import numpy as np
 import sys
+import os
 import argparse
-
-from astropy.coordinates import EarthLocation,SkyCoord
-from astropy.time import Time
-from astropy import units as u
-from astropy.coordinates import AltAz, ICRS
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, tzinfo, timezone
 
 def gps_to_unix(gps_time):
     return (315964800 + gps_time - 18)
 
+def unix_to_gps(unix_time):
+    return (unix_time - 315964800 + 18)
+
 def unix_to_utc(unix_time):
     dt_obj = datetime.fromtimestamp(unix_time)
     dt_obj = dt_obj.astimezone(timezone.utc)
     return dt_obj.strftime('%Y%m%d%H%M%S')
 
+def utc_to_unix(utc_timestamp):
+    return timegm(datetime.strptime(utc_timestamp, '%Y%m%d%H%M%S').timetuple())
 
-def azel2radec(azimut, elevation, time_unix):
+
+def azel2radec_batch(azimut, elevation, times_unix):
+    """
+    Converts a fixed (azimuth, elevation) pointing to RA, DEC at each of the given unix times
+    with a single array transform. Returns two arrays of RA and DEC in degrees.
+    """
+    # astropy is imported only here and in fix_metafits, as it is slow to import
+    from astropy.coordinates import EarthLocation, SkyCoord, AltAz, ICRS
+    from astropy.time import Time
+    from astropy import units as u
     mwa_location = EarthLocation.from_geodetic(lat=-26.70331*u.deg, lon=116.6708*u.deg, height=377*u.m)
-    # need time in local time?
-    local_time = (datetime.fromtimestamp(time_unix) - timedelta(hours=8)).isoformat()
-    print(local_time)
-    observing_time = Time(local_time, format='isot') #time_unix, format='unix')
+    observing_time = Time(np.asarray(times_unix, dtype=np.float64), format='unix')
     MWA_altaz = AltAz(location=mwa_location, obstime=observing_time)
-    azel = [(azimut, elevation)]
-    azelcoord  = SkyCoord(azel, frame=MWA_altaz, unit=u.deg)
-    radec_coord = azelcoord.transform_to(ICRS)
-    ra = (radec_coord.ra * u.deg).value[0]
-    dec = (radec_coord.dec * u.deg).value[0]
-    return (ra, dec)
-    
+    n_times = len(observing_time)
+    azelcoord  = SkyCoord(az=np.full(n_times, azimut)*u.deg, alt=np.full(n_times, elevation)*u.deg, frame=MWA_altaz)
+    radec_coord = azelcoord.transform_to(ICRS())
+    return radec_coord.ra.deg, radec_coord.dec.deg
+
+
+def azel2radec(azimut, elevation, time_unix):
+    ra, dec = azel2radec_batch(azimut, elevation, [time_unix])
+    return (ra[0], dec[0])
+
+
+def read_timestamps(timestamps_file):
+    """
+    Reads the list of seconds to process, one per line, either as GPS time or as
+    UTC timestamp in the YYYYMMDDhhmmss format (like the SMART pipeline timestamps.txt).
+    Returns the list of GPS times.
+    """
+    gps_times = []
+    with open(timestamps_file) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'): continue
+            if len(line) == 14:
+                gps_times.append(unix_to_gps(utc_to_unix(line)))
+            else:
+                gps_times.append(int(line))
+    return gps_times
+
+
+def fix_metafits(input_fitsname, gps_times, n_timesteps, inttime, n_channels, outdir, n_threads = 1, skip_existing = False):
+    """
+    Writes one metafits file per GPS time, named after the UTC timestamp of that second,
+    with pointing and time information updated. The input file is read only once: the primary
+    header is rendered once as template, only the cards that change with time are re-rendered
+    for each second, and the remaining HDUs are copied verbatim.
+    """
+    import astropy.io.fits as pyfits
+    with pyfits.open(input_fitsname) as fits:
+        template = fits[0].header.copy()
+        primary_header_size = fits.fileinfo(0)['datLoc']
+    with open(input_fitsname, 'rb') as f:
+        f.seek(primary_header_size)
+        rest_of_file = f.read()
+
+    alt =  template['ALTITUDE']
+    azim = template['AZIMUTH']
+    unix_times = [gps_to_unix(gps) for gps in gps_times]
+    utc_times = [unix_to_utc(t) for t in unix_times]
+    out_fitsnames = [f"{outdir}/{utc_time}.metafits" for utc_time in utc_times]
+    todo = [i for i, name in enumerate(out_fitsnames) if not (skip_existing and os.path.exists(name))]
+    if len(todo) == 0:
+        return []
+    ra, dec = azel2radec_batch(azim, alt, [unix_times[i] for i in todo])
+
+    #template['DATE-OBS']  = dateobs
+    template['GPSTIME']   = gps_times[todo[0]]
+    template['RA']        = float(ra[0])
+    template['DEC']       = float(dec[0])
+    template['NSCANS']    = n_timesteps
+    template['INTTIME']   = inttime
+    template['NCHANS']    = n_channels
+    template_string = template.tostring()
+    # position of the cards changing from one second to the other in the rendered header
+    card_offsets = {}
+    for key in ('GPSTIME', 'RA', 'DEC'):
+        card_offsets[key] = template_string.index(template.cards[key].image)
+
+    def write_one(k):
+        i = todo[k]
+        header_string = template_string
+        for key, value in (('GPSTIME', gps_times[i]), ('RA', float(ra[k])), ('DEC', float(dec[k]))):
+            image = pyfits.Card(key, value, template.comments[key]).image
+            if len(image) != pyfits.Card.length:
+                raise ValueError(f"Card {key} does not fit in a single header record.")
+            offset = card_offsets[key]
+            header_string = header_string[:offset] + image + header_string[offset + pyfits.Card.length:]
+        print("Writing fits %s" % (out_fitsnames[i]))
+        with open(out_fitsnames[i], 'wb') as f:
+            f.write(header_string.encode('ascii'))
+            f.write(rest_of_file)
+        return out_fitsnames[i]
+
+    if n_threads > 1:
+        with ThreadPoolExecutor(n_threads) as pool:
+            return list(pool.map(write_one, range(len(todo))))
+    return [write_one(k) for k in range(len(todo))]
+
 
 if __name__ == '__main__':
-   parser = argparse.ArgumentParser(prog='fix_metadata.py', description='Updates the metadata file to match the current second of MWA observation.') 
-   parser.add_argument('-c','--n_channels','--n_chans', dest="n_channels",default=768, help="Number of channels [default %default]", type=int)
-   parser.add_argument('-t','--n_scans','--n_timesteps', dest="n_timesteps",default=1, help="Number of timesteps [default %default]", type=int)
-   parser.add_argument('-i','--inttime','--inttime_sec', dest="inttime",default=4, help="Integration time in seconds [default %default]", type=float)
-   parser.add_argument('-g','--gpstime', dest="gpstime", required=True, help="GPS time of current second being processed.", type=int)
+   parser = argparse.ArgumentParser(prog='fix_metadata.py', description='Updates the metadata file to match the current second of MWA observation. ' \
+      'In batch mode (--start-gps/--end-gps or --timestamps) one metadata file per second is written by a single process.')
+   parser.add_argument('-c','--n_channels','--n_chans', dest="n_channels",default=768, help="Number of channels [default %(default)s]", type=int)
+   parser.add_argument('-t','--n_scans','--n_timesteps', dest="n_timesteps",default=1, help="Number of timesteps [default %(default)s]", type=int)
+   parser.add_argument('-i','--inttime','--inttime_sec', dest="inttime",default=4, help="Integration time in seconds [default %(default)s]", type=float)
+   seconds = parser.add_mutually_exclusive_group(required=True)
+   seconds.add_argument('-g','--gpstime', dest="gpstime", help="GPS time of current second being processed.", type=int)
+   seconds.add_argument('-s','--start-gps', dest="start_gps", help="Batch mode: first GPS second to process.", type=int)
+   seconds.add_argument('-l','--timestamps', dest="timestamps", help="Batch mode: file listing the seconds to process, as GPS times or YYYYMMDDhhmmss UTC timestamps.", type=str)
+   parser.add_argument('-e','--end-gps', dest="end_gps", help="Batch mode: last GPS second to process (inclusive). Default: same as --start-gps.", type=int)
+   parser.add_argument('-j','--threads', dest="threads", default=1, help="Number of threads writing the output files.", type=int)
+   parser.add_argument('--skip-existing', action='store_true', help="Do not overwrite metadata files that already exist.")
    parser.add_argument('-o','--outdir', dest="outdir", help="Output directory where to save the new metafits.", default=".", type=str)
    parser.add_argument('metafits', metavar='metafits', type=str, nargs=1)
    args = vars(parser.parse_args())
-   
-   input_fitsname = args['metafits'][0] 
-   fits = pyfits.open(input_fitsname)
-      
-   alt =  fits[0].header['ALTITUDE']
-   azim = fits[0].header['AZIMUTH']
-   unix_time = gps_to_unix(args['gpstime'])
-   utc_time = unix_to_utc(unix_time)
-   ra, dec = azel2radec(azim, alt, unix_time)
-   #fits[0].header['DATE-OBS']  = dateobs
-   fits[0].header['GPSTIME']   = args['gpstime']
-   fits[0].header['RA']        = float(ra)
-   fits[0].header['DEC']       = float(dec)
-   fits[0].header['NSCANS']    = args['n_timesteps']
-   fits[0].header['INTTIME']   = args['inttime']
-   fits[0].header['NCHANS']    = args['n_channels']
-   
-   out_fitsname = f"{args['outdir']}/{utc_time}.metafits"
-   print("Writing fits %s" % (out_fitsname))
-   fits.writeto(out_fitsname, overwrite=True)
 
+   if args['gpstime'] is not None:
+      gps_times = [args['gpstime']]
+   elif args['start_gps'] is not None:
+      end_gps = args['end_gps'] if args['end_gps'] is not None else args['start_gps']
+      gps_times = list(range(args['start_gps'], end_gps + 1))
+   else:
+      gps_times = read_timestamps(args['timestamps'])
 
+   fix_metafits(args['metafits'][0], gps_times, args['n_timesteps'], args['inttime'], args['n_channels'],
+      args['outdir'], args['threads'], args['skip_existing'])
@@ -6,16 +6,21 @@
 
 SCRIPT_DIR=$(cd $(dirname ${BASH_SOURCE[0]}) && pwd)
 
-# Determining the number of CPU cores that can be used
+# Determining the number of CPU cores that can be used, unless set by the caller
+# (e.g. lib/workflow.py, which runs several stages at the same time).
+if [ -z "${NCORES}" ]; then
 N_CPU_SOCKETS=`cat /proc/cpuinfo | grep "physical id"  | sort | uniq | wc -l`
 N_CORES_PER_SOCKET=`cat /proc/cpuinfo | grep "cpu cores" | head -n1 | grep -oE [0-9]+`
 NCORES=$(( N_CPU_SOCKETS * N_CORES_PER_SOCKET ))
+fi
 
+if [ -z ${LAUNCHER+x} ]; then
 LAUNCHER=""
 if ! [ -z ${PAWSEY_CLUSTER+x} ]; then
 echo "Using Pawsey cluster ${PAWSEY_CLUSTER}"
 LAUNCHER="srun -c $SLURM_CPUS_PER_TASK"
 fi
+fi
 
 PERF="perf record -g --call-graph dwarf -F 9000"
 
@@ -56,25 +61,67 @@ function print_run {
  $@
 }
 
+# Timing records of the stages are appended, one JSON object per line, to TIMINGS_FILE
+# (default: ${WORK_DIR}/timings.jsonl). Summarise them with blink-pipeline/timing_report.py.
+
+# children_cpu_time
+# Description: prints the CPU seconds (user + system) used so far by the terminated child processes of this shell.
+function children_cpu_time {
+    awk -v tck=`getconf CLK_TCK` '{ printf "%.2f", ($16 + $17) / tck }' /proc/$$/stat
+}
+
+function start_timing {
+    STAGE_START_TIME=`date +%s.%N`
+    STAGE_START_CPU=`children_cpu_time`
+}
+
+# record_timing <stage> <input files> [<key>=<value> ...]
+# Description: appends the timing record of a stage started with start_timing. The input files
+# (a glob pattern) are used to compute the number of bytes read, the key/value pairs are recorded
+# as the stage parameters.
+function record_timing {
+    stage="$1"
+    inputs="$2"
+    shift 2
+    end_time=`date +%s.%N`
+    wall=`awk -v a=${STAGE_START_TIME} -v b=${end_time} 'BEGIN { printf "%.3f", b - a }'`
+    cpu=`awk -v a=${STAGE_START_CPU} -v b=$(children_cpu_time) 'BEGIN { printf "%.2f", b - a }'`
+    input_bytes=`du -cb --apparent-size ${inputs} 2>/dev/null | tail -n1 | cut -f1`
+    params=""
+    for param in "$@"; do
+        params="${params}${params:+, }\"${param%%=*}\": \"${param#*=}\""
+    done
+    printf '{"time": %s, "obsid": %s, "gps": %s, "stage": "%s", "seconds": 1, "wall": %s, "cpu": %s, "input_bytes": %s, "node": "%s", "ncores": %s, "module": "%s", "params": {%s}}\n' \
+        ${end_time%.*} ${OBSERVATION_ID} ${OBS_GPSTIME} ${stage} ${wall} ${cpu} ${input_bytes:-0} `hostname` ${NCORES} "${LOADEDMODULES}" "${params}" \
+        >> "${TIMINGS_FILE:-${WORK_DIR}/timings.jsonl}"
+}
 
+
+# download_metadata / download_calibration_data
+# Description: get the observation's metafits file and calibration solutions from the shared
+# download cache (see lib/prefetch.py), which only downloads them if they were not prefetched.
 function download_metadata {
-    mkdir -p "${METADATA_DIR}" 
     metadata_file="${METADATA_DIR}/${OBSERVATION_ID}.metafits"
     if [ -e ${metadata_file} ]; then
         echo "Skipping downloading metadata... file already exists."
         return 0
     fi
-    url="http://ws.mwatelescope.org/metadata/fits?obs_id="
-    print_run wget ${url}${OBSERVATION_ID} -O ${metadata_file} 
+    print_run python3 "${SCRIPT_DIR}/prefetch.py" get metadata ${OBSERVATION_ID} "${metadata_file}"
 }
 
 function download_calibration_data {
-    mkdir -p "${CALIBRATION_DIR}"
-    [ -e "${CALIBRATION_DIR}/solutions.zip" ] || \
-        print_run wget "http://ws.mwatelescope.org/calib/get_calfile_for_obsid?obs_id=${OBSERVATION_ID}&zipfile=1&add_request=1" -O "${CALIBRATION_DIR}/solutions.zip"
-    cd "${CALIBRATION_DIR}"
-    [ -e *.bin ] || print_run unzip solutions.zip
-    cd - 
+    if ls ${CALIBRATION_DIR}/*.bin > /dev/null 2>&1; then
+        echo "Skipping downloading calibration data... solutions already exist."
+        return 0
+    fi
+    print_run python3 "${SCRIPT_DIR}/prefetch.py" get calibration ${OBSERVATION_ID} "${CALIBRATION_DIR}"
+}
+
+# prefetch_downloads <obsid> [<obsid> ...]
+# Description: downloads the metadata and calibration solutions of the given observations
+# into the shared cache, concurrently. Run it before submitting the compute jobs.
+function prefetch_downloads {
+    print_run python3 "${SCRIPT_DIR}/prefetch.py" prefetch "$@"
 }
 
 function fix_metadata {
@@ -87,6 +134,24 @@ function fix_metadata {
     print_run python3 "${SCRIPT_DIR}/fix_metafits_time_radec.py" -t ${DUMPS_PER_SECOND} -c 768 -i ${COTTER_TIMERES} -g ${OBS_GPSTIME} -o ${METADATA_DIR} "${original_metadata}"
 }
 
+# fix_metadata_range <start_gpstime> <end_gpstime>
+# Description: writes the metadata files of all the seconds in the given range (inclusive)
+# with a single Python process. Files that already exist are not overwritten, so that
+# subsequent fix_metadata calls for the single seconds are skipped.
+function fix_metadata_range {
+    original_metadata="${METADATA_DIR}/${OBSERVATION_ID}.metafits"
+    print_run python3 "${SCRIPT_DIR}/fix_metafits_time_radec.py" -t ${DUMPS_PER_SECOND} -c 768 -i ${COTTER_TIMERES} -s $1 -e $2 -j 4 --skip-existing -o ${METADATA_DIR} "${original_metadata}"
+}
+
+# complete_seconds <start_gpstime> <end_gpstime>
+# Description: prints the GPS seconds in the given range (inclusive) for which all the coarse
+# channel files are present in OBSERVATIONS_ROOT_DIR. The directory is scanned once and the
+# result kept in an index next to it (see blink-pipeline/obs_index.py), refreshed when files are added.
+OBS_INDEX_SCRIPT=${OBS_INDEX_SCRIPT:-"${SCRIPT_DIR}/../../blink-pipeline/obs_index.py"}
+function complete_seconds {
+    python3 "${OBS_INDEX_SCRIPT}" --list-complete $1 $2 "${OBSERVATIONS_ROOT_DIR}"
+}
+
 # run_correlator <timeres>
 function run_correlator {
     vis_dir="${CURRENT_SECOND_WORK_DIR}/raw_visibilities"
@@ -100,10 +165,12 @@ function run_correlator {
     INPUT_DATA_FILES="${OBSERVATIONS_ROOT_DIR}/${OBSERVATION_ID}_${OBS_GPSTIME}_ch*.dat"
 
     p_start_time=`date +%s`
+    start_timing
     print_run blink-correlator -a 136 -t ${resolution} -c 4 -o ${vis_dir} ${INPUT_DATA_FILES}  
     p_end_time=`date +%s`
     p_elapsed=$((p_end_time-p_start_time))
     echo "Offline correlator took $p_elapsed seconds."
+    record_timing run_correlator "${INPUT_DATA_FILES}" time_res=${resolution}
     cd - 
 }
 
@@ -124,6 +191,7 @@ function run_cotter {
     object="00h36m08.95s -10d34m00.3s"
     echo "Cotter started at" `date +"%s"`
     p_start_time=`date +%s`
+    start_timing
      # -centre 18h33m41.89s -03d39m04.25 -edgewidth=80
      # -flagantenna 25,58,71,80,81,92,101,108,114,119,125
 # 
@@ -131,6 +199,7 @@ function run_cotter {
     p_end_time=`date +%s`
     p_elapsed=$((p_end_time-p_start_time))
     echo "Cotter took $p_elapsed seconds."
+    record_timing run_cotter "${RAW_VISIBILITIES}" time_res=${COTTER_TIMERES}
     cd -
 }
 
@@ -146,12 +215,14 @@ function run_birli {
     # Run contter
     object="00h36m08.95s -10d34m00.3s"
     p_start_time=`date +%s`
+    start_timing
     echo "Birli started at" `date +"%s"`
     # --phase-centre 18h33m41.89s -03d39m04.25s
     print_run ${LAUNCHER} birli --avg-time-res ${COTTER_TIMERES} --avg-freq-res 0.04  --flag-edge-width 0  --no-rfi --apply-di-cal  ${bin_file} --flag-antennas 25,58,71,80,81,92,101,108,114,119,125 -m "${METADATA_DIR}/${UTC_TIMESTAMP}.metafits"  --flag-init 0   --ms-out corrected_visibilities.ms ${RAW_VISIBILITIES}
     p_end_time=`date +%s`
     p_elapsed=$((p_end_time-p_start_time))
     echo "Birli took $p_elapsed seconds."
+    record_timing run_birli "${RAW_VISIBILITIES}" time_res=${COTTER_TIMERES}
     cd -
 }
 
@@ -174,11 +245,13 @@ function run_wsclean {
     mkdir -p "${img_dir}"
     cd "${img_dir}"
     p_start_time=`date +%s`
+    start_timing
 # -intervals-out ${iout}
     print_run ${LAUNCHER} wsclean -name ${output_image_name} -j ${NCORES} -size ${imagesize} ${imagesize}  -pol i -use-idg -idg-mode cpu  -weight ${weighting} -nwlayers 1 -scale $pixscale -niter ${n_iter} ${channels_out} "${CURRENT_SECOND_WORK_DIR}/corrected_visibilities.ms" 
     # print_run ${LAUNCHER} wsclean -name ${output_image_name} -j ${NCORES} -size ${imagesize} ${imagesize}  -pol i -intervals-out ${iout} -gridder wgridder  -weight ${weighting} -scale $pixscale -niter ${n_iter} ${channels_out} "${CURRENT_SECOND_WORK_DIR}/corrected_visibilities.ms" 
     p_end_time=`date +%s`
     p_elapsed=$((p_end_time-p_start_time))
     echo "WSClean took $p_elapsed seconds."
+    record_timing run_wsclean "${CURRENT_SECOND_WORK_DIR}/corrected_visibilities.ms" imagesize=${imagesize} pixscale=${pixscale} weighting=${weighting}
 }
 
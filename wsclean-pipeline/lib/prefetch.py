@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Shared cache of the files downloaded from the MWA web services: the metafits file and the
+calibration solutions of each observation.
+
+Downloads are stored once in a content-addressed cache shared by all the work directories and
+users of the project: `objects/<sha256>` holds the file content and `refs/<kind>/<obsid>.json`
+points to it. Fetching an observation takes a lock on its reference, so that concurrent jobs
+never download the same file twice; the ones arriving later wait and then read the cache.
+
+The `prefetch` command downloads the files of a list of observations with a bounded number of
+concurrent connections and retries, ahead of the compute jobs. The `get` command, used by the
+workflow functions, copies a file from the cache to where the pipeline expects it (extracting the
+calibration solutions), downloading it first only if it was not prefetched.
+
+The cache directory is MWA_DOWNLOAD_CACHE (it should be writable by the project group), and the
+web services URL MWA_WS_URL (see `fake_ws/fake_ws.py` for a local stand-in).
+
+Usage:
+    prefetch.py prefetch [-j 4] [--obsids-file file] <obsids...>
+    prefetch.py get metadata <obsid> <metafits file>
+    prefetch.py get calibration <obsid> <calibration dir>
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import urllib.error
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WS_URL = "http://ws.mwatelescope.org"
+
+DEFAULT_CACHE_DIR = "/scratch/pawsey1154/mwa_download_cache"
+
+# URL paths of the files of an observation, relative to the web services URL.
+KINDS = {
+    'metadata' : "/metadata/fits?obs_id={obsid}",
+    'calibration' : "/calib/get_calfile_for_obsid?obs_id={obsid}&zipfile=1&add_request=1"
+}
+
+
+def ws_url():
+    return os.getenv("MWA_WS_URL", DEFAULT_WS_URL).rstrip('/')
+
+
+def cache_dir():
+    return os.getenv("MWA_DOWNLOAD_CACHE", DEFAULT_CACHE_DIR)
+
+
+
+def check_content(kind : str, path : str):
+    """
+    Raises an exception if a downloaded file is not of the expected type, e.g. when the web
+    services return an error page.
+    """
+    if kind == 'metadata':
+        with open(path, 'rb') as f:
+            if not f.read(6) == b"SIMPLE":
+                raise ValueError("the downloaded metadata is not a FITS file")
+    elif not zipfile.is_zipfile(path):
+        raise ValueError("the downloaded calibration solutions are not a zip file")
+
+
+
+class DownloadCache:
+    def __init__(self, root : str = None, url : str = None, retries : int = 5, backoff : float = 2.0, timeout : float = 120):
+        self.root = root if root is not None else cache_dir()
+        self.url = url if url is not None else ws_url()
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def ref_path(self, kind : str, obsid : int):
+        return os.path.join(self.root, "refs", kind, f"{obsid}.json")
+
+    def object_path(self, digest : str):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def lookup(self, kind : str, obsid : int):
+        """
+        Returns the path of the cached file, or None if it is not in the cache.
+        """
+        try:
+            with open(self.ref_path(kind, obsid)) as f:
+                path = self.object_path(json.load(f)['sha256'])
+        except (OSError, ValueError, KeyError):
+            return None
+        return path if os.path.exists(path) else None
+
+    def download(self, url : str, path : str):
+        """
+        Downloads `url` to `path`, retrying with exponential backoff.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response, open(path, 'wb') as f:
+                    shutil.copyfileobj(response, f, 1 << 20)
+                return
+            except (urllib.error.URLError, OSError) as e:
+                # client errors (e.g. unknown observation) will not go away by retrying
+                if isinstance(e, urllib.error.HTTPError) and e.code < 500:
+                    raise Exception(f"Download of {url} failed: {e}")
+                if attempt == self.retries:
+                    raise Exception(f"Download of {url} failed after {self.retries + 1} attempts: {e}")
+                delay = self.backoff * 2**attempt
+                print(f"Download of {url} failed ({e}), retrying in {delay:.0f} s.", file=sys.stderr)
+                time.sleep(delay)
+
+    def fetch(self, kind : str, obsid : int):
+        """
+        Returns the path of the cached file of the given kind for the observation,
+        downloading it if needed.
+        """
+        path = self.lookup(kind, obsid)
+        if path is not None:
+            return path
+        ref_file = self.ref_path(kind, obsid)
+        os.makedirs(os.path.dirname(ref_file), exist_ok=True)
+        lock = os.open(ref_file + ".lock", os.O_CREAT | os.O_RDWR, 0o666)
+        try:
+            try:
+                # let the other project members take the lock too
+                os.fchmod(lock, 0o666)
+            except OSError:
+                pass
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another process may have downloaded it while we were waiting for the lock
+            path = self.lookup(kind, obsid)
+            if path is not None:
+                return path
+            tmp_file = os.path.join(self.root, f"download.{os.getpid()}.{kind}.{obsid}.tmp")
+            url = self.url + KINDS[kind].format(obsid=obsid)
+            try:
+                self.download(url, tmp_file)
+                check_content(kind, tmp_file)
+                digest = hashlib.sha256()
+                with open(tmp_file, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(block)
+                digest = digest.hexdigest()
+                path = self.object_path(digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # cached files are shared by the project members and never modified
+                os.chmod(tmp_file, 0o444)
+                os.replace(tmp_file, path)
+            finally:
+                if os.path.exists(tmp_file): os.remove(tmp_file)
+            with open(ref_file + ".tmp", 'w') as f:
+                json.dump({'sha256' : digest, 'url' : url, 'size' : os.path.getsize(path), 'time' : int(time.time())}, f)
+            os.replace(ref_file + ".tmp", ref_file)
+        finally:
+            os.close(lock)
+        return path
+
+    def prefetch(self, obsids : list, n_connections : int = 4):
+        """
+        Fetches the files of all the given observations, at most `n_connections` at a time.
+        Returns the list of (kind, obsid, error) of the fetches that failed.
+        """
+        def fetch(key):
+            try:
+                self.fetch(*key)
+                return None
+            except Exception as e:
+                return key + (str(e),)
+        keys = [(kind, obsid) for obsid in obsids for kind in KINDS]
+        with ThreadPoolExecutor(max_workers=n_connections) as executor:
+            return [x for x in executor.map(fetch, keys) if x is not None]
+
+
+
+def place(source : str, destination : str):
+    """
+    Hard links the cached file to its destination, or copies it when on another file system.
+    """
+    tmp_file = f"{destination}.{os.getpid()}.tmp"
+    try:
+        os.link(source, tmp_file)
+    except OSError:
+        shutil.copyfile(source, tmp_file)
+    os.replace(tmp_file, destination)
+
+
+
+def get_metadata(cache : DownloadCache, obsid : int, metafits_file : str):
+    os.makedirs(os.path.dirname(os.path.abspath(metafits_file)), exist_ok=True)
+    place(cache.fetch('metadata', obsid), metafits_file)
+
+
+
+def get_calibration(cache : DownloadCache, obsid : int, calibration_dir : str):
+    """
+    Writes the calibration solutions archive to `calibration_dir/solutions.zip` and extracts it there.
+    """
+    os.makedirs(calibration_dir, exist_ok=True)
+    archive = os.path.join(calibration_dir, "solutions.zip")
+    place(cache.fetch('calibration', obsid), archive)
+    with zipfile.ZipFile(archive) as f:
+        f.extractall(calibration_dir)
+
+
+
+def read_obsids(obsids : list, obsids_file : str = None):
+    obsids = [int(x) for x in obsids]
+    if obsids_file is not None:
+        with open(obsids_file) as f:
+            obsids += [int(x.split()[0]) for x in f if x.strip() and not x.startswith('#')]
+    return sorted(set(obsids))
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared cache of the MWA metadata and calibration downloads.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    prefetch_parser = subparsers.add_parser("prefetch", help="Download the files of the given observations into the cache.")
+    prefetch_parser.add_argument("obsids", nargs='*', help="Observation IDs.")
+    prefetch_parser.add_argument("--obsids-file", type=str, default=None, help="File listing observation IDs, one per line.")
+    prefetch_parser.add_argument("-j", "--connections", type=int, default=4, help="Maximum number of concurrent downloads.")
+    get_parser = subparsers.add_parser("get", help="Copy a file of an observation from the cache, downloading it if needed.")
+    get_parser.add_argument("kind", choices=list(KINDS), help="File to get.")
+    get_parser.add_argument("obsid", type=int, help="Observation ID.")
+    get_parser.add_argument("destination", help="Metafits file, or directory of the calibration solutions.")
+    for p in (prefetch_parser, get_parser):
+        p.add_argument("--retries", type=int, default=5, help="Number of retries of a failed download.")
+    args = parser.parse_args()
+
+    cache = DownloadCache(retries=args.retries)
+    if args.command == "prefetch":
+        obsids = read_obsids(args.obsids, args.obsids_file)
+        failed = cache.prefetch(obsids, args.connections)
+        print(f"Prefetched the files of {len(obsids)} observations into {cache.root}, {len(failed)} failed.")
+        for kind, obsid, error in failed:
+            print(f"{obsid} {kind}: {error}")
+        sys.exit(1 if len(failed) > 0 else 0)
+    elif args.kind == "metadata":
+        get_metadata(cache, args.obsid, args.destination)
+    else:
+        get_calibration(cache, args.obsid, args.destination)
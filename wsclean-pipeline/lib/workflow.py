@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Runs the wsclean pipeline of `mwa-wsclean-workflow.sh` over many seconds of an observation
+as a graph of stages, executing independent stages at the same time.
+
+Each stage is one function of the workflow script, run in its own bash process. The metadata and
+calibration downloads and the metadata fixing run once for all the seconds; then, for each GPS
+second, the correlator, cotter (or birli) and wsclean stages run one after the other. Stages of
+different seconds are independent, so while cotter processes a second the correlator can already
+read the next one and wsclean image the previous one.
+
+Stages are started as long as their CPU cores fit in the budget (by default SLURM_CPUS_PER_TASK,
+NCORES or the number of cores of the machine). I/O bound stages (downloads, reading the voltages)
+take a slot in a separate pool instead, so that they overlap with the CPU bound ones. When several
+stages are ready, those of the earliest second and latest stage go first, so that seconds are
+completed in order rather than all progressing together.
+
+Completed stages are recorded in a manifest (`workflow_manifest.jsonl` in the observation's work
+directory) and skipped when the workflow is run again. The output of each stage goes to
+`<work dir>/<obsid>/<gps>/logs/<stage>.log` (`<work dir>/<obsid>/logs` for the global stages).
+
+Usage:
+    workflow.py --obsid 1276619416 --observations-dir <combined dir> --work-dir <dir> <gps seconds...>
+"""
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKFLOW_SCRIPT = os.path.join(SCRIPT_DIR, "mwa-wsclean-workflow.sh")
+
+# Resources of each stage: number of CPU cores, or 'io' for stages mostly waiting on the
+# network or the file system. The number of cores can be changed with --stage-cpus.
+STAGES = {
+    'download_metadata' : 'io',
+    'download_calibration_data' : 'io',
+    'fix_metadata_range' : 1,
+    'run_correlator' : 'io',
+    'run_cotter' : 8,
+    'run_birli' : 8,
+    'run_wsclean' : 16
+}
+
+# Among the stages ready to run, later ones go first.
+STAGE_ORDER = list(STAGES)
+
+
+class Task:
+    def __init__(self, name : str, stage : str, gps : int, shell_args : list, depends_on : list):
+        self.name = name
+        self.stage = stage
+        self.gps = gps
+        self.shell_args = shell_args
+        self.depends_on = depends_on
+
+
+
+def default_cpu_budget():
+    for variable in ("SLURM_CPUS_PER_TASK", "NCORES"):
+        value = os.getenv(variable)
+        if value:
+            return int(value)
+    return os.cpu_count()
+
+
+
+def build_graph(seconds : list, converter : str, wsclean_args : list):
+    """
+    Returns the list of tasks to process the given GPS seconds, in topological order.
+    """
+    if len(seconds) == 0:
+        return []
+    # the metadata of new seconds must be written if the workflow is run again on a larger range
+    fix_metadata = f"fix_metadata_range_{min(seconds)}_{max(seconds)}"
+    tasks = [
+        Task('download_metadata', 'download_metadata', seconds[0], [], []),
+        Task('download_calibration_data', 'download_calibration_data', seconds[0], [], []),
+        Task(fix_metadata, 'fix_metadata_range', seconds[0], [min(seconds), max(seconds)], ['download_metadata'])
+    ]
+    for gps in seconds:
+        tasks.append(Task(f"{gps}/run_correlator", 'run_correlator', gps, [], []))
+        tasks.append(Task(f"{gps}/{converter}", converter, gps, [],
+            [f"{gps}/run_correlator", fix_metadata, 'download_calibration_data']))
+        tasks.append(Task(f"{gps}/run_wsclean", 'run_wsclean', gps, wsclean_args, [f"{gps}/{converter}"]))
+    return tasks
+
+
+
+def read_manifest(path : str):
+    """
+    Returns the set of names of the tasks recorded as completed in the manifest.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # last line of an interrupted run
+                continue
+            if record.get('status') == 'done':
+                done.add(record['task'])
+            else:
+                done.discard(record['task'])
+    return done
+
+
+
+class WorkflowRunner:
+    def __init__(self, observation_id : int, observations_dir : str, work_dir : str, time_resolution : str,
+            cpu_budget : int, io_slots : int, stage_cpus : dict, dry_run : bool = False):
+        self.observation_id = observation_id
+        self.observations_dir = observations_dir
+        self.work_dir = work_dir
+        self.time_resolution = time_resolution
+        self.cpu_budget = cpu_budget
+        self.io_slots = io_slots
+        self.stage_cpus = stage_cpus
+        self.dry_run = dry_run
+        self.manifest_file = os.path.join(work_dir, str(observation_id), "workflow_manifest.jsonl")
+
+    def cpus(self, task : Task):
+        """
+        Number of cores used by a task, 0 for I/O bound tasks.
+        """
+        cpus = self.stage_cpus[task.stage]
+        return 0 if cpus == 'io' else min(int(cpus), self.cpu_budget)
+
+    def log_file(self, task : Task):
+        if '/' in task.name:
+            return os.path.join(self.work_dir, str(self.observation_id), str(task.gps), "logs", f"{task.stage}.log")
+        return os.path.join(self.work_dir, str(self.observation_id), "logs", f"{task.stage}.log")
+
+    def command(self, task : Task):
+        cpus = max(self.cpus(task), 1)
+        commands = [
+            f". {shlex.quote(WORKFLOW_SCRIPT)}",
+            f"set_observation {self.observation_id} {task.gps}",
+            f"set_time_resolution {shlex.quote(self.time_resolution)}",
+            " ".join([task.stage] + [shlex.quote(str(x)) for x in task.shell_args])
+        ]
+        env = dict(os.environ, OBSERVATIONS_ROOT_DIR=self.observations_dir, WORK_DIR=self.work_dir, NCORES=str(cpus))
+        # concurrent job steps within the allocation, each on its own cores
+        env['LAUNCHER'] = f"srun --exact -n 1 -c {cpus}" if os.getenv("SLURM_JOB_ID") else ""
+        # stop at the first failing command so that the stage is reported as failed
+        return ["bash", "-e", "-c", "\n".join(commands)], env
+
+    def run_task(self, task : Task):
+        command, env = self.command(task)
+        log_file = self.log_file(task)
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        start = time.time()
+        with open(log_file, "a") as log:
+            returncode = subprocess.run(command, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+        return returncode, time.time() - start
+
+    def record(self, task : Task, status : str, elapsed : float):
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+        with open(self.manifest_file, "a") as f:
+            f.write(json.dumps({'task' : task.name, 'stage' : task.stage, 'gps' : task.gps, 'status' : status,
+                'elapsed' : round(elapsed, 3), 'time' : int(time.time())}) + "\n")
+
+    def run(self, tasks : list):
+        """
+        Runs the tasks not completed yet. Returns the list of names of the tasks that failed
+        or could not run because a task they depend on failed.
+        """
+        done = read_manifest(self.manifest_file)
+        pending = [x for x in tasks if x.name not in done]
+        print(f"{len(pending)} of {len(tasks)} stages to run with {self.cpu_budget} cores and {self.io_slots} I/O slots.")
+        if self.dry_run:
+            for task in pending:
+                print(f"{task.name}: {self.command(task)[0][-1].splitlines()[-1]}")
+            return []
+
+        failed = set()
+        running = {}
+        used_cpus, used_io = 0, 0
+        with ThreadPoolExecutor(max_workers=self.cpu_budget + self.io_slots) as executor:
+            while pending or running:
+                # tasks whose dependencies failed will never run
+                for task in [x for x in pending if any(d in failed for d in x.depends_on)]:
+                    print(f"{task.name}: skipped, a stage it depends on failed.")
+                    failed.add(task.name)
+                    pending.remove(task)
+                ready = [x for x in pending if all(d in done for d in x.depends_on)]
+                ready.sort(key=lambda x : (x.gps, -STAGE_ORDER.index(x.stage)))
+                for task in ready:
+                    cpus = self.cpus(task)
+                    if cpus == 0 and used_io >= self.io_slots: continue
+                    if cpus > 0 and used_cpus + cpus > self.cpu_budget: continue
+                    used_cpus += cpus
+                    used_io += cpus == 0
+                    pending.remove(task)
+                    print(f"{task.name}: started.")
+                    running[executor.submit(self.run_task, task)] = task
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    cpus = self.cpus(task)
+                    used_cpus -= cpus
+                    used_io -= cpus == 0
+                    returncode, elapsed = future.result()
+                    if returncode == 0:
+                        done.add(task.name)
+                        self.record(task, 'done', elapsed)
+                        print(f"{task.name}: done in {elapsed:.1f} s.")
+                    else:
+                        failed.add(task.name)
+                        self.record(task, 'failed', elapsed)
+                        print(f"{task.name}: failed with exit code {returncode}, see {self.log_file(task)}")
+        return sorted(failed)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the wsclean pipeline on many seconds in parallel.")
+    parser.add_argument("seconds", type=int, nargs='*', help="GPS seconds to process (none: nothing to do).")
+    parser.add_argument("--obsid", type=int, required=True, help="Observation ID.")
+    parser.add_argument("--observations-dir", type=str, required=True, help="Directory with the combined .dat files.")
+    parser.add_argument("--work-dir", type=str, required=True, help="Top level working directory.")
+    parser.add_argument("--time-res", type=str, default="1s", help="Time resolution (1s, 50ms or 20ms).")
+    parser.add_argument("--converter", type=str, default="cotter", choices=["cotter", "birli"], help="Tool converting the visibilities to a measurement set.")
+    parser.add_argument("--imagesize", type=int, default=1024, help="Image size (side, in pixels).")
+    parser.add_argument("--pixscale", type=float, default=0.006, help="Pixel scale in degrees.")
+    parser.add_argument("--weighting", type=str, default="natural", help="WSClean weighting.")
+    parser.add_argument("--cpus", type=int, default=None, help="Number of cores to use. Default: SLURM_CPUS_PER_TASK, NCORES or all the cores.")
+    parser.add_argument("--io-slots", type=int, default=4, help="Number of I/O bound stages running at the same time.")
+    parser.add_argument("--stage-cpus", type=str, nargs='*', default=[], metavar="STAGE=N",
+        help="Number of cores of a stage, e.g. run_wsclean=32.")
+    parser.add_argument("--dry-run", action='store_true', help="Only print the stages that would run.")
+    args = parser.parse_args()
+
+    stage_cpus = dict(STAGES)
+    for spec in args.stage_cpus:
+        stage, cpus = spec.split('=')
+        if stage not in stage_cpus:
+            raise ValueError(f"Unknown stage: {stage}")
+        stage_cpus[stage] = cpus if cpus == 'io' else int(cpus)
+
+    if len(args.seconds) == 0:
+        print("No seconds to process.")
+        sys.exit(0)
+
+    runner = WorkflowRunner(args.obsid, args.observations_dir, args.work_dir, args.time_res,
+        args.cpus if args.cpus is not None else default_cpu_budget(), args.io_slots, stage_cpus, args.dry_run)
+    tasks = build_graph(sorted(set(args.seconds)), f"run_{args.converter}", [args.imagesize, args.pixscale, args.weighting])
+    failed = runner.run(tasks)
+    if len(failed) > 0:
+        print(f"{len(failed)} stages did not complete: {', '.join(failed)}")
+        sys.exit(1)
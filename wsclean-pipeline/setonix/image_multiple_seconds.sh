@@ -3,11 +3,27 @@
 export OBSERVATION_ID=1342107776 
 export TIME_RESOLUTION="1s"
 
+# Download the metadata and calibration solutions once, before the jobs need them.
+python3 ../lib/prefetch.py prefetch ${OBSERVATION_ID} || exit 1
+
 N_SECONDS=1
 N_SECONDS_PER_BATCH=1
 # Set Observation ID and GPS second to process
 START_GPSTIME=1342107784
 LAST_GPSTIME=$(expr $START_GPSTIME + $N_SECONDS - 1 )
+
+# Set SUBMIT_MODE=fanout to submit all the seconds as a single job array instead (see lib/fanout.py):
+# each task images a batch of seconds on a whole node, several at the same time, and the
+# seconds not completed are submitted again when this script is run again (or drop --no-wait
+# to keep polling the queue and retry them automatically).
+SUBMIT_MODE=${SUBMIT_MODE:-"batches"}
+if [ "${SUBMIT_MODE}" = "fanout" ]; then
+python3 ../lib/fanout.py submit --obsid ${OBSERVATION_ID} --observations-dir ${MYSCRATCH}/${OBSERVATION_ID}/combined \
+    --work-dir ${MYSCRATCH}/${OBSERVATION_ID}_wscleanpipeline --time-res ${TIME_RESOLUTION} \
+    --start-gps ${START_GPSTIME} --end-gps ${LAST_GPSTIME} --no-wait
+exit $?
+fi
+
 while ((START_GPSTIME <= LAST_GPSTIME ));
 do 
 END_GPSTIME=$((START_GPSTIME + N_SECONDS_PER_BATCH - 1))
@@ -26,7 +26,25 @@ WORK_DIR=${MYSCRATCH}/${OBSERVATION_ID}_wscleanpipeline
 START_GPSTIME=${START_GPSTIME:-1276619418}
 END_GPSTIME=${END_GPSTIME:-${START_GPSTIME}}
 
-for CURRENT_GPSTIME in `seq $START_GPSTIME $END_GPSTIME`;
+# By default the seconds are processed one after the other. Set WORKFLOW_ENGINE=dag to process
+# them in parallel with lib/workflow.py, which runs the stages of different seconds at the same
+# time within the allocated cores.
+WORKFLOW_ENGINE=${WORKFLOW_ENGINE:-"serial"}
+
+if [ "${WORKFLOW_ENGINE}" = "dag" ]; then
+# Seconds with missing coarse channels are skipped.
+python3 "${SCRIPT_DIR}/workflow.py" --obsid ${OBSERVATION_ID} --observations-dir ${OBSERVATIONS_ROOT_DIR} \
+    --work-dir ${WORK_DIR} --time-res ${TIME_RESOLUTION} `complete_seconds $START_GPSTIME $END_GPSTIME`
+exit $?
+fi
+
+# Metadata for all the seconds is generated at once.
+set_observation ${OBSERVATION_ID} ${START_GPSTIME}
+download_metadata
+fix_metadata_range ${START_GPSTIME} ${END_GPSTIME}
+
+# Seconds with missing coarse channels are skipped.
+for CURRENT_GPSTIME in `complete_seconds $START_GPSTIME $END_GPSTIME`;
 do
 echo ${CURRENT_GPSTIME}
 set_observation ${OBSERVATION_ID} ${CURRENT_GPSTIME}
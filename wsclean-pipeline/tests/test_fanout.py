@@ -0,0 +1,51 @@
+from fanout import FanoutState, run_fanout
+
+
+def queued(state, seconds, job_id):
+    for gps in seconds:
+        second = state.seconds[str(gps)]
+        second.update(status='queued', job_id=job_id, attempts=second['attempts'] + 1)
+
+
+def test_update_retries_seconds_of_finished_jobs():
+    state = FanoutState.load_or_create(None, [1, 2, 3])
+    queued(state, [1, 2, 3], 100)
+    # the job is still running: nothing changes but the completed seconds
+    state.update({1}, {"100"}, max_retries=1)
+    assert (state.with_status('done'), state.with_status('queued')) == ([1], [2, 3])
+    state.update({1, 2}, set(), max_retries=1)
+    assert (state.with_status('done'), state.with_status('pending')) == ([1, 2], [3])
+    # first retry, then out of retries
+    queued(state, [3], 101)
+    state.update({1, 2}, set(), max_retries=1)
+    assert state.with_status('failed') == [3]
+    assert state.seconds["3"]['attempts'] == 2
+    # a failed second completed late is done
+    state.update({1, 2, 3}, set(), max_retries=1)
+    assert state.with_status('done') == [1, 2, 3]
+
+
+def test_update_no_retries():
+    state = FanoutState.load_or_create(None, [1])
+    queued(state, [1], 100)
+    state.update(set(), set(), max_retries=0)
+    assert state.with_status('failed') == [1]
+
+
+def test_run_fanout_resubmits_until_out_of_retries(tmp_path):
+    path = str(tmp_path / "fanout" / "state.json")
+    state = FanoutState.load_or_create(path, [1, 2, 3, 4])
+    submitted = []
+    def submit(seconds):
+        submitted.append(seconds)
+        return str(len(submitted))
+    # second 4 never completes, second 3 on the first retry
+    completed = lambda: [set(), {1, 2}, {1, 2, 3}, {1, 2, 3}][len(submitted)]
+    failed = run_fanout(state, submit, completed, max_retries=2, poll_interval=0, queue=lambda job_ids: [])
+    assert submitted == [[1, 2, 3, 4], [3, 4], [4]]
+    assert failed == [4]
+    # the state file is kept across runs
+    state = FanoutState.load_or_create(path, [1, 2, 3, 4, 5])
+    assert state.with_status('done') == [1, 2, 3]
+    assert state.with_status('pending') == [5]
+    assert state.seconds["4"]['attempts'] == 3